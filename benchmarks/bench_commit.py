@@ -0,0 +1,110 @@
+"""
+Benchmark: committing a PR's changes with git plumbing on a temporary index
+(git_commit.commit_files) against the porcelain chain create_pull_request
+used before (config x2, status, checkout -b, add ., commit).
+
+Both run in a fresh worktree of a bare clone, as PR jobs do; pushing and
+opening the PR are left out.
+
+    python benchmarks/bench_commit.py --files 2000 --changed 10 --runs 10
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from git_commit import commit_files  # noqa: E402
+from git_ops import run_git  # noqa: E402
+
+IDENTITY = {
+    'GIT_AUTHOR_NAME': 'Bench', 'GIT_AUTHOR_EMAIL': 'bench@example.com',
+    'GIT_COMMITTER_NAME': 'Bench', 'GIT_COMMITTER_EMAIL': 'bench@example.com',
+}
+
+
+def make_repo(root: Path, files: int) -> Path:
+    work = root / 'work'
+    work.mkdir()
+    for i in range(files):
+        path = work / f"pkg{i % 50}" / f"module{i}.py"
+        path.parent.mkdir(exist_ok=True)
+        path.write_text(''.join(f"def function_{i}_{n}(x):\n    return x + {n}\n\n" for n in range(20)))
+    env = dict(os.environ, **IDENTITY)
+    subprocess.run(["git", "init", "-q", "-b", "main"], cwd=work, check=True)
+    subprocess.run(["git", "add", "-A"], cwd=work, check=True)
+    subprocess.run(["git", "commit", "-qm", "init"], cwd=work, check=True, env=env)
+    bare = root / 'repo.git'
+    subprocess.run(["git", "clone", "-q", "--bare", str(work), str(bare)], check=True)
+    return bare
+
+
+def change_files(worktree: Path, changed: int, files: int) -> list:
+    paths = []
+    for i in range(0, files, max(1, files // changed))[:changed]:
+        rel = f"pkg{i % 50}/module{i}.py"
+        with open(worktree / rel, 'a') as f:
+            f.write("\n# changed\n")
+        paths.append(rel)
+    return paths
+
+
+async def porcelain_commit(worktree: Path, branch: str):
+    await run_git("config", "user.name", "Bench", cwd=worktree)
+    await run_git("config", "user.email", "bench@example.com", cwd=worktree)
+    await run_git("status", "--porcelain", cwd=worktree)
+    await run_git("checkout", "-b", branch, cwd=worktree)
+    await run_git("add", ".", cwd=worktree)
+    await run_git("commit", "-m", "Update repository", cwd=worktree)
+
+
+async def plumbing_commit(worktree: Path, base: str, paths: list):
+    await commit_files(worktree, base, paths, "Update repository", IDENTITY)
+
+
+async def run(args):
+    root = Path(tempfile.mkdtemp(prefix='bench-commit-'))
+    try:
+        bare = make_repo(root, args.files)
+        base = (await run_git("rev-parse", "main", cwd=bare)).strip()
+        timings = {'porcelain': [], 'plumbing': []}
+        for run_index in range(args.runs):
+            for engine in timings:
+                worktree = root / f"wt-{engine}-{run_index}"
+                await run_git("worktree", "add", "--detach", str(worktree), base, cwd=bare)
+                paths = change_files(worktree, args.changed, args.files)
+                start = time.perf_counter()
+                if engine == 'porcelain':
+                    await porcelain_commit(worktree, f"bench-{run_index}")
+                else:
+                    await plumbing_commit(worktree, base, paths)
+                timings[engine].append(time.perf_counter() - start)
+                await run_git("worktree", "remove", "--force", str(worktree), cwd=bare)
+
+        print(f"{args.files} files, {args.changed} changed, {args.runs} runs")
+        for engine, values in timings.items():
+            print(f"  {engine:10} median {statistics.median(values) * 1000:8.1f} ms   "
+                  f"min {min(values) * 1000:8.1f} ms")
+        speedup = statistics.median(timings['porcelain']) / statistics.median(timings['plumbing'])
+        print(f"  speedup    {speedup:.1f}x")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=2000)
+    parser.add_argument('--changed', type=int, default=10)
+    parser.add_argument('--runs', type=int, default=10)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Micro-benchmark: FuzzyLineMatcher against the brute-force SequenceMatcher scan
+that EditSectionInstruction used before.
+
+    python benchmarks/bench_edit_section.py --lines 5000 --hunks 5
+"""
+import argparse
+import random
+import sys
+import time
+from difflib import SequenceMatcher
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dsl.edit_section import EditSectionInstruction  # noqa: E402
+from dsl.fuzzy_matcher import FuzzyLineMatcher  # noqa: E402
+
+
+def brute_force_find(lines, patch):
+    """The original EditSectionInstruction.find_in_lines."""
+    non_plus = [p for p in patch if p[0] != '+']
+    if len(non_plus) == 0:
+        return -1, 0
+
+    patch_text = '\n'.join(p[1].strip() for p in non_plus)
+    best_match = -1
+    best_ratio = 0
+
+    for i in range(len(lines) - len(non_plus) + 1):
+        window = '\n'.join(lines[i:i + len(non_plus)]).strip()
+        ratio = SequenceMatcher(None, patch_text, window).ratio()
+        if ratio > best_ratio and ratio >= 0.7:
+            best_ratio = ratio
+            best_match = i
+
+    return best_match, best_ratio
+
+
+WORDS = ['user', 'order', 'total', 'cache', 'index', 'payload', 'result', 'config', 'session', 'buffer',
+         'handler', 'item', 'count', 'offset', 'name', 'path', 'token', 'queue', 'record', 'status']
+
+STATEMENTS = [
+    "    {a}_{b} = {c}.get('{d}', {n})\n",
+    "    if {a} is None or len({b}) > {n}:\n",
+    "        raise ValueError(f\"invalid {a}: {{{b}}}\")\n",
+    "    for {a} in {b}_{c}s[{n}:]:\n",
+    "        {a}.append({b}[{n}] * {c})\n",
+    "    logging.info(\"{a} {b} %s\", {c}_{d})\n",
+    "    return {{'{a}': {b}, '{c}': {n}}}\n",
+    "    {a} += sum({b}.{c} for {b} in {d}_list)\n",
+]
+
+
+def make_file(line_count, rng):
+    lines = []
+    for i in range(line_count):
+        words = {key: rng.choice(WORDS) for key in 'abcd'}
+        if i % 12 == 0:
+            lines.append("def {a}_{b}_{n}({c}, {d}=None):\n".format(n=i, **words))
+        elif i % 12 == 11:
+            lines.append("\n")
+        else:
+            lines.append(rng.choice(STATEMENTS).format(n=rng.randint(0, 999), **words))
+    return lines
+
+
+def make_patch(lines, rng, noise):
+    """An edit-section body around a random spot, with some characters of the context mangled."""
+    start = rng.randint(1, len(lines) - 8)
+    patch = []
+    for line in lines[start:start + 3]:
+        text = line.rstrip('\n')
+        if noise and text:
+            chars = list(text)
+            for _ in range(int(len(chars) * noise)):
+                chars[rng.randrange(len(chars))] = rng.choice('abcxyz')
+            text = ''.join(chars)
+        patch.append(text)
+    patch.append('---' + lines[start + 3].rstrip('\n'))
+    patch.append('+++    total_new = total - 1')
+    patch.extend(line.rstrip('\n') for line in lines[start + 4:start + 6])
+    return '\n'.join(patch)
+
+
+def parse_patches(content):
+    patches = []
+    for line in content.split('\n'):
+        if line.startswith('---'):
+            patches.append(('-', line[3:]))
+        elif line.startswith('+++'):
+            patches.append(('+', line[3:]))
+        else:
+            patches.append((' ', line))
+    return patches
+
+
+def run(line_count, hunk_count, noise, seed):
+    rng = random.Random(seed)
+    lines = make_file(line_count, rng)
+    instruction = EditSectionInstruction()
+    queries = []
+    for _ in range(hunk_count):
+        patches = parse_patches(make_patch(lines, rng, noise))
+        for cluster in instruction.find_change_clusters(patches):
+            queries.extend(instruction.expand_cluster_content(patches, cluster))
+
+    start = time.perf_counter()
+    expected = [brute_force_find(lines, query) for query in queries]
+    brute_force_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matcher = FuzzyLineMatcher(lines)
+    actual = [matcher.find(query) for query in queries]
+    indexed_time = time.perf_counter() - start
+
+    if expected != actual:
+        mismatches = sum(1 for a, b in zip(expected, actual) if a != b)
+        raise SystemExit(f"FuzzyLineMatcher disagrees with the brute-force scan on {mismatches} queries")
+
+    print(f"lines={line_count} hunks={hunk_count} noise={noise} queries={len(queries)}")
+    print(f"  brute force: {brute_force_time:.3f}s")
+    print(f"  indexed:     {indexed_time:.3f}s  "
+          f"(scored {matcher.candidates_evaluated} windows, {brute_force_time / max(indexed_time, 1e-9):.1f}x faster)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, default=2000)
+    parser.add_argument('--hunks', type=int, default=3)
+    parser.add_argument('--noise', type=float, default=0.05, help="fraction of context characters to mangle")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    run(args.lines, args.hunks, args.noise, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+"""
+Benchmark suite: the stages of the summary and pull request pipeline on a
+synthetic repository, each on its own and end to end against a local bare
+remote.
+
+The repository has --files Python files of --lines lines; the edit summary
+has --hunks edit-section blocks spread over --edited files, with --noise of
+each hunk's context characters mangled so the fuzzy matcher has work to do.
+Every stage runs --runs times and is reported as its median time, its
+throughput and its peak Python memory (tracemalloc, in one extra run).
+
+--save-baseline stores the results as JSON. --baseline compares against a
+stored file and exits with status 1 when a stage's time or peak memory is
+over its baseline by more than --tolerance (a fraction) and by more than
+--min-delta seconds or --min-delta-bytes, so that stages taking a few
+milliseconds don't fail on timer noise. Timings only compare on the same
+machine, so record the baseline from the base revision in the same job as
+the comparison rather than keeping one in the repository:
+
+    python benchmarks/bench_pipeline.py --files 500 --lines 200 --hunks 50 --noise 0.05
+    git worktree add /tmp/base origin/main
+    python /tmp/base/benchmarks/bench_pipeline.py --save-baseline /tmp/baseline.json
+    python benchmarks/bench_pipeline.py --baseline /tmp/baseline.json --tolerance 0.25
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from bench_edit_section import make_file, make_patch  # noqa: E402
+
+USER, REPO = 'bench', 'repo'
+GIT_URL = f"https://github.com/{USER}/{REPO}.git"
+IDENTITY = {
+    'GIT_AUTHOR_NAME': 'Bench', 'GIT_AUTHOR_EMAIL': 'bench@example.com',
+    'GIT_COMMITTER_NAME': 'Bench', 'GIT_COMMITTER_EMAIL': 'bench@example.com',
+}
+# Parameters that must match for a baseline to be comparable
+PARAMETERS = ('files', 'lines', 'hunks', 'edited', 'noise', 'seed')
+
+
+def make_remote(root: Path, args, rng: random.Random) -> Dict[str, List[str]]:
+    """Creates the synthetic repository as a bare remote under root; returns each file's lines by path."""
+    work = root / 'work'
+    files = {}
+    for i in range(args.files):
+        path = f"pkg{i % 50}/module{i}.py"
+        files[path] = make_file(args.lines, rng)
+        (work / path).parent.mkdir(parents=True, exist_ok=True)
+        (work / path).write_text(''.join(files[path]))
+    env = dict(os.environ, **IDENTITY)
+    subprocess.run(["git", "init", "-q", "-b", "main"], cwd=work, check=True)
+    subprocess.run(["git", "add", "-A"], cwd=work, check=True)
+    subprocess.run(["git", "commit", "-qm", "init"], cwd=work, check=True, env=env)
+    subprocess.run(["git", "clone", "-q", "--bare", str(work), str(root / 'remote' / f"{REPO}.git")], check=True)
+    shutil.rmtree(work)
+    return files
+
+
+def make_edit_summary(files: Dict[str, List[str]], args, rng: random.Random) -> str:
+    paths = rng.sample(sorted(files), min(args.edited, len(files)))
+    blocks = []
+    for n in range(args.hunks):
+        path = paths[n % len(paths)]
+        patch = make_patch(files[path], rng, args.noise)
+        blocks.append(f"# File /{USER}/{REPO}/{path}::edit-section\n{patch}\n# EndFile /{USER}/{REPO}/{path}\n")
+    return ''.join(blocks)
+
+
+def code2prompt_output(clone_dir: Path, files: Dict[str, List[str]]) -> str:
+    """template.j2 rendered by code2prompt, with the absolute paths process_relative_paths rewrites."""
+    parts = ["# Code summary\n"]
+    parts.extend(f"- {clone_dir}/{path}\n" for path in files)
+    parts.append("\n\n## Files\n\n")
+    for path, lines in files.items():
+        parts.append(f"\n# File {clone_dir}/{path}\n{''.join(lines)}\n# EndFile {clone_dir}/{path}\n")
+    return ''.join(parts)
+
+
+class Suite:
+    def __init__(self, runs: int):
+        self.runs = runs
+        self.results: Dict[str, dict] = {}
+
+    def measure(self, name: str, func: Callable, units: float, unit: str, setup: Callable = None):
+        """Times func (after setup, which is not timed) runs times, then once more under tracemalloc."""
+        times = []
+        for _ in range(self.runs):
+            state = setup() if setup else None
+            start = time.perf_counter()
+            func(state) if setup else func()
+            times.append(time.perf_counter() - start)
+
+        state = setup() if setup else None
+        tracemalloc.start()
+        try:
+            func(state) if setup else func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        seconds = statistics.median(times)
+        self.results[name] = {'seconds': seconds, 'min_seconds': min(times), 'peak_bytes': peak,
+                              'throughput': units / seconds if seconds else 0.0, 'unit': unit}
+        print(f"  {name:24} median {seconds * 1000:9.1f} ms   {units / seconds if seconds else 0:12.1f} {unit}/s"
+              f"   peak {peak / 2 ** 20:8.1f} MiB")
+
+
+def run(args) -> Dict[str, dict]:
+    rng = random.Random(args.seed)
+    root = Path(tempfile.mkdtemp(prefix='bench-pipeline-'))
+    # Clones of https://github.com/bench/... come from the local bare remote
+    gitconfig = root / 'gitconfig'
+    gitconfig.write_text(f'[url "{root / "remote"}/"]\n\tinsteadOf = https://github.com/{USER}/\n')
+    os.environ['GIT_CONFIG_GLOBAL'] = str(gitconfig)
+    os.environ['REPO_BASE_DIR'] = str(root / 'repos')
+    # repo_controller reads its templates and static files relative to the working directory
+    os.chdir(ROOT)
+
+    import repo_controller as rc
+    from dsl.edit_section import EditSectionInstruction
+    from git_commit import commit_files
+    from git_ops import run_git
+    from summarizer import GitTreeSource, render_summary
+
+    loop = asyncio.new_event_loop()
+    try:
+        files = make_remote(root, args, rng)
+        edit_summary = make_edit_summary(files, args, rng)
+        repo_bytes = sum(len(''.join(lines).encode()) for lines in files.values())
+        suite = Suite(args.runs)
+        print(f"files={args.files} lines={args.lines} hunks={args.hunks} edited={args.edited} "
+              f"noise={args.noise} runs={args.runs}")
+
+        # Every stage on its own, against a clone made once
+        repo_path = loop.run_until_complete(rc.get_cached_repo(GIT_URL, 'main', USER, REPO))
+        base_sha = loop.run_until_complete(rc.resolve_branch(repo_path, 'main'))
+
+        suite.measure('render', lambda: ''.join(render_summary(GitTreeSource(repo_path, base_sha), f"/{USER}/{REPO}")),
+                      repo_bytes / 2 ** 20, 'MiB')
+
+        clone_dir = root / 'checkout'
+        raw_output = code2prompt_output(clone_dir, files)
+        suite.measure('process_relative_paths', lambda: rc.process_relative_paths(raw_output, clone_dir, GIT_URL),
+                      len(raw_output) / 2 ** 20, 'MiB')
+
+        suite.measure('parse_summary', lambda: rc.parse_summary(edit_summary, clone_dir, USER, REPO),
+                      len(edit_summary) / 2 ** 20, 'MiB')
+
+        blocks = rc.parse_summary(edit_summary, clone_dir, USER, REPO)
+
+        def edit_sections():
+            for block in blocks:
+                path = block['path'].lstrip('/')
+                EditSectionInstruction().apply(path, block['content'], list(files[path]))
+
+        suite.measure('edit_section', edit_sections, args.hunks, 'hunks')
+
+        worktrees = []
+
+        def fresh_worktree():
+            worktree = root / 'worktrees' / str(len(worktrees))
+            loop.run_until_complete(run_git("worktree", "add", "--detach", str(worktree), base_sha, cwd=repo_path))
+            worktrees.append(worktree)
+            return worktree
+
+        def apply(worktree: Path):
+            return rc.update_repo(rc.parse_summary(edit_summary, worktree, USER, REPO), worktree)
+
+        edited = len({block['path'] for block in blocks})
+        suite.measure('update_repo', apply, edited, 'files', setup=fresh_worktree)
+
+        def applied_worktree():
+            worktree = fresh_worktree()
+            changed = [Path(os.path.relpath(s.path, worktree.resolve())).as_posix() for s in apply(worktree)]
+            return worktree, changed
+
+        suite.measure('commit', lambda state: loop.run_until_complete(
+            commit_files(state[0], base_sha, state[1], "Update repository", IDENTITY)),
+            edited, 'files', setup=applied_worktree)
+
+        # End to end: clone from the remote, summarize, apply the edits in a worktree, commit and push
+        def end_to_end(run_index: int):
+            async def pipeline():
+                shutil.rmtree(rc.REPO_BASE_DIR / USER, ignore_errors=True)
+                rc.forget_repo(rc.cached_repo_path(USER, REPO))
+                path = await rc.get_cached_repo(GIT_URL, 'main', USER, REPO)
+                sha = await rc.resolve_branch(path, 'main')
+                await rc.summarize_repo(path, sha, GIT_URL)
+                async with rc.repo_worktree(path, sha) as worktree:
+                    staged = await asyncio.to_thread(apply, worktree)
+                    changed = [Path(os.path.relpath(s.path, worktree.resolve())).as_posix() for s in staged]
+                    commit_sha = await commit_files(worktree, sha, changed, "Update repository", IDENTITY)
+                    await run_git("push", "origin", f"{commit_sha}:refs/heads/bench-{run_index}", cwd=worktree)
+
+            loop.run_until_complete(pipeline())
+
+        runs = iter(range(args.runs + 1))
+        suite.measure('end_to_end', end_to_end, args.files, 'files', setup=lambda: next(runs))
+        return suite.results
+    finally:
+        loop.close()
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def compare(results: Dict[str, dict], baseline: dict, tolerance: float, min_delta: float,
+            min_delta_bytes: int) -> List[str]:
+    regressions = []
+    for name, result in results.items():
+        expected = baseline['stages'].get(name)
+        if expected is None:
+            continue
+        for key, label, floor in (('seconds', 'time', min_delta), ('peak_bytes', 'peak memory', min_delta_bytes)):
+            if (expected[key] and result[key] > expected[key] * (1 + tolerance)
+                    and result[key] - expected[key] > floor):
+                regressions.append(f"{name}: {label} {result[key] / expected[key]:.2f}x the baseline")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=500)
+    parser.add_argument('--lines', type=int, default=200)
+    parser.add_argument('--hunks', type=int, default=50)
+    parser.add_argument('--edited', type=int, default=20, help="files the hunks are spread over")
+    parser.add_argument('--noise', type=float, default=0.05, help="fraction of context characters to mangle")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--baseline', type=Path, help="fail when a stage regresses against this file")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed regression over the baseline")
+    parser.add_argument('--min-delta', type=float, default=0.002,
+                        help="ignore time regressions of fewer seconds than this")
+    parser.add_argument('--min-delta-bytes', type=int, default=64 * 1024,
+                        help="ignore peak memory regressions of fewer bytes than this")
+    parser.add_argument('--save-baseline', type=Path, help="write the results to this file")
+    args = parser.parse_args()
+    if args.lines < 10:
+        parser.error("--lines must be at least 10")
+
+    parameters = {name: getattr(args, name) for name in PARAMETERS}
+    baseline = None
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        if baseline['parameters'] != parameters:
+            raise SystemExit(f"Baseline was recorded with different parameters: {baseline['parameters']}")
+
+    results = run(args)
+
+    if args.save_baseline:
+        args.save_baseline.write_text(json.dumps({'parameters': parameters, 'stages': results}, indent=2) + '\n')
+        print(f"Baseline written to {args.save_baseline}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance, args.min_delta, args.min_delta_bytes)
+        if regressions:
+            print("Regressions beyond the baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"No stage regressed by more than {args.tolerance:.0%}")
+
+
+if __name__ == '__main__':
+    main()
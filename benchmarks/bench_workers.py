@@ -0,0 +1,148 @@
+"""
+Load test: the server under uvicorn with several worker processes sharing
+one REPO_BASE_DIR, against a synthetic repository in a local bare remote.
+
+For each --workers count a fresh server is started. First --concurrency
+clients request the same uncached repository at once, which must all
+succeed off a single clone. Then --requests GET /repo/files page requests
+(rendered on every request, not cached) run with --concurrency clients,
+and throughput and latency are reported per worker count.
+
+    python benchmarks/bench_workers.py --workers 1 2 4 --requests 400 --concurrency 16
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from bench_pipeline import GIT_URL, REPO, ROOT, USER, make_remote
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(root: Path, workers: int, port: int) -> subprocess.Popen:
+    base_dir = root / f"repos-{workers}"
+    env = dict(os.environ, REPO_BASE_DIR=str(base_dir), GIT_CONFIG_GLOBAL=str(root / 'gitconfig'))
+    return subprocess.Popen([sys.executable, "-m", "uvicorn", "repo_controller:app", "--port", str(port),
+                             "--workers", str(workers), "--log-level", "warning"], cwd=ROOT, env=env)
+
+
+async def wait_until_ready(client: httpx.AsyncClient, server: subprocess.Popen, workers: int):
+    # Every worker must be up, or the first requests only measure the ones that are
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f"Server exited with status {server.returncode}")
+        try:
+            if (await client.get("/cache/stats")).status_code == 200:
+                break
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    await asyncio.sleep(1 + workers * 0.5)
+
+
+async def cold_start(client: httpx.AsyncClient, concurrency: int) -> float:
+    start = time.perf_counter()
+    responses = await asyncio.gather(*(client.get("/repo/manifest", params={'git_url': GIT_URL})
+                                       for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    failed = [r for r in responses if r.status_code != 200]
+    if failed:
+        raise SystemExit(f"{len(failed)} cold requests failed, e.g. {failed[0].status_code}: {failed[0].text}")
+    commits = {r.json()['commit'] for r in responses}
+    if len(commits) != 1:
+        raise SystemExit(f"Cold requests saw different commits: {commits}")
+    return elapsed
+
+
+async def load(client: httpx.AsyncClient, requests: int, concurrency: int, pages: int, page_size: int, seed: int):
+    rng = random.Random(seed)
+    queue = [rng.randint(1, pages) for _ in range(requests)]
+    latencies, errors = [], []
+
+    async def client_loop():
+        while queue:
+            page = queue.pop()
+            start = time.perf_counter()
+            response = await client.get("/repo/files", params={'git_url': GIT_URL, 'page': page,
+                                                               'page_size': page_size, 'line_number': True})
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors.append(response.status_code)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+    return time.perf_counter() - start, latencies, errors
+
+
+async def run_workers(root: Path, workers: int, args) -> float:
+    port = free_port()
+    server = start_server(root, workers, port)
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=120, limits=limits) as client:
+            await wait_until_ready(client, server, workers)
+            cold = await cold_start(client, args.concurrency)
+            clones = [p for p in (root / f"repos-{workers}" / USER).iterdir()]
+            if [p.name for p in clones] != [f"{REPO}.git"]:
+                raise SystemExit(f"Expected one clone, found {clones}")
+
+            pages = max(1, -(-args.files // args.page_size))
+            elapsed, latencies, errors = await load(client, args.requests, args.concurrency, pages,
+                                                    args.page_size, args.seed)
+        latencies.sort()
+        throughput = len(latencies) / elapsed
+        print(f"  workers={workers:<3} cold start {cold * 1000:8.1f} ms   {throughput:8.1f} req/s   "
+              f"p50 {statistics.median(latencies) * 1000:7.1f} ms   "
+              f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:7.1f} ms   errors {len(errors)}")
+        if errors:
+            raise SystemExit(f"{len(errors)} requests failed (statuses {sorted(set(errors))})")
+        return throughput
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--lines', type=int, default=200)
+    parser.add_argument('--page-size', type=int, default=25)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    root = Path(tempfile.mkdtemp(prefix='bench-workers-'))
+    try:
+        # Clones of https://github.com/bench/... come from the local bare remote
+        (root / 'gitconfig').write_text(f'[url "{root / "remote"}/"]\n\tinsteadOf = https://github.com/{USER}/\n')
+        make_remote(root, argparse.Namespace(files=args.files, lines=args.lines), random.Random(args.seed))
+        print(f"files={args.files} lines={args.lines} page_size={args.page_size} requests={args.requests} "
+              f"concurrency={args.concurrency} cpus={os.cpu_count()}")
+        throughputs = {workers: asyncio.run(run_workers(root, workers, args)) for workers in args.workers}
+        first = args.workers[0]
+        for workers in args.workers[1:]:
+            print(f"  {workers} workers: {throughputs[workers] / throughputs[first]:.2f}x the throughput of {first}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
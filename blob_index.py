@@ -0,0 +1,125 @@
+"""
+Per-blob statistics, keyed by git blob SHA.
+
+A blob's content never changes, so anything derived from it (line count,
+token counts, whether it is binary) is computed once and reused for every branch, commit and
+repository that contains the same blob. The index lives in SQLite next to
+the cached clones.
+"""
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from git_objects import TreeEntry, binary_paths, list_tree
+
+# SQLite limits the number of bound parameters per statement
+_BATCH = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blob_lines (
+    sha TEXT PRIMARY KEY,
+    lines INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blob_binary (
+    sha TEXT PRIMARY KEY,
+    binary INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blob_tokens (
+    sha TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    tokenizer TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    PRIMARY KEY (sha, variant, tokenizer)
+);
+"""
+
+
+def _batches(items: List[str]) -> Iterable[List[str]]:
+    for start in range(0, len(items), _BATCH):
+        yield items[start:start + _BATCH]
+
+
+class BlobIndex:
+    """Blocking; every method is safe to call from any thread."""
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    def get_lines(self, shas: Iterable[str]) -> Dict[str, int]:
+        found = {}
+        with self._lock:
+            for batch in _batches(list(set(shas))):
+                marks = ','.join('?' * len(batch))
+                found.update(self._db.execute(f"SELECT sha, lines FROM blob_lines WHERE sha IN ({marks})", batch))
+        return found
+
+    def put_lines(self, rows: Iterable[Tuple[str, int]]):
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO blob_lines (sha, lines) VALUES (?, ?)", rows)
+
+    def get_binary(self, shas: Iterable[str]) -> Dict[str, bool]:
+        found = {}
+        with self._lock:
+            for batch in _batches(list(set(shas))):
+                marks = ','.join('?' * len(batch))
+                found.update((sha, bool(binary)) for sha, binary in self._db.execute(
+                    f"SELECT sha, binary FROM blob_binary WHERE sha IN ({marks})", batch))
+        return found
+
+    def put_binary(self, rows: Iterable[Tuple[str, bool]]):
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO blob_binary (sha, binary) VALUES (?, ?)",
+                                 [(sha, int(binary)) for sha, binary in rows])
+
+    def get_tokens(self, shas: Iterable[str], variant: str, tokenizer: str) -> Dict[str, int]:
+        found = {}
+        with self._lock:
+            for batch in _batches(list(set(shas))):
+                marks = ','.join('?' * len(batch))
+                found.update(self._db.execute(
+                    f"SELECT sha, tokens FROM blob_tokens WHERE variant = ? AND tokenizer = ? AND sha IN ({marks})",
+                    [variant, tokenizer, *batch]))
+        return found
+
+    def put_tokens(self, rows: Iterable[Tuple[str, int]], variant: str, tokenizer: str):
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO blob_tokens (sha, variant, tokenizer, tokens) VALUES (?, ?, ?, ?)",
+                [(sha, variant, tokenizer, tokens) for sha, tokens in rows])
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            lines = self._db.execute("SELECT COUNT(*) FROM blob_lines").fetchone()[0]
+            tokens = self._db.execute("SELECT COUNT(*) FROM blob_tokens").fetchone()[0]
+            binary = self._db.execute("SELECT COUNT(*) FROM blob_binary").fetchone()[0]
+        return {'line_entries': lines, 'token_entries': tokens, 'binary_entries': binary}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def text_entries(git_dir: Path, rev: str, paths: Optional[Sequence[str]] = None,
+                 index: Optional[BlobIndex] = None) -> List[TreeEntry]:
+    """
+    The entries of list_tree that are not binary. Without an index every file is checked; with one,
+    only blobs it has not seen yet are, and their results are added to it.
+    """
+    entries = list_tree(git_dir, rev, paths)
+    if index is None:
+        binary = binary_paths(git_dir, rev, paths)
+        return [e for e in entries if e.path not in binary]
+
+    known = index.get_binary(e.sha for e in entries)
+    unseen = [e for e in entries if e.sha not in known]
+    if unseen:
+        binary = binary_paths(git_dir, rev, [e.path for e in unseen])
+        found = {e.sha: e.path in binary for e in unseen}
+        index.put_binary(found.items())
+        known.update(found)
+    return [e for e in entries if not known[e.sha]]
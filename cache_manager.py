@@ -0,0 +1,257 @@
+import asyncio
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from coordination import FileLock
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS repos (
+    path TEXT PRIMARY KEY,
+    last_access REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS branches (
+    path TEXT NOT NULL,
+    branch TEXT NOT NULL,
+    checked_at REAL NOT NULL,
+    PRIMARY KEY (path, branch)
+);
+"""
+
+
+def directory_size(path: Path) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class RepoCacheEntry:
+    def __init__(self, path: Path, last_access: float, size: int):
+        self.path = path
+        self.last_access = last_access
+        self.size = size
+
+    def to_dict(self) -> dict:
+        return {'path': str(self.path), 'last_access': self.last_access, 'size': self.size}
+
+
+class RepoIndex:
+    """
+    Clone metadata shared by every server process, in SQLite: each clone's
+    size and last access, and when each of its branches was last checked
+    against the remote. Blocking; every method is safe to call from any thread.
+    """
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    def entries(self) -> List[RepoCacheEntry]:
+        with self._lock:
+            rows = self._db.execute("SELECT path, last_access, size FROM repos").fetchall()
+        return [RepoCacheEntry(Path(path), last_access, size) for path, last_access, size in rows]
+
+    def replace_all(self, entries: Iterable[RepoCacheEntry]):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM repos")
+            self._db.executemany("INSERT INTO repos (path, last_access, size) VALUES (?, ?, ?)",
+                                 [(str(e.path), e.last_access, e.size) for e in entries])
+
+    def put(self, entry: RepoCacheEntry):
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO repos (path, last_access, size) VALUES (?, ?, ?)",
+                             (str(entry.path), entry.last_access, entry.size))
+
+    def touch(self, path: Path, now: float):
+        with self._lock, self._db:
+            self._db.execute("UPDATE repos SET last_access = ? WHERE path = ?", (now, str(path)))
+
+    def remove(self, path: Path):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM repos WHERE path = ?", (str(path),))
+            self._db.execute("DELETE FROM branches WHERE path = ?", (str(path),))
+
+    def branch_checked_at(self, path: Path, branch: str) -> Optional[float]:
+        with self._lock:
+            row = self._db.execute("SELECT checked_at FROM branches WHERE path = ? AND branch = ?",
+                                   (str(path), branch)).fetchone()
+        return row[0] if row is not None else None
+
+    def set_branch_checked(self, path: Path, branch: str, checked_at: float):
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO branches (path, branch, checked_at) VALUES (?, ?, ?)",
+                             (str(path), branch, checked_at))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class RepoCacheManager:
+    """
+    Tracks every cached clone under base_dir and evicts them by TTL and total size.
+
+    The index is shared by every server process (see RepoIndex). A clone in
+    use by a request, in any process, holds a shared lock on its lock file
+    under lock_dir, and eviction needs the exclusive lock, so a clone is
+    never evicted while in use and a request for a clone that is being
+    evicted waits for the eviction to finish (and then re-clones). Last
+    access times are also stored as the clone directory's mtime, so the
+    index can be rebuilt from disk.
+    """
+
+    def __init__(self, base_dir: Path, ttl: float, max_bytes: int, index: RepoIndex, lock_dir: Path):
+        self.base_dir = base_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.index = index
+        self.lock_dir = lock_dir
+        self.evictions = 0
+        self._pins: Dict[Path, List[FileLock]] = {}
+        self._evicting: Dict[Path, FileLock] = {}
+        self._lock = threading.Lock()
+
+    def _file_lock(self, path: Path) -> FileLock:
+        return FileLock(self.lock_dir / f"{path.relative_to(self.base_dir)}.lock")
+
+    def rebuild(self):
+        """
+        Indexes the clones already on disk (and removes half-finished ones).
+        Only safe while no other process is using base_dir.
+        """
+        entries = {}
+        if self.base_dir.exists():
+            for user_dir in self.base_dir.iterdir():
+                if user_dir.name.startswith('.') or not user_dir.is_dir():
+                    continue
+                for repo_dir in user_dir.iterdir():
+                    if repo_dir.name.startswith('.'):
+                        # leftovers of clones that never finished
+                        shutil.rmtree(repo_dir, ignore_errors=True)
+                        continue
+                    if (repo_dir / 'HEAD').exists() or (repo_dir / '.git').exists():
+                        entries[repo_dir] = RepoCacheEntry(repo_dir, repo_dir.stat().st_mtime,
+                                                           directory_size(repo_dir))
+        self.index.replace_all(entries.values())
+        logging.info(f"Repository cache: indexed {len(entries)} clones "
+                     f"({sum(e.size for e in entries.values())} bytes)")
+
+    def touch(self, path: Path):
+        """Blocking."""
+        now = time.time()
+        self.index.touch(path, now)
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+
+    def record(self, path: Path):
+        """(Re)measures a clone after it was created or fetched into. Blocking."""
+        self.index.put(RepoCacheEntry(path, time.time(), directory_size(path)))
+
+    def pin(self, path: Path):
+        """Marks a clone as in use until unpin. Blocking (waits out an eviction in another process)."""
+        lock = self._file_lock(path)
+        lock.acquire(shared=True)
+        with self._lock:
+            self._pins.setdefault(path, []).append(lock)
+        self.touch(path)
+
+    def unpin(self, path: Path):
+        with self._lock:
+            locks = self._pins.get(path, [])
+            lock = locks.pop() if locks else None
+            if not locks:
+                self._pins.pop(path, None)
+        if lock is not None:
+            lock.release()
+        self.touch(path)
+
+    @asynccontextmanager
+    async def use(self, path: Path):
+        """Pins a clone for the duration of a request, waiting out an eviction in progress."""
+        lock = self._file_lock(path)
+        await lock.acquire_async(shared=True)
+        with self._lock:
+            self._pins.setdefault(path, []).append(lock)
+        await asyncio.to_thread(self.touch, path)
+        try:
+            yield path
+        finally:
+            await asyncio.to_thread(self.unpin, path)
+
+    def select_victims(self, now: Optional[float] = None) -> List[RepoCacheEntry]:
+        """
+        Expired clones, then least recently used ones until the total fits max_bytes. Clones in use in any
+        process are skipped; the victims stay locked until sweep removes them. Blocking.
+        """
+        now = time.time() if now is None else now
+        entries = self.index.entries()
+        total = sum(e.size for e in entries)
+        victims = []
+        for entry in sorted(entries, key=lambda e: e.last_access):
+            if now - entry.last_access < self.ttl and total <= self.max_bytes:
+                continue
+            with self._lock:
+                if self._pins.get(entry.path) or entry.path in self._evicting:
+                    continue
+                lock = self._file_lock(entry.path)
+                if not lock.acquire(blocking=False):
+                    continue
+                self._evicting[entry.path] = lock
+            victims.append(entry)
+            total -= entry.size
+        return victims
+
+    async def sweep(self, on_evict=None) -> int:
+        victims = await asyncio.to_thread(self.select_victims)
+        for entry in victims:
+            try:
+                logging.info(f"Evicting cached repository {entry.path} ({entry.size} bytes)")
+                await asyncio.to_thread(shutil.rmtree, entry.path, True)
+                await asyncio.to_thread(self.index.remove, entry.path)
+                if on_evict is not None:
+                    on_evict(entry.path)
+                with self._lock:
+                    self.evictions += 1
+            finally:
+                with self._lock:
+                    lock = self._evicting.pop(entry.path)
+                # Anyone waiting to use the clone re-clones it under a new lock file
+                lock.release(unlink=not entry.path.exists())
+        return len(victims)
+
+    async def run_periodically(self, interval: float, on_evict=None):
+        while True:
+            try:
+                await self.sweep(on_evict)
+            except Exception as e:
+                logging.error(f"Repository cache sweep failed: {e}")
+            await asyncio.sleep(interval)
+
+    def stats(self) -> dict:
+        entries = self.index.entries()
+        with self._lock:
+            return {
+                'entries': len(entries),
+                'bytes': sum(e.size for e in entries),
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'pinned': len(self._pins),
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,163 @@
+"""
+Coordination between server processes that share REPO_BASE_DIR.
+
+uvicorn --workers N, or several replicas on one volume, run independent
+processes over the same clones, caches and job store, so in-process locks
+are not enough. Everything here is built on flock(2) lock files, which the
+kernel releases when a process exits, so a crashed worker never leaves a
+lock behind.
+"""
+import asyncio
+import fcntl
+import hashlib
+import os
+import socket
+import uuid
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Callable, Hashable, Optional
+
+from git_ops import KeyedLocks
+
+
+class FileLock:
+    """
+    A shared or exclusive flock on one file. Each instance opens the file
+    itself, so two instances conflict even within one process.
+
+    The holder of an exclusive lock may delete the file (release(unlink=True)).
+    A lock is only taken on the file currently at path, so anyone who opened
+    the deleted file before then tries again on its replacement.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._fd: Optional[int] = None
+
+    @property
+    def locked(self) -> bool:
+        return self._fd is not None
+
+    def acquire(self, shared: bool = False, blocking: bool = True) -> bool:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        except BaseException:
+            os.close(fd)
+            raise
+        if not self._is_current(fd):
+            # Deleted by its previous holder while we waited
+            os.close(fd)
+            return self.acquire(shared, blocking)
+        self._fd = fd
+        return True
+
+    def _is_current(self, fd: int) -> bool:
+        try:
+            return os.path.samestat(os.fstat(fd), os.stat(self.path))
+        except FileNotFoundError:
+            return False
+
+    async def acquire_async(self, shared: bool = False, poll: float = 0.02, max_poll: float = 0.5):
+        """Waits for the lock by polling, so neither the event loop nor a worker thread blocks."""
+        delay = poll
+        while not self.acquire(shared, blocking=False):
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, max_poll)
+
+    def release(self, unlink: bool = False):
+        """Releases the lock; unlink (only for an exclusive lock) deletes the file first."""
+        if self._fd is not None:
+            if unlink:
+                self.path.unlink(missing_ok=True)
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+
+class ProcessLocks:
+    """
+    Exclusive locks by key that hold across processes. Waiters in one
+    process queue on an asyncio.Lock, so only one of them polls the lock
+    file that excludes the other processes. The lock file is deleted when
+    the last waiter in the process is done with it.
+    """
+
+    def __init__(self, lock_dir: Path):
+        self.lock_dir = lock_dir
+        self._local = KeyedLocks()
+
+    def path(self, key: Hashable) -> Path:
+        return self.lock_dir / f"{hashlib.sha1(repr(key).encode()).hexdigest()}.lock"
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable) -> AsyncIterator[None]:
+        async with self._local.hold(key):
+            lock = FileLock(self.path(key))
+            await lock.acquire_async()
+            try:
+                yield
+            finally:
+                # The next waiter in this process would only recreate the file
+                lock.release(unlink=self._local.waiters(key) == 1)
+
+    def is_locked(self, key: Hashable) -> bool:
+        """Whether this process holds (or waits for) the lock."""
+        return self._local.is_locked(key)
+
+
+class WorkerRegistry:
+    """
+    The server processes sharing a directory.
+
+    Every process holds an exclusive lock on its own file for as long as it
+    runs, so a worker ID whose file can be locked belongs to a process that
+    has exited. All of them also hold a shared lock on one instance file;
+    a process that can lock it exclusively is the only one running.
+    """
+
+    def __init__(self, workers_dir: Path):
+        self.workers_dir = workers_dir
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._own = FileLock(self._path(self.worker_id))
+        self._instance = FileLock(workers_dir / 'instance.lock')
+
+    def _path(self, worker_id: str) -> Path:
+        return self.workers_dir / f"{worker_id}.worker"
+
+    def register(self, when_alone: Optional[Callable[[], None]] = None) -> bool:
+        """
+        Registers this process. when_alone (cleanup of what earlier runs left
+        behind) runs only if no other worker is running. Blocking.
+        """
+        self._own.acquire()
+        alone = self._instance.acquire(blocking=False)
+        if alone:
+            try:
+                if when_alone is not None:
+                    when_alone()
+            finally:
+                self._instance.release()
+        self._instance.acquire(shared=True)
+        return alone
+
+    def is_alive(self, worker_id: str) -> bool:
+        if worker_id == self.worker_id:
+            return True
+        probe = FileLock(self._path(worker_id))
+        if not probe.path.exists():
+            return False
+        if not probe.acquire(blocking=False):
+            return True
+        probe.release()
+        probe.path.unlink(missing_ok=True)
+        return False
+
+    def unregister(self):
+        self._instance.release()
+        self._own.release()
+        self._own.path.unlink(missing_ok=True)
@@ -1,9 +1,15 @@
-from difflib import SequenceMatcher
+import logging
+
 from .base import DslInstruction
+from .fuzzy_matcher import FuzzyLineMatcher
+from .line_hint import blob_matches, current_line, parse_line_hint, record_edit
+from metrics import MATCH_CANDIDATES, stage
 
 
 class EditSectionInstruction(DslInstruction):
     MAX_CONTEXT_SIZE = 5
+    # Lines around a hinted line searched (in turn) before the whole file
+    NEAR_RADII = (32, 256)
     """
     Patches parts of a file.
     The format is:
@@ -13,8 +19,23 @@ class EditSectionInstruction(DslInstruction):
     +++    bias = 5
         return bias + x
     # EndFile path/to/file
+
+    An optional hint gives the line of the patch's first context line, and
+    the blob SHA the line number refers to: ::edit-section:120@<blob-sha>.
+    While the file is still that blob, the patch is verified and applied at
+    that line without a search; otherwise the search starts around it.
     """
+    def __init__(self, line=None, blob_sha=None):
+        self.line = line
+        self.blob_sha = blob_sha
+        # Where the hinted line is in the lines being patched, after earlier blocks' edits
+        self.current_line = line
+        # Where each change cluster of the last apply() went: 1-based first line, match score,
+        # and how it was found ('hint', 'near' or 'search')
+        self.matches = []
+
     def apply(self, file_path, content, lines):
+        self.matches = []
         patch_lines = content.split('\n')
 
         patches = []
@@ -27,49 +48,124 @@ class EditSectionInstruction(DslInstruction):
                     patches.append(('+', line[3:]))
             else:
                 patches.append((' ', line))
-        print(patches)
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(f"Edit-section patches for {file_path}: {patches}")
         # split the patch into clusters
         clusters = self.find_change_clusters(patches)
+        # the hinted line is only exact while the file is the blob it was taken from,
+        # and only where earlier blocks' edits can be followed
+        self.current_line = current_line(file_path, self.line) if self.line is not None else None
+        exact = self.current_line is not None and blob_matches(file_path, lines, self.blob_sha)
+        if self.current_line is None:
+            self.current_line = self.line
+        # lines added minus lines removed by the clusters applied so far
+        shift = 0
 
         for cluster in clusters:
-            # find the best match for the patch in the original file
-            best_match = None
-            best_score = -1
-            for content in self.expand_cluster_content(patches, cluster):
-                match_index, match_score = self.find_in_lines(lines, content)
-                if match_score > best_score:
-                    best_match = (match_index, content)
-                    best_score = match_score
-            
-            if best_match is None:
+            found = None
+            with stage('edit_section_match'):
+                if exact:
+                    found = self.verify_at(lines, patches, cluster, shift)
+                if found is None and self.line is not None:
+                    found = self.search_near(lines, patches, cluster, shift)
+                if found is None:
+                    found = self.search(lines, patches, cluster)
+
+            if found is None:
                 raise ValueError("Suitable patch location not found in the file")
-            
+
             # add the patch to the result
-            start_index, content = best_match
+            start_index, content, best_score, method = found
+            self.matches.append({'line': start_index + 1, 'score': round(best_score, 4), 'method': method})
             lines = self.apply_patch(lines, content, start_index)
+            for edit in self.changed_runs(content, start_index):
+                record_edit(file_path, *edit)
+            shift += sum(1 for op, _ in content if op == '+') - sum(1 for op, _ in content if op == '-')
 
         # make sure all lines end with a newline
         lines = [line if line.endswith('\n') else line + '\n' for line in lines]
 
         return lines, "Patch applied successfully"
 
-    def find_in_lines(self, lines, patch):
-        non_plus = [p for p in patch if p[0] != '+']
-        if len(non_plus) == 0:
-            return -1, 0
-        
-        patch_text = '\n'.join(p[1].strip() for p in non_plus)
-        best_match = -1
-        best_ratio = 0
-        
-        for i in range(len(lines) - len(non_plus) + 1):
-            window = '\n'.join(lines[i:i+len(non_plus)]).strip()
-            ratio = SequenceMatcher(None, patch_text, window).ratio()
-            if ratio > best_ratio and ratio >= 0.7:
-                best_ratio = ratio
-                best_match = i
-        
-        return best_match, best_ratio
+    def expected_index(self, patches, start, shift):
+        """Where the hint puts the first non-'+' line of patches[start:], counting from 0."""
+        return self.current_line - 1 + shift + sum(1 for op, _ in patches[:start] if op != '+')
+
+    def changed_runs(self, patch, start_index):
+        """(start, removed, added) of each run of changed lines of a patch applied at start_index."""
+        index = start_index
+        run = None
+        for op, _ in patch + [(' ', None)]:
+            if op == ' ':
+                if run is not None:
+                    yield run
+                    index = run[0] + run[2]
+                    run = None
+                index += 1
+                continue
+            if run is None:
+                run = (index, 0, 0)
+            start, removed, added = run
+            run = (start, removed + (op == '-'), added + (op == '+'))
+
+    def verify_at(self, lines, patches, cluster, shift):
+        """The largest expansion of the cluster whose lines are exactly where the hint says, or None."""
+        best = None
+        for start, content in self.expand_cluster(patches, cluster):
+            # context that reaches into another cluster would apply that cluster's changes too
+            if sum(1 for op, _ in content if op != ' ') != len(cluster[2]):
+                continue
+            index = self.expected_index(patches, start, shift)
+            expected = [line.strip() for op, line in content if op != '+']
+            if index < 0 or index + len(expected) > len(lines):
+                continue
+            if best is not None and len(expected) <= best[1]:
+                continue
+            if all(lines[index + k].strip() == line for k, line in enumerate(expected)):
+                best = (index, len(expected), content)
+        if best is None:
+            return None
+        return best[0], best[2], 1.0, 'hint'
+
+    def search_near(self, lines, patches, cluster, shift):
+        """Searches ever larger ranges of lines around the hinted line, preferring matches closest to it."""
+        expected = self.expected_index(patches, cluster[0], shift)
+        for radius in self.NEAR_RADII:
+            low = max(0, expected - radius)
+            high = min(len(lines), expected + radius + len(cluster[2]) + 2 * self.MAX_CONTEXT_SIZE)
+            found = self.search(lines[low:high], patches, cluster,
+                                lambda start: self.expected_index(patches, start, shift) - low)
+            if found is not None:
+                index, content, score, _ = found
+                return low + index, content, score, 'near'
+            if low == 0 and high == len(lines):
+                break
+        return None
+
+    def search(self, lines, patches, cluster, near=None):
+        """
+        The best fuzzy match of any expansion of the cluster in lines, or None. near maps an expansion's
+        index in patches to the index in lines it is expected at.
+        """
+        # index the lines once and reuse them for every expansion of the cluster
+        matcher = FuzzyLineMatcher(lines)
+        best_match = None
+        best_score = -1
+        for start, content in self.expand_cluster(patches, cluster):
+            match_index, match_score = self.find_in_lines(lines, content, matcher, near(start) if near else None)
+            # an index of -1 means nothing matched well enough
+            if match_index >= 0 and match_score > best_score:
+                best_match = (match_index, content)
+                best_score = match_score
+        MATCH_CANDIDATES.inc(matcher.candidates_evaluated)
+        if best_match is None:
+            return None
+        return best_match[0], best_match[1], best_score, 'search'
+
+    def find_in_lines(self, lines, patch, matcher=None, near=None):
+        if matcher is None:
+            matcher = FuzzyLineMatcher(lines)
+        return matcher.find(patch, near)
 
     def apply_patch(self, lines, patch, start_index):
         result = lines[:start_index]
@@ -89,7 +185,12 @@ class EditSectionInstruction(DslInstruction):
 
     @classmethod
     def parse(cls, args):
-        return cls()
+        # Arguments that are not a line hint were always ignored; summaries written before hints still apply
+        try:
+            return cls(*parse_line_hint(args))
+        except ValueError as e:
+            logging.warning(f"Ignoring edit-section arguments: {e}")
+            return cls()
 
     def find_change_clusters(self, patches):
         clusters = []
@@ -113,18 +214,23 @@ class EditSectionInstruction(DslInstruction):
         return clusters
 
     def expand_cluster_content(self, patches, cluster):
+        for _, content in self.expand_cluster(patches, cluster):
+            yield content
+
+    def expand_cluster(self, patches, cluster):
+        """Yields (index in patches, content) of the cluster and its expansions."""
         cluster_start, cluster_end, cluster_content = cluster
         # keep returning the cluster while also expanding it from up, down and then up AND down
         for i in range(0, self.MAX_CONTEXT_SIZE + 1):
             for j in range(0, self.MAX_CONTEXT_SIZE + 1):
                 if i == 0 and j == 0:
-                    yield cluster_content
+                    yield cluster_start, cluster_content
                     continue
                 new_cluster_start = cluster_start - i
                 new_cluster_end = cluster_end + j
                 if new_cluster_start < 0 or new_cluster_end > len(patches):
                     continue
                 new_cluster_content = patches[new_cluster_start:new_cluster_end]
-                yield new_cluster_content
+                yield new_cluster_start, new_cluster_content
 
 
@@ -0,0 +1,159 @@
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+
+
+class FuzzyLineMatcher:
+    """
+    Finds the window of lines that best matches a patch, scored exactly like
+    SequenceMatcher(None, patch_text, window).ratio().
+
+    The index is built once per file and reused for every lookup:
+    - stripped line -> line numbers, for exact anchors
+    - per-line character counts, for a sliding upper bound on the ratio
+    - character trigrams -> line numbers (built lazily), for fuzzy anchors
+
+    Anchored windows are scored first to get a good best score early, then the
+    remaining windows are scored in order of their upper bound until no bound
+    can beat the best score. The result (location and tie breaking) is the
+    same as scanning every window.
+    """
+    THRESHOLD = 0.7
+    MAX_SEEDS = 8
+    NGRAM_SIZE = 3
+    # Guards the bound comparisons against float rounding
+    EPSILON = 1e-9
+
+    def __init__(self, lines):
+        self.lines = lines
+        self._line_counts = [Counter(line) for line in lines]
+        self._line_lengths = [len(line) for line in lines]
+        self._blank = [not line.strip() for line in lines]
+        self._exact_index = defaultdict(list)
+        for i, line in enumerate(lines):
+            self._exact_index[line.strip()].append(i)
+        self._ngram_index = None
+        self.candidates_evaluated = 0
+
+    def find(self, patch, near=None):
+        """
+        Returns (start_index, ratio) of the best window, or (-1, 0) when nothing reaches THRESHOLD.
+        Equally good windows go to the first one, or with near to the one closest to that index.
+        """
+        non_plus = [p for p in patch if p[0] != '+']
+        if len(non_plus) == 0:
+            return -1, 0
+
+        size = len(non_plus)
+        window_count = len(self.lines) - size + 1
+        if window_count <= 0:
+            return -1, 0
+
+        patch_lines = [p[1].strip() for p in non_plus]
+        patch_text = '\n'.join(patch_lines)
+        patch_counts = Counter(patch_text)
+        patch_length = len(patch_text)
+
+        scores = {}
+        best_match = -1
+        best_ratio = 0
+
+        def score(i):
+            if i not in scores:
+                window = '\n'.join(self.lines[i:i + size]).strip()
+                matcher = SequenceMatcher(None, patch_text, window)
+                cutoff = max(best_ratio, self.THRESHOLD) - self.EPSILON
+                if matcher.real_quick_ratio() < cutoff or matcher.quick_ratio() < cutoff:
+                    return None
+                self.candidates_evaluated += 1
+                scores[i] = matcher.ratio()
+            return scores[i]
+
+        def distance(i):
+            return i if near is None else (abs(i - near), i)
+
+        def consider(i):
+            nonlocal best_match, best_ratio
+            ratio = score(i)
+            if ratio is None or ratio < self.THRESHOLD:
+                return
+            if ratio > best_ratio or (ratio == best_ratio and distance(i) < distance(best_match)):
+                best_match, best_ratio = i, ratio
+
+        for i in self._seed_windows(patch_lines, window_count):
+            consider(i)
+
+        bounds = []
+        window_counts = Counter()
+        for k in range(size):
+            window_counts.update(self._line_counts[k])
+        for i in range(window_count):
+            if i > 0:
+                window_counts.subtract(self._line_counts[i - 1])
+                window_counts.update(self._line_counts[i + size - 1])
+            window_length = self._stripped_length(i, size)
+            # Chars of the raw window (join newlines included) that also occur in the patch
+            common = sum(min(count, window_counts[ch] + (size - 1 if ch == '\n' else 0))
+                         for ch, count in patch_counts.items())
+            common = min(common, patch_length, window_length)
+            total = patch_length + window_length
+            bound = 2.0 * common / total if total else 1.0
+            if bound >= self.THRESHOLD - self.EPSILON:
+                bounds.append((-bound, i))
+
+        # Best-first: once the bound drops below the best score nothing left can win
+        bounds.sort()
+        for negative_bound, i in bounds:
+            if -negative_bound < max(best_ratio, self.THRESHOLD) - self.EPSILON:
+                break
+            consider(i)
+
+        return best_match, best_ratio
+
+    def _stripped_length(self, start, size):
+        """Length of '\\n'.join(lines[start:start + size]).strip() without building it."""
+        end = start + size
+        first = start
+        while first < end and self._blank[first]:
+            first += 1
+        if first == end:
+            return 0
+        last = end - 1
+        while self._blank[last]:
+            last -= 1
+        length = sum(self._line_lengths[first:last + 1]) + (last - first)
+        length -= len(self.lines[first]) - len(self.lines[first].lstrip())
+        length -= len(self.lines[last]) - len(self.lines[last].rstrip())
+        return length
+
+    def _seed_windows(self, patch_lines, window_count):
+        """Window starts voted for by exact (or, failing that, trigram) line anchors, best first."""
+        votes = Counter()
+        for offset, line in enumerate(patch_lines):
+            if not line:
+                continue
+            for i in self._exact_index.get(line, ()):
+                votes[i - offset] += 2
+        if not votes:
+            for offset, line in enumerate(patch_lines):
+                for i in self._similar_lines(line):
+                    votes[i - offset] += 1
+        seeds = [i for i, _ in votes.most_common() if 0 <= i < window_count]
+        return seeds[:self.MAX_SEEDS]
+
+    def _similar_lines(self, line, limit=3):
+        grams = self._ngrams(line)
+        if not grams:
+            return []
+        if self._ngram_index is None:
+            self._ngram_index = defaultdict(list)
+            for i, file_line in enumerate(self.lines):
+                for gram in self._ngrams(file_line.strip()):
+                    self._ngram_index[gram].append(i)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._ngram_index.get(gram, ()))
+        return [i for i, _ in shared.most_common(limit)]
+
+    def _ngrams(self, text):
+        n = self.NGRAM_SIZE
+        return {text[i:i + n] for i in range(len(text) - n + 1)}
@@ -1,13 +1,30 @@
 from .base import DslInstruction
+from .line_hint import blob_matches, current_line, parse_line_hint, record_edit
 
 class InjectAtLineInstruction(DslInstruction):
-    def __init__(self, line_number):
+    def __init__(self, line_number, blob_sha=None):
         self.line_number = line_number
+        # With a blob SHA the line number is only used while the file is still that blob
+        self.blob_sha = blob_sha
 
     def apply(self, file_path, content, lines):
-        lines.insert(self.line_number - 1, content + '\n')
+        if self.blob_sha is not None and not blob_matches(file_path, lines, self.blob_sha):
+            raise ValueError(f"File is no longer blob {self.blob_sha}; not injecting at line {self.line_number}")
+        # The line number refers to the file before earlier blocks changed it
+        line_number = current_line(file_path, self.line_number)
+        if line_number is None:
+            if self.blob_sha is not None:
+                raise ValueError(f"Line {self.line_number} of blob {self.blob_sha} can no longer be located")
+            line_number = self.line_number
+        index = min(line_number - 1, len(lines))
+        injected = (content + '\n').splitlines(keepends=True)
+        lines[index:index] = injected
+        record_edit(file_path, index, 0, len(injected))
         return lines, f"Injected content at line {self.line_number}"
 
     @classmethod
     def parse(cls, arg):
-        return cls(int(arg))
\ No newline at end of file
+        line_number, blob_sha = parse_line_hint(arg)
+        if line_number is None:
+            raise ValueError(f"inject-at-line needs a line number: {arg}")
+        return cls(line_number, blob_sha)
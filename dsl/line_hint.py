@@ -0,0 +1,65 @@
+"""
+Line hints of edit-section and inject-at-line blocks: '<line>[@<blob-sha>]'.
+
+The line comes from a summary rendered with line_number=true, the blob SHA
+(full or abbreviated) from GET /repo/manifest. While the file the changes
+are applied to is still that blob the line can be trusted; once it has
+changed the line is only a starting point.
+
+Line numbers refer to the file as it was before the summary. Earlier blocks
+for the same file record the lines they changed on its StagedFile, and
+current_line() follows a hinted line through those edits.
+"""
+import re
+from typing import Optional, Tuple
+
+from git_objects import blob_sha
+
+HINT_PATTERN = re.compile(r'(\d+)?(?:@([0-9a-fA-F]{7,40}))?')
+
+
+def parse_line_hint(args: str) -> Tuple[Optional[int], Optional[str]]:
+    """The hint's 1-based line and blob SHA, either of which may be missing."""
+    match = HINT_PATTERN.fullmatch(args.strip())
+    if match is None:
+        raise ValueError(f"Invalid line hint: {args}")
+    line, sha = match.groups()
+    if line is not None and int(line) < 1:
+        raise ValueError(f"Line numbers start at 1: {args}")
+    return int(line) if line is not None else None, sha.lower() if sha else None
+
+
+def current_line(file_path, line: int) -> Optional[int]:
+    """
+    Where the 1-based line of the original file is now, after the edits recorded on file_path (a line
+    that was replaced maps to where it was). None when the file was changed without recording its edits.
+    """
+    edits = getattr(file_path, 'line_edits', [])
+    if edits is None:
+        return None
+    index = line - 1
+    for start, removed, added in edits:
+        if index >= start + removed:
+            index += added - removed
+        elif index >= start:
+            index = start
+    return index + 1
+
+
+def record_edit(file_path, start: int, removed: int, added: int):
+    """Records on a StagedFile that lines[start:start + removed] were replaced by added lines."""
+    record = getattr(file_path, 'record_edit', None)
+    if callable(record):
+        record(start, removed, added)
+
+
+def blob_matches(file_path, lines, sha: Optional[str]) -> bool:
+    """
+    Whether the file is still the blob sha: for a StagedFile its content before the transaction
+    (earlier blocks of the same summary may have moved lines since), otherwise the given lines.
+    """
+    if sha is None:
+        return False
+    original_sha = getattr(file_path, 'original_sha', None)
+    current = original_sha() if callable(original_sha) else blob_sha(''.join(lines).encode('utf-8'))
+    return current is not None and current.startswith(sha)
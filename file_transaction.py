@@ -0,0 +1,203 @@
+"""
+Applies a summary's file blocks to a checkout as one transaction.
+
+Blocks are grouped by the file they resolve to. Each file is read at most
+once, every block for it is applied to its lines in memory (in the order the
+blocks were given), and the results are written to temporary files beside
+their targets. Nothing on disk changes until every file has been staged;
+the staged files are then renamed into place, keeping backups of the
+originals so that a failure part way through restores the tree as it was.
+"""
+import io
+import logging
+import os
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from git_objects import blob_sha
+
+
+class ApplyError(Exception):
+    def __init__(self, path: str, error: Exception):
+        self.path = path
+        self.error = error
+        super().__init__(f"Error processing file {path}: {error}")
+
+
+class StagedFile:
+    """
+    In-memory state of one file during a transaction.
+
+    It is handed to DSL instructions in place of the file's Path, so exists()
+    and unlink() act on the staged state; other attributes fall through to
+    the real path. Instructions that change lines in place record where with
+    record_edit(), so that later line hints can be mapped to where their
+    line is now; line_edits is None once that is no longer known.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.lines: Optional[List[str]] = None
+        self.deleted = not path.is_file()
+        self.changed = False
+        self.line_edits: Optional[List[Tuple[int, int, int]]] = []
+
+    def exists(self) -> bool:
+        return not self.deleted
+
+    def unlink(self):
+        if self.deleted:
+            raise FileNotFoundError(f"No such file: {self.path}")
+        self.lines = None
+        self.deleted = True
+        self.changed = True
+        self.line_edits = None
+
+    def read_lines(self) -> List[str]:
+        if self.deleted:
+            raise FileNotFoundError(f"No such file: {self.path}")
+        if self.lines is None:
+            self.lines = self.load()
+        return self.lines
+
+    def load(self) -> List[str]:
+        """The file's original lines."""
+        with open(self.path, 'r') as f:
+            return f.readlines()
+
+    def original_sha(self) -> Optional[str]:
+        """The git blob SHA of the file as it was before the transaction (None if it did not exist)."""
+        try:
+            with open(self.path, 'rb') as f:
+                return blob_sha(f.read())
+        except FileNotFoundError:
+            return None
+
+    def write_lines(self, lines: List[str]):
+        self.lines = list(lines)
+        self.deleted = False
+        self.changed = True
+
+    def write_text(self, text: str):
+        # Split the way reading the written file back would
+        self.write_lines(io.StringIO(text, newline=None).readlines())
+        self.line_edits = None
+
+    def record_edit(self, start: int, removed: int, added: int):
+        """Records that the current lines[start:start + removed] were replaced by added lines."""
+        if self.line_edits is not None:
+            self.line_edits.append((start, removed, added))
+
+    def __getattr__(self, name):
+        return getattr(self.path, name)
+
+    def __fspath__(self) -> str:
+        return str(self.path)
+
+    def __str__(self) -> str:
+        return str(self.path)
+
+
+def stage_blocks(staged: StagedFile, blocks: List[dict]):
+    """Applies a file's blocks (dicts with 'path', 'content' and 'dsl') to its staged state."""
+    for block in blocks:
+        try:
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug(f"Processing file: {staged.path}")
+            dsl_instruction = block['dsl']
+            if dsl_instruction:
+                # Instructions may modify the list they are given even when they do not return it
+                new_lines, message = dsl_instruction.apply(staged, block['content'], list(staged.read_lines()))
+                if new_lines:
+                    staged.write_lines(new_lines)
+            else:
+                staged.write_text(block['content'].strip())
+        except Exception as e:
+            raise ApplyError(block['path'], e) from e
+
+
+class FileTransaction:
+    def __init__(self, resolve: Callable[[str], Path], workers: int = 4):
+        self.resolve = resolve
+        self.workers = workers
+
+    def group(self, blocks: Iterable[dict]) -> Dict[Path, List[dict]]:
+        resolved: Dict[str, Path] = {}
+        groups: Dict[Path, List[dict]] = {}
+        for block in blocks:
+            path = block['path']
+            if path not in resolved:
+                try:
+                    resolved[path] = self.resolve(path)
+                except Exception as e:
+                    raise ApplyError(path, e) from e
+            groups.setdefault(resolved[path], []).append(block)
+        return groups
+
+    def apply(self, blocks: Iterable[dict]) -> List[StagedFile]:
+        """Applies the blocks, in order per file; all or nothing. Returns the files that changed."""
+        groups = self.group(blocks)
+        staged = [StagedFile(path) for path in groups]
+        self._map(lambda s: stage_blocks(s, groups[s.path]), staged)
+        changed = [s for s in staged if s.changed]
+        self.commit(changed)
+        return changed
+
+    def commit(self, changed: List[StagedFile]):
+        token = uuid.uuid4().hex[:12]
+        temps: Dict[Path, Path] = {}
+        replaced: List[Tuple[StagedFile, Optional[Path]]] = []
+
+        def write_temp(staged: StagedFile):
+            staged.path.parent.mkdir(parents=True, exist_ok=True)
+            temp = staged.path.with_name(f".{staged.path.name}.{token}.tmp")
+            temps[staged.path] = temp
+            with open(temp, 'w') as f:
+                f.writelines(staged.lines)
+            if staged.path.is_file():
+                shutil.copymode(staged.path, temp)
+
+        try:
+            self._map(write_temp, [s for s in changed if not s.deleted])
+            for staged in changed:
+                backup = None
+                if staged.path.is_file():
+                    backup = staged.path.with_name(f".{staged.path.name}.{token}.bak")
+                    os.replace(staged.path, backup)
+                replaced.append((staged, backup))
+                if not staged.deleted:
+                    os.replace(temps[staged.path], staged.path)
+                    del temps[staged.path]
+                    if logging.getLogger().isEnabledFor(logging.DEBUG):
+                        logging.debug(f"Updated file: {staged.path}")
+        except Exception:
+            for staged, backup in reversed(replaced):
+                try:
+                    if not staged.deleted:
+                        staged.path.unlink(missing_ok=True)
+                    if backup is not None:
+                        os.replace(backup, staged.path)
+                except OSError as e:
+                    logging.error(f"Could not restore {staged.path}: {e}")
+            raise
+        finally:
+            for temp in temps.values():
+                temp.unlink(missing_ok=True)
+
+        for _, backup in replaced:
+            if backup is not None:
+                backup.unlink(missing_ok=True)
+
+    def _map(self, func, items: list):
+        """Runs func over items on the worker pool, re-raising the first failure in item order."""
+        if len(items) <= 1 or self.workers <= 1:
+            for item in items:
+                func(item)
+            return
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(items))) as pool:
+            futures = [pool.submit(func, item) for item in items]
+            for future in futures:
+                future.result()
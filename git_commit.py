@@ -0,0 +1,62 @@
+"""
+Builds commits with git plumbing, without staging anything in a checkout.
+
+The commit's tree is assembled in a throwaway index file: the parent's tree
+is read into it, the changed files are hashed into the object database and
+recorded with `update-index`, and `write-tree` / `commit-tree` turn it into
+a commit. Commands run in the checkout so its attributes (clean filters,
+line endings) apply as they would for `git add`, but the checkout's own
+index and the repository's refs and config are left untouched.
+"""
+import os
+import shutil
+import stat
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from git_ops import run_git
+
+NULL_SHA = '0' * 40
+
+
+def file_mode(path: Path) -> str:
+    return '100755' if os.stat(path).st_mode & stat.S_IXUSR else '100644'
+
+
+async def commit_files(work_dir: Path, parent: str, changed: List[str], message: str,
+                       identity: Dict[str, str]) -> Optional[str]:
+    """
+    Commits the current state of the changed paths (relative to work_dir; a
+    missing file is a deletion) on top of parent. Returns the new commit's
+    SHA, or None when the result is identical to parent.
+
+    identity holds the GIT_AUTHOR_* / GIT_COMMITTER_* environment variables.
+    """
+    present = [p for p in changed if (work_dir / p).is_file()]
+    deleted = [p for p in changed if not (work_dir / p).is_file()]
+
+    # git refuses an empty index file, so give it a fresh path rather than a mkstemp file
+    index_dir = tempfile.mkdtemp(prefix='txtrepo-index-')
+    env = dict(os.environ, GIT_INDEX_FILE=os.path.join(index_dir, 'index'), **identity)
+    try:
+        await run_git("read-tree", parent, cwd=work_dir, env=env)
+
+        entries = []
+        if present:
+            # One hash-object for every file; it prints one SHA per input path, in order
+            shas = (await run_git("hash-object", "-w", "--stdin-paths", cwd=work_dir, env=env,
+                                  input=''.join(f"{p}\n" for p in present))).split()
+            entries.extend(f"{file_mode(work_dir / p)} {sha}\t{p}" for p, sha in zip(present, shas))
+        entries.extend(f"0 {NULL_SHA}\t{p}" for p in deleted)
+        if entries:
+            await run_git("update-index", "-z", "--index-info", cwd=work_dir, env=env,
+                          input=''.join(f"{e}\0" for e in entries))
+
+        tree = (await run_git("write-tree", cwd=work_dir, env=env)).strip()
+        parent_tree = (await run_git("rev-parse", f"{parent}^{{tree}}", cwd=work_dir)).strip()
+        if tree == parent_tree:
+            return None
+        return (await run_git("commit-tree", tree, "-p", parent, "-m", message, cwd=work_dir, env=env)).strip()
+    finally:
+        shutil.rmtree(index_dir, ignore_errors=True)
@@ -0,0 +1,190 @@
+"""
+Blocking readers for git objects, for code that runs in worker threads.
+
+Reading straight from the object database needs no checkout, and objects
+are immutable, so any number of readers can work on one repository while
+it is being fetched.
+"""
+import hashlib
+import io
+import os
+import subprocess
+from pathlib import Path
+from typing import BinaryIO, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+# The well-known SHA of the empty tree, for diffing a commit against nothing
+EMPTY_TREE = '4b825dc642cb6eb9a060e54bf8d69288fbee4904'
+REGULAR_FILE_MODES = ('100644', '100755')
+# Longer path lists are filtered in Python rather than passed as pathspecs
+MAX_PATHSPECS = 1000
+
+
+class TreeEntry(NamedTuple):
+    path: str
+    mode: str
+    sha: str
+    size: int
+
+
+def blob_sha(data: bytes) -> str:
+    """The SHA git gives a blob with this content (as git hash-object would)."""
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def git(git_dir: Path, *args: str) -> bytes:
+    return subprocess.run(["git", *args], cwd=git_dir, check=True, capture_output=True).stdout
+
+
+def resolve(git_dir: Path, rev: str) -> str:
+    return git(git_dir, "rev-parse", "--verify", f"{rev}^{{commit}}").decode().strip()
+
+
+def _limited(args: List[str], paths: Optional[Sequence[str]]) -> List[str]:
+    """args limited to the given paths, taken literally (no globbing)."""
+    if paths is None or len(paths) > MAX_PATHSPECS:
+        return args
+    return ["--literal-pathspecs", *args, "--", *paths]
+
+
+def _keep(paths: Optional[Sequence[str]]):
+    if paths is None or len(paths) <= MAX_PATHSPECS:
+        return lambda path: True
+    wanted = set(paths)
+    return lambda path: path in wanted
+
+
+def list_tree(git_dir: Path, rev: str, paths: Optional[Sequence[str]] = None) -> List[TreeEntry]:
+    """
+    Regular files in the tree of rev, from `git ls-tree -r -l` (symlinks and submodules are skipped),
+    optionally only those among paths.
+    """
+    if paths is not None and not paths:
+        return []
+    keep = _keep(paths)
+    entries = []
+    for record in git(git_dir, *_limited(["ls-tree", "-r", "-l", "-z", rev], paths)).split(b'\0'):
+        if not record:
+            continue
+        meta, path = record.split(b'\t', 1)
+        mode, kind, sha, size = meta.decode().split()
+        if kind != 'blob' or mode not in REGULAR_FILE_MODES or not keep(os.fsdecode(path)):
+            continue
+        entries.append(TreeEntry(os.fsdecode(path), mode, sha, int(size)))
+    return entries
+
+
+def binary_paths(git_dir: Path, rev: str, paths: Optional[Sequence[str]] = None) -> Set[str]:
+    """Paths git itself considers binary in rev (the same NUL-byte sniffing `git diff` uses)."""
+    if paths is not None and not paths:
+        return set()
+    output = git(git_dir, *_limited(["diff", "--numstat", "-z", "--no-renames", EMPTY_TREE, rev], paths))
+    binary = set()
+    for record in output.split(b'\0'):
+        if record.startswith(b'-\t-\t'):
+            binary.add(os.fsdecode(record[4:]))
+    return binary
+
+
+def last_changed(git_dir: Path, rev: str, max_commits: int) -> Dict[str, int]:
+    """
+    Commit time of the latest change to each path, looking at the newest
+    max_commits commits of rev's history (paths not changed in them are absent).
+    """
+    output = git(git_dir, "log", f"--max-count={max_commits}", "--format=%x01%ct", "--name-only", "-z",
+                 "--no-renames", rev)
+    times: Dict[str, int] = {}
+    for record in output.split(b'\x01')[1:]:
+        # "<time>\0\n<path>\0<path>\0..."
+        fields = record.split(b'\0')
+        timestamp = int(fields[0])
+        names = fields[1:]
+        if names and names[0].startswith(b'\n'):
+            names[0] = names[0][1:]
+        for name in names:
+            path = os.fsdecode(name)
+            if path and path not in times:
+                times[path] = timestamp
+    return times
+
+
+def diff_paths(git_dir: Path, since: str, rev: str) -> Tuple[List[str], List[str]]:
+    """Paths added or modified, and paths deleted, between the commits since and rev."""
+    fields = git(git_dir, "diff", "--name-status", "-z", "--no-renames", since, rev).split(b'\0')
+    changed, deleted = [], []
+    for status, path in zip(fields[0::2], fields[1::2]):
+        (deleted if status == b'D' else changed).append(os.fsdecode(path))
+    return changed, deleted
+
+
+class BlobReader:
+    """
+    Streams blob contents through one long-running `git cat-file --batch`.
+
+    Only one blob can be open at a time; opening the next one (or closing the
+    reader) drains whatever the caller left unread.
+    """
+
+    def __init__(self, git_dir: Path):
+        self.process = subprocess.Popen(["git", "cat-file", "--batch"], cwd=git_dir, stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self._current: Optional[_BlobStream] = None
+
+    def open(self, sha: str) -> BinaryIO:
+        if self._current is not None:
+            self._current.close()
+        self.process.stdin.write(f"{sha}\n".encode())
+        self.process.stdin.flush()
+        header = self.process.stdout.readline().decode().split()
+        if len(header) != 3:
+            raise KeyError(f"Object {sha} not found")
+        self._current = _BlobStream(self.process.stdout, int(header[2]))
+        return io.BufferedReader(self._current)
+
+    def read(self, sha: str) -> bytes:
+        with self.open(sha) as blob:
+            return blob.read()
+
+    def close(self):
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+        if self.process.poll() is None:
+            self.process.stdin.close()
+            self.process.wait()
+        self.process.stdout.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _BlobStream(io.RawIOBase):
+    def __init__(self, stdout, size: int):
+        self.stdout = stdout
+        self.remaining = size
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self.remaining <= 0:
+            return 0
+        data = self.stdout.read(min(len(buffer), self.remaining))
+        if not data:
+            raise EOFError("git cat-file ended mid-blob")
+        buffer[:len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            while self.remaining > 0:
+                data = self.stdout.read(min(self.remaining, 64 * 1024))
+                if not data:
+                    break
+                self.remaining -= len(data)
+            # Every blob in --batch output is followed by a newline
+            self.stdout.read(1)
+        super().close()
@@ -0,0 +1,123 @@
+"""
+Non-blocking process execution and the coordination primitives around it.
+
+Commands run as asyncio subprocesses so a slow clone or fetch never stalls
+the event loop. Asyncio primitives are created lazily, inside the running
+loop, so importing this module never binds them to the wrong loop.
+"""
+import asyncio
+import subprocess
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Union
+
+
+async def run_command(cmd: List[str], cwd: Optional[Union[str, Path]] = None, input: Optional[str] = None,
+                      check: bool = True, env: Optional[Dict[str, str]] = None) -> subprocess.CompletedProcess:
+    """Async equivalent of subprocess.run(cmd, capture_output=True, text=True)."""
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        cwd=str(cwd) if cwd is not None else None,
+        stdin=asyncio.subprocess.PIPE if input is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env=env
+    )
+    try:
+        stdout, stderr = await process.communicate(input.encode() if input is not None else None)
+    except asyncio.CancelledError:
+        if process.returncode is None:
+            process.kill()
+        raise
+    result = subprocess.CompletedProcess(cmd, process.returncode, stdout.decode(errors='replace'),
+                                         stderr.decode(errors='replace'))
+    if check and result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, cmd, result.stdout, result.stderr)
+    return result
+
+
+async def run_git(*args: str, cwd: Optional[Union[str, Path]] = None, input: Optional[str] = None,
+                  env: Optional[Dict[str, str]] = None) -> str:
+    """Runs a git command and returns its stdout, raising CalledProcessError on failure."""
+    result = await run_command(["git", *args], cwd=cwd, input=input, env=env)
+    return result.stdout
+
+
+class KeyedLocks:
+    """
+    One asyncio.Lock per key (e.g. per repository directory). A key's lock
+    only exists while a task holds or waits for it, so keys that come and go
+    (like evicted clones) are not kept forever.
+    """
+
+    def __init__(self):
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        self._users: Dict[Hashable, int] = {}
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable) -> AsyncIterator[None]:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._users[key] = self._users.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._users[key] -= 1
+            if not self._users[key]:
+                del self._users[key]
+                del self._locks[key]
+
+    def waiters(self, key: Hashable) -> int:
+        """The tasks holding or waiting for the key's lock."""
+        return self._users.get(key, 0)
+
+    def is_locked(self, key: Hashable) -> bool:
+        lock = self._locks.get(key)
+        return lock is not None and lock.locked()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one execution.
+
+    Callers that arrive while a call is in flight await the same result (or
+    exception) instead of starting their own. A caller being cancelled does
+    not cancel the shared call.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    async def run(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func())
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(future)
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._inflight
+
+
+class ConcurrencyLimit:
+    """An asyncio.Semaphore created on first use."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        return self._semaphore
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.semaphore.release()
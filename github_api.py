@@ -0,0 +1,68 @@
+"""
+GitHub REST API client for opening pull requests.
+
+One httpx.AsyncClient is shared by every request, so connections to the API
+are pooled and kept alive. The base URL is configurable (GITHUB_API_URL) for
+GitHub Enterprise or a local stand-in server.
+"""
+from typing import Optional
+
+import httpx
+
+API_VERSION = '2022-11-28'
+
+
+class GitHubAPIError(Exception):
+    def __init__(self, status_code: int, message: str):
+        self.status_code = status_code
+        self.message = message
+        super().__init__(f"GitHub API error {status_code}: {message}")
+
+
+def _error_message(response: httpx.Response) -> str:
+    try:
+        body = response.json()
+    except ValueError:
+        return response.text
+    message = body.get('message', response.text)
+    # Validation failures (e.g. "A pull request already exists") carry the detail in errors
+    details = [e.get('message') or e.get('code') for e in body.get('errors', []) if isinstance(e, dict)]
+    return f"{message}: {'; '.join(d for d in details if d)}" if any(details) else message
+
+
+class GitHubClient:
+    def __init__(self, base_url: str, timeout: float = 30.0, max_connections: int = 20):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Created on first use, inside the running event loop
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+                headers={'Accept': 'application/vnd.github+json', 'X-GitHub-Api-Version': API_VERSION}
+            )
+        return self._client
+
+    async def create_pull_request(self, token: str, owner: str, repo: str, head: str, base: str, title: str,
+                                  body: str) -> str:
+        """Opens a pull request and returns its URL."""
+        response = await self.client.post(
+            f"/repos/{owner}/{repo}/pulls",
+            headers={'Authorization': f"Bearer {token}"},
+            json={'title': title, 'head': head, 'base': base, 'body': body}
+        )
+        if response.status_code != 201:
+            raise GitHubAPIError(response.status_code, _error_message(response))
+        return response.json()['html_url']
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,411 @@
+"""
+Persistent background jobs for work that outlives an HTTP request.
+
+Jobs are stored in SQLite, so queued work survives a restart. A fixed
+number of workers claim jobs oldest first; jobs with the same ordering key
+(e.g. the repository they change) never run concurrently and start in the
+order they were submitted, also when several server processes share the
+store. Large payloads are spooled to files beside the database as they are
+produced, rather than held in memory. Secrets and payloads are cleared as
+soon as a job finishes; until then the store's files are readable by their
+owner only.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from metrics import StageTimings, recording
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+# Spooled payloads no job refers to (their request failed) are deleted after this many seconds
+ORPHAN_PAYLOAD_AGE = 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    kind TEXT NOT NULL,
+    ordering_key TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT,
+    params TEXT NOT NULL,
+    payload TEXT,
+    payload_path TEXT,
+    secret TEXT,
+    timings TEXT NOT NULL DEFAULT '{}',
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    worker TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, seq);
+"""
+
+
+class Job:
+    def __init__(self, row: sqlite3.Row):
+        self.id = row['id']
+        self.kind = row['kind']
+        self.ordering_key = row['ordering_key']
+        self.status = row['status']
+        self.stage = row['stage']
+        self.params = json.loads(row['params'])
+        self.payload = json.loads(row['payload']) if row['payload'] is not None else None
+        self.payload_path = row['payload_path']
+        self.secret = row['secret']
+        self.timings = json.loads(row['timings'])
+        self.result = json.loads(row['result']) if row['result'] is not None else None
+        self.error = row['error']
+        self.created_at = row['created_at']
+        self.started_at = row['started_at']
+        self.finished_at = row['finished_at']
+
+    def to_dict(self) -> dict:
+        """The job's public state (never the payload or the secret)."""
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'stage': self.stage,
+            'params': self.params,
+            'timings': self.timings,
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class PayloadSpool:
+    """A job payload written to a file as it is produced: one JSON value per line."""
+
+    def __init__(self, directory: Path):
+        self.path = directory / f"{uuid.uuid4().hex}.ndjson"
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        self._file = os.fdopen(fd, 'w', encoding='utf-8')
+
+    def write(self, item: Any):
+        self._file.write(json.dumps(item, ensure_ascii=False) + '\n')
+
+    def write_all(self, items: Iterable[Any]):
+        for item in items:
+            self.write(item)
+
+    def close(self):
+        self._file.close()
+
+    def discard(self):
+        self._file.close()
+        self.path.unlink(missing_ok=True)
+
+
+def read_payload(path: str) -> Iterator[Any]:
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
+
+
+class JobStore:
+    """Job records in SQLite. Blocking; every method is safe to call from any thread."""
+
+    def __init__(self, path: Path, payload_dir: Optional[Path] = None):
+        _create_private(path)
+        self.payload_dir = payload_dir or path.parent / 'payloads'
+        self.payload_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # Cleared secrets are overwritten with zeros rather than left in free pages
+        self._db.execute("PRAGMA secure_delete=ON")
+        self._db.executescript(_SCHEMA)
+        # Stores created before jobs recorded the process running them, or spooled their payloads
+        columns = {row['name'] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        for column in ('worker', 'payload_path'):
+            if column not in columns:
+                try:
+                    self._db.execute(f"ALTER TABLE jobs ADD COLUMN {column} TEXT")
+                except sqlite3.OperationalError:
+                    pass  # added by another process meanwhile
+        self._lock = threading.Lock()
+
+    def spool(self) -> PayloadSpool:
+        """A new payload file, to pass to create() as payload_path once written and closed."""
+        return PayloadSpool(self.payload_dir)
+
+    def create(self, kind: str, ordering_key: str, params: dict, payload: Any = None,
+               secret: Optional[str] = None, payload_path: Optional[str] = None) -> str:
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, kind, ordering_key, status, params, payload, payload_path, secret, "
+                "created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, ordering_key, QUEUED, json.dumps(params),
+                 json.dumps(payload) if payload is not None else None, payload_path, secret, time.time()))
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return Job(row) if row is not None else None
+
+    def claim(self, worker: Optional[str] = None) -> Optional[Job]:
+        """
+        Marks the oldest queued job whose ordering key has nothing running as running (by worker), and
+        returns it. Safe across processes sharing the store.
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT * FROM jobs WHERE status = ? AND ordering_key NOT IN "
+                    "(SELECT ordering_key FROM jobs WHERE status = ?) ORDER BY seq LIMIT 1",
+                    (QUEUED, RUNNING)).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE jobs SET status = ?, started_at = ?, worker = ? WHERE id = ?",
+                                     (RUNNING, time.time(), worker, row['id']))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        job = Job(row)
+        job.status = RUNNING
+        return job
+
+    def set_stage(self, job_id: str, stage: str, timings: Dict[str, float]):
+        with self._lock:
+            self._db.execute("UPDATE jobs SET stage = ?, timings = ? WHERE id = ? AND status = ?",
+                             (stage, json.dumps(timings), job_id, RUNNING))
+
+    def finish(self, job_id: str, status: str, timings: Dict[str, float], result: Any = None,
+               error: Optional[str] = None):
+        """Records the outcome and drops the payload and secret."""
+        with self._lock:
+            paths = [row[0] for row in self._db.execute("SELECT payload_path FROM jobs WHERE id = ?", (job_id,))]
+            self._db.execute(
+                "UPDATE jobs SET status = ?, stage = NULL, timings = ?, result = ?, error = ?, finished_at = ?, "
+                "payload = NULL, payload_path = NULL, secret = NULL WHERE id = ?",
+                (status, json.dumps(timings), json.dumps(result) if result is not None else None, error,
+                 time.time(), job_id))
+            self._truncate_wal()
+        _remove_payloads(paths)
+
+    def _truncate_wal(self):
+        """Checkpoints and empties the WAL, which still holds the pages with cleared secrets. Caller holds the lock."""
+        try:
+            self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.OperationalError as e:
+            # Readers in other processes can hold it up; the next job's checkpoint catches up
+            logging.debug(f"WAL checkpoint failed: {e}")
+
+    def recover(self, is_alive: Callable[[str], bool] = lambda worker: False) -> int:
+        """
+        Fails jobs left running by processes that have exited (is_alive tells
+        whether a worker still runs). They may have pushed already, so they
+        are not retried; queued jobs are kept and run again.
+        """
+        with self._lock:
+            workers = [row[0] for row in self._db.execute(
+                "SELECT DISTINCT worker FROM jobs WHERE status = ?", (RUNNING,))]
+        gone = [worker for worker in workers if worker is None or not is_alive(worker)]
+        if not gone:
+            return 0
+        marks = ','.join('?' * len(gone))
+        condition = f"status = ? AND (worker IS NULL OR worker IN ({marks}))"
+        arguments = (RUNNING, *[w for w in gone if w])
+        with self._lock:
+            paths = [row[0] for row in self._db.execute(
+                f"SELECT payload_path FROM jobs WHERE {condition}", arguments)]
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ?, payload = NULL, payload_path = NULL, "
+                f"secret = NULL WHERE {condition}",
+                (FAILED, "Interrupted by a server restart", time.time(), *arguments))
+            self._truncate_wal()
+        _remove_payloads(paths)
+        return cursor.rowcount
+
+    def purge(self, older_than: float) -> int:
+        """
+        Deletes finished jobs that finished more than older_than seconds ago, and spooled payloads of
+        requests that never became jobs.
+        """
+        with self._lock:
+            cursor = self._db.execute("DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?",
+                                      (time.time() - older_than,))
+            referenced = {row[0] for row in self._db.execute(
+                "SELECT payload_path FROM jobs WHERE payload_path IS NOT NULL")}
+        # Listed after the query, so a payload spooled meanwhile is too new to be removed
+        cutoff = time.time() - ORPHAN_PAYLOAD_AGE
+        for path in self.payload_dir.glob('*.ndjson'):
+            try:
+                if str(path) not in referenced and path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except FileNotFoundError:
+                pass
+        return cursor.rowcount
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def _remove_payloads(paths: List[Optional[str]]):
+    for path in paths:
+        if path is not None:
+            Path(path).unlink(missing_ok=True)
+
+
+def _create_private(path: Path):
+    """Creates the database (and its directory) readable by this user only, and tightens existing files."""
+    path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    os.chmod(path.parent, 0o700)
+    os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+    # SQLite gives the -wal and -shm files the database file's permissions
+    for suffix in ('', '-wal', '-shm'):
+        try:
+            os.chmod(f"{path}{suffix}", 0o600)
+        except FileNotFoundError:
+            pass
+
+
+class JobTimings(StageTimings):
+    """
+    Stage timings that also keep the job's stored stage and timings current.
+
+    stage() runs on the event loop (or in worker threads), and a write can
+    wait on another process's transaction, so stages are only noted here;
+    one task writes the latest of them to the store from a worker thread.
+    """
+
+    def __init__(self, store: JobStore, job_id: str):
+        super().__init__()
+        self.store = store
+        self.job_id = job_id
+        self._loop = asyncio.get_running_loop()
+        self._latest: Optional[Tuple[str, Dict[str, float]]] = None
+        self._writer: Optional[asyncio.Task] = None
+
+    def started(self, name: str):
+        self._latest = (name, self.rounded())
+        self._loop.call_soon_threadsafe(self._start_writer)
+
+    def _start_writer(self):
+        if self._writer is None or self._writer.done():
+            self._writer = self._loop.create_task(self._write())
+
+    async def _write(self):
+        while self._latest is not None:
+            stage, timings = self._latest
+            self._latest = None
+            try:
+                await asyncio.to_thread(self.store.set_stage, self.job_id, stage, timings)
+            except Exception as e:
+                logging.warning(f"Recording the stage of job {self.job_id} failed: {e}")
+
+    async def flush(self):
+        """Waits for the stages noted so far to be written."""
+        # Lets writers requested from worker threads start first
+        await asyncio.sleep(0)
+        if self._writer is not None:
+            await self._writer
+
+    def rounded(self) -> Dict[str, float]:
+        return {name: round(elapsed, 4) for name, elapsed in self.durations().items()}
+
+
+class JobFailed(Exception):
+    """Raised by a handler to fail its job with a message meant for the client."""
+
+
+class JobQueue:
+    """
+    Runs stored jobs on a fixed number of asyncio workers.
+
+    handlers maps a job kind to an async function taking the Job and
+    returning its (JSON-serializable) result.
+    """
+
+    POLL_INTERVAL = 1.0
+
+    def __init__(self, store: JobStore, handlers: Dict[str, Callable[[Job], Awaitable[Any]]], workers: int,
+                 worker_id: Optional[str] = None):
+        self.store = store
+        self.handlers = handlers
+        self.workers = workers
+        # Recorded on claimed jobs, so other processes can tell whether their runner is still alive
+        self.worker_id = worker_id
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, kind: str, ordering_key: str, params: dict, payload: Any = None,
+                     secret: Optional[str] = None, payload_path: Optional[str] = None) -> str:
+        job_id = await asyncio.to_thread(self.store.create, kind, ordering_key, params, payload, secret,
+                                         payload_path)
+        self._notify()
+        return job_id
+
+    def _notify(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _work(self):
+        while True:
+            job = await asyncio.to_thread(self.store.claim, self.worker_id)
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+            await self._run(job)
+            # The job's ordering key is free again, so a job waiting on it may be runnable
+            self._notify()
+
+    async def _run(self, job: Job):
+        timings = JobTimings(self.store, job.id)
+        status, result, error = FAILED, None, None
+        try:
+            with recording(timings):
+                result = await self.handlers[job.kind](job)
+            status = SUCCEEDED
+        except asyncio.CancelledError:
+            error = "Cancelled by a server shutdown"
+            raise
+        except JobFailed as e:
+            error = str(e)
+        except Exception as e:
+            logging.exception(f"Job {job.id} failed")
+            error = f"Unexpected error: {e}"
+        finally:
+            await timings.flush()
+            await asyncio.to_thread(self.store.finish, job.id, status, timings.rounded(), result, error)
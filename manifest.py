@@ -0,0 +1,64 @@
+"""
+File manifests of a commit, for clients that fetch a large repository in pages.
+
+Paths, blob SHAs and sizes come straight from `git ls-tree -l`. Line counts
+need the blob's content, so each is counted once and kept in the blob index
+under the blob's SHA.
+"""
+from pathlib import Path
+from typing import Dict, List
+
+from blob_index import BlobIndex
+from git_objects import BlobReader, TreeEntry
+
+
+def count_lines(blob) -> int:
+    """Lines in a binary stream, counting a last line without a trailing newline."""
+    lines = 0
+    last = b'\n'
+    while True:
+        data = blob.read(64 * 1024)
+        if not data:
+            break
+        lines += data.count(b'\n')
+        last = data[-1:]
+    return lines + (last != b'\n')
+
+
+def line_counts(git_dir: Path, entries: List[TreeEntry], index: BlobIndex) -> Dict[str, int]:
+    """Line count of each entry's blob, by SHA; blobs missing from the index are counted and added."""
+    counts = index.get_lines(e.sha for e in entries)
+    missing = sorted({e.sha for e in entries} - counts.keys())
+    if missing:
+        counted = {}
+        with BlobReader(git_dir) as reader:
+            for sha in missing:
+                with reader.open(sha) as blob:
+                    counted[sha] = count_lines(blob)
+        index.put_lines(counted.items())
+        counts.update(counted)
+    return counts
+
+
+def build_manifest(git_dir: Path, base: str, entries: List[TreeEntry], index: BlobIndex) -> List[dict]:
+    counts = line_counts(git_dir, entries, index)
+    return [{'path': f"{base}/{e.path}", 'sha': e.sha, 'size': e.size, 'lines': counts[e.sha]} for e in entries]
+
+
+def page_paths(entries: List[TreeEntry], page: int, page_size: int) -> List[str]:
+    """Repo-relative paths on the given (1-based) page."""
+    start = (page - 1) * page_size
+    return [e.path for e in entries[start:start + page_size]]
+
+
+def strip_base(path: str, base: str) -> str:
+    """
+    The repo-relative path of a manifest path (/user/repo/...); repo-relative paths are returned as they are.
+    Raises ValueError for paths git would not take as a path in the tree (empty, '.' or '..' segments).
+    """
+    if path.startswith(base + '/'):
+        path = path[len(base) + 1:]
+    path = path.lstrip('/')
+    if '\0' in path or any(part in ('', '.', '..') for part in path.split('/')):
+        raise ValueError(f"Invalid path: {path}")
+    return path
@@ -0,0 +1,245 @@
+"""
+Minimal in-process metrics, exposed in the Prometheus text format.
+
+Counters and histograms are kept in memory and rendered on demand by
+GET /metrics; gauges are read from a callback at scrape time. stage() times a
+block of work into the stage histogram and into the StageTimings being
+recorded in the current context: a request's (returned as a Server-Timing
+header by ServerTimingMiddleware) or a background job's.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket..., sum, count]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted((key, list(state)) for key, state in self._values.items())
+        lines = []
+        for key, state in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {state[-1]}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{labels} {state[-1]}")
+        return lines
+
+
+class Gauge(Metric):
+    """A gauge whose values (one per label set) are read from a callback at scrape time."""
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...],
+                 collect: Callable[[], Iterable[Tuple[Tuple[str, ...], float]]]):
+        super().__init__(name, help, labelnames)
+        self.collect = collect
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in self.collect()]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'txtrepo_stage_duration_seconds', 'Time spent in each pipeline stage.', ('stage',)))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'txtrepo_http_request_duration_seconds', 'Time to the start of the response, per route.',
+    ('method', 'route', 'status')))
+SUMMARY_CACHE_REQUESTS = REGISTRY.register(Counter(
+    'txtrepo_summary_cache_requests_total', 'Summary requests, by whether the summary cache had them.',
+    ('result',)))
+SUMMARY_BYTES = REGISTRY.register(Counter(
+    'txtrepo_summary_bytes_total', 'Bytes of summary text rendered (cache misses only).'))
+FILES_PATCHED = REGISTRY.register(Counter(
+    'txtrepo_files_patched_total', 'Files written or deleted by pull request jobs.'))
+MATCH_CANDIDATES = REGISTRY.register(Counter(
+    'txtrepo_edit_section_candidates_total', 'Candidate windows scored while locating edit-section patches.'))
+
+
+class StageTimings:
+    """The stages a request or job went through, in the order they finished."""
+
+    def __init__(self):
+        self.timings: List[Tuple[str, float]] = []
+
+    def started(self, name: str):
+        pass
+
+    def finished(self, name: str, elapsed: float):
+        self.timings.append((name, elapsed))
+
+    def durations(self) -> Dict[str, float]:
+        """Seconds per stage; repeated stages are summed."""
+        durations: Dict[str, float] = {}
+        for name, elapsed in self.timings:
+            durations[name] = durations.get(name, 0) + elapsed
+        return durations
+
+
+_recorder: ContextVar[Optional[StageTimings]] = ContextVar('stage_timings', default=None)
+
+
+@contextmanager
+def recording(timings: StageTimings):
+    """Records the stages timed in this context (and the tasks and threads it starts) into timings."""
+    token = _recorder.set(timings)
+    try:
+        yield timings
+    finally:
+        _recorder.reset(token)
+
+
+@contextmanager
+def stage(name: str):
+    """Times the block into the stage histogram and the StageTimings being recorded, if any."""
+    recorder = _recorder.get()
+    if recorder is not None:
+        recorder.started(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        if recorder is not None:
+            recorder.finished(name, elapsed)
+
+
+def server_timing(timings: StageTimings, total: float) -> str:
+    durations = timings.durations()
+    durations['total'] = total
+    return ', '.join(f"{name};dur={elapsed * 1000:.1f}" for name, elapsed in durations.items())
+
+
+class ServerTimingMiddleware:
+    """ASGI middleware adding a Server-Timing header (with the stages timed so far) to every response."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        timings = StageTimings()
+        start = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message['type'] == 'http.response.start':
+                total = time.perf_counter() - start
+                headers = list(message.get('headers', []))
+                headers.append((b'server-timing', server_timing(timings, total).encode('latin-1')))
+                message = dict(message, headers=headers)
+                route = getattr(scope.get('route'), 'path', None) or 'other'
+                REQUEST_SECONDS.observe(total, method=scope['method'], route=route, status=str(message['status']))
+            await send(message)
+
+        with recording(timings):
+            await self.app(scope, receive, send_with_timing)
@@ -0,0 +1,157 @@
+"""
+Dry runs of a summary's file blocks against a commit, entirely in memory.
+
+Each file's original content comes from its blob in the bare clone, the
+blocks are applied to it through the same DSL instructions and staging as a
+real pull request (file_transaction), and the result is compared with the
+original as a unified diff. Nothing is written to disk, so any number of
+previews can run against one clone at the same time.
+"""
+import difflib
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from file_transaction import ApplyError, FileTransaction, StagedFile, stage_blocks
+from git_objects import BlobReader, list_tree
+
+
+class Overlay:
+    """
+    The files of one commit, rooted at a directory that is never created.
+
+    Blocks resolve to paths under root (with the same checks as a real
+    worktree); those paths are then looked up in the commit's tree.
+    """
+
+    def __init__(self, git_dir: Path, rev: str, root: Path):
+        self.git_dir = git_dir
+        self.rev = rev
+        self.root = root
+        self._blobs: Dict[str, str] = {}
+        self._reader: Optional[BlobReader] = None
+        self._lock = threading.Lock()
+
+    def relative(self, path: Path) -> str:
+        relative = os.path.relpath(path, self.root.resolve())
+        if relative.startswith('..'):
+            raise ValueError(f"Invalid file path: {path}")
+        return Path(relative).as_posix()
+
+    def load_blobs(self, paths: List[Path]):
+        """Looks up the blob of each path that exists in the commit (one ls-tree for all of them)."""
+        relative = [self.relative(path) for path in paths]
+        self._blobs = {entry.path: entry.sha for entry in list_tree(self.git_dir, self.rev, relative)}
+
+    def open(self, path: Path) -> 'OverlayFile':
+        return OverlayFile(path, self.relative(path), self)
+
+    def read(self, sha: str) -> bytes:
+        # One cat-file process serves every file of the preview, one blob at a time
+        with self._lock:
+            if self._reader is None:
+                self._reader = BlobReader(self.git_dir)
+            return self._reader.read(sha)
+
+    def close(self):
+        with self._lock:
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+
+
+class OverlayFile(StagedFile):
+    """A StagedFile whose original content is a blob of the overlay's commit."""
+
+    def __init__(self, path: Path, relative: str, overlay: Overlay):
+        self.path = path
+        self.relative = relative
+        self.overlay = overlay
+        self.sha = overlay._blobs.get(relative)
+        self.lines: Optional[List[str]] = None
+        self.deleted = self.sha is None
+        self.changed = False
+        self.line_edits: Optional[List[Tuple[int, int, int]]] = []
+        self._original: Optional[List[str]] = None
+
+    def load(self) -> List[str]:
+        return list(self.original())
+
+    def original_sha(self) -> Optional[str]:
+        return self.sha
+
+    def original(self) -> List[str]:
+        if self.sha is None:
+            return []
+        if self._original is None:
+            data = self.overlay.read(self.sha)
+            # Decoded as open(path, 'r') would read the checked-out file
+            self._original = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8', errors='replace').readlines()
+        return self._original
+
+
+def unified_diff(original: List[str], lines: List[str], relative: str, existed: bool, deleted: bool) -> str:
+    diff = difflib.unified_diff(original, lines,
+                                fromfile=f"a/{relative}" if existed else '/dev/null',
+                                tofile='/dev/null' if deleted else f"b/{relative}")
+    return ''.join(_terminated(diff))
+
+
+def _terminated(diff: Iterator[str]) -> Iterator[str]:
+    for line in diff:
+        if line.endswith('\n'):
+            yield line
+        else:
+            yield line + '\n'
+            yield '\\ No newline at end of file\n'
+
+
+def file_status(staged: OverlayFile) -> str:
+    if not staged.changed:
+        return 'unchanged'
+    if staged.deleted:
+        return 'deleted' if staged.sha is not None else 'unchanged'
+    if staged.sha is None:
+        return 'added'
+    return 'modified' if staged.lines != staged.original() else 'unchanged'
+
+
+def preview_blocks(overlay: Overlay, resolve: Callable[[str], Path], blocks: List[dict], base: str,
+                   workers: int = 4) -> List[dict]:
+    """
+    Applies blocks (as from parse_file_blocks) to the overlay. Returns one result per file, in the order
+    the files first appear: its status, unified diff, error (if a block failed) and the blocks' match
+    locations. A failing file does not stop the others.
+    """
+    groups = FileTransaction(resolve).group(blocks)
+    overlay.load_blobs(list(groups))
+
+    def preview(path: Path) -> dict:
+        staged = overlay.open(path)
+        error = None
+        try:
+            stage_blocks(staged, groups[path])
+        except ApplyError as e:
+            error = str(e.error)
+        status = 'failed' if error is not None else file_status(staged)
+        diff = ''
+        if status not in ('unchanged', 'failed'):
+            diff = unified_diff(staged.original(), [] if staged.deleted else staged.lines, staged.relative,
+                                staged.sha is not None, staged.deleted)
+        return {
+            'path': f"{base}/{staged.relative}",
+            'status': status,
+            'diff': diff,
+            'error': error,
+            'blocks': [{'command': block['command'][2:] if block['command'] else None,
+                        'matches': getattr(block['dsl'], 'matches', None)} for block in groups[path]]
+        }
+
+    paths = list(groups)
+    if len(paths) <= 1 or workers <= 1:
+        return [preview(path) for path in paths]
+    with ThreadPoolExecutor(max_workers=min(workers, len(paths))) as pool:
+        return list(pool.map(preview, paths))
@@ -4,6 +4,26 @@ from dotenv import load_dotenv
 load_dotenv()
 from dsl.factory import DslInstructionFactory
 from dsl.base import DslInstruction
+from summary_cache import SummaryCache, normalize_patterns
+from file_transaction import ApplyError, FileTransaction, StagedFile
+from git_commit import commit_files
+from github_api import GitHubAPIError, GitHubClient
+from summarizer import GitTreeSource, friendly_base, render_summary, select_paths
+from git_objects import diff_paths
+from blob_index import BlobIndex
+from overlay import Overlay, preview_blocks
+from manifest import build_manifest, page_paths, strip_base
+from token_budget import STRATEGIES, BudgetPlan, Tokenizer, candidate_entries, default_tokenizer_name, plan_summary
+from summary_parser import FileBlock, aiter_file_blocks, iter_file_blocks, split_lines
+from git_ops import ConcurrencyLimit, SingleFlight, run_command, run_git
+from cache_manager import RepoCacheManager, RepoIndex
+from coordination import ProcessLocks, WorkerRegistry
+from job_queue import Job, JobFailed, JobQueue, JobStore, PayloadSpool, read_payload
+from metrics import (CONTENT_TYPE, FILES_PATCHED, REGISTRY, SUMMARY_BYTES, SUMMARY_CACHE_REQUESTS, Gauge,
+                     ServerTimingMiddleware, stage)
+import gzip
+import hashlib
+import json
 import os
 import subprocess
 import tempfile
@@ -11,16 +31,19 @@ import sys
 import re
 from pathlib import Path
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
-from fastapi import FastAPI, HTTPException, BackgroundTasks, Query
-from pydantic import BaseModel
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Query, Request
+from pydantic import BaseModel, Field
 import shutil
 import time
+import uuid
 import asyncio
-from typing import Dict, Any, List, Optional
+from contextlib import asynccontextmanager
+from typing import Dict, Any, AsyncIterator, Iterable, Iterator, List, NamedTuple, Optional, Tuple
 import logging
 
 app = FastAPI()
+app.add_middleware(ServerTimingMiddleware)
 # Mount the static files directory
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -32,10 +55,71 @@ async def root():
     return HTMLResponse(content=content)
 
 
-# Cache to store cloned repositories
-repo_cache: Dict[str, Dict[str, Any]] = {}
 CACHE_EXPIRATION = int(os.getenv('CACHE_EXPIRATION', 3600))
 REPO_BASE_DIR = Path(os.getenv('REPO_BASE_DIR', '/tmp/repos'))
+# Cloned repositories are evicted when unused for CACHE_EXPIRATION seconds or,
+# least recently used first, when together they exceed REPO_CACHE_MAX_BYTES
+REPO_CACHE_MAX_BYTES = int(os.getenv('REPO_CACHE_MAX_BYTES', 20 * 1024 * 1024 * 1024))
+CACHE_SWEEP_INTERVAL = float(os.getenv('CACHE_SWEEP_INTERVAL', 300))
+# Server processes sharing REPO_BASE_DIR (uvicorn --workers, replicas on one volume) coordinate
+# through lock files under LOCK_DIR and a shared index of the cached clones
+LOCK_DIR = REPO_BASE_DIR / '.locks'
+repo_cache = RepoCacheManager(REPO_BASE_DIR, CACHE_EXPIRATION, REPO_CACHE_MAX_BYTES,
+                              RepoIndex(REPO_BASE_DIR / '.repo_index' / 'repos.sqlite3'), LOCK_DIR / 'repos')
+worker_registry = WorkerRegistry(LOCK_DIR / 'workers')
+# Each repo is cached as a bare clone at REPO_BASE_DIR/user/repo.git; PR jobs
+# get their own short-lived worktree under WORKTREE_BASE_DIR
+WORKTREE_BASE_DIR = REPO_BASE_DIR / '.worktrees'
+
+# Rendered summaries, keyed by repo, commit SHA and options
+SUMMARY_CACHE_MEMORY_BYTES = int(os.getenv('SUMMARY_CACHE_MEMORY_BYTES', 256 * 1024 * 1024))
+SUMMARY_CACHE_DISK_BYTES = int(os.getenv('SUMMARY_CACHE_DISK_BYTES', 2 * 1024 * 1024 * 1024))
+summary_cache = SummaryCache(REPO_BASE_DIR / '.summary_cache', SUMMARY_CACHE_MEMORY_BYTES, SUMMARY_CACHE_DISK_BYTES)
+# 'native' renders summaries in-process, 'code2prompt' shells out to the CLI
+SUMMARY_ENGINE = os.getenv('SUMMARY_ENGINE', 'native')
+with open('template.j2', 'rb') as template_file:
+    TEMPLATE_DIGEST = hashlib.sha256(template_file.read()).hexdigest()
+
+# Worktree bookkeeping runs under that repo's lock; concurrent fetches of
+# the same repo and branch are coalesced into one
+MAX_CONCURRENT_CLONES = int(os.getenv('MAX_CONCURRENT_CLONES', 4))
+# Clone modes: CLONE_DEPTH > 0 makes shallow clones, CLONE_FILTER (e.g. 'blob:none')
+# makes partial clones, CLONE_SINGLE_BRANCH only clones the requested branch
+CLONE_DEPTH = int(os.getenv('CLONE_DEPTH', 0))
+CLONE_FILTER = os.getenv('CLONE_FILTER', '')
+CLONE_SINGLE_BRANCH = os.getenv('CLONE_SINGLE_BRANCH', 'false').lower() in ('1', 'true', 'yes')
+# A branch checked against the remote less than FETCH_TTL seconds ago is used as is
+FETCH_TTL = float(os.getenv('FETCH_TTL', 0))
+# Worker threads for applying a PR's changes to independent files in parallel
+APPLY_WORKERS = int(os.getenv('APPLY_WORKERS', 4))
+# POST /repo runs as a background job: JOB_WORKERS jobs run at once (one at a
+# time per repo), and finished jobs are kept for JOB_RETENTION seconds
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 4))
+JOB_RETENTION = float(os.getenv('JOB_RETENTION', 7 * 24 * 3600))
+JOB_DB_PATH = REPO_BASE_DIR / '.jobs' / 'jobs.sqlite3'
+job_queue: Optional[JobQueue] = None
+# Token counts per blob (for max_tokens budgets) are kept in BLOB_INDEX_PATH; SUMMARY_TOKENIZER
+# is a tiktoken encoding name, or 'heuristic' (the default when tiktoken is not installed)
+BLOB_INDEX_PATH = REPO_BASE_DIR / '.blob_index' / 'blobs.sqlite3'
+summary_tokenizer = Tokenizer(os.getenv('SUMMARY_TOKENIZER') or default_tokenizer_name())
+blob_index: Optional[BlobIndex] = None
+# POST /repo/batch summarizes up to BATCH_CONCURRENCY of its (at most BATCH_MAX_REPOS) repositories at once
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', 8))
+BATCH_MAX_REPOS = int(os.getenv('BATCH_MAX_REPOS', 100))
+# Largest page GET /repo/files renders
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', 1000))
+# Pull requests are opened through the GitHub REST API (or a compatible server at GITHUB_API_URL)
+GITHUB_API_URL = os.getenv('GITHUB_API_URL', 'https://api.github.com')
+github = GitHubClient(GITHUB_API_URL)
+COMMIT_IDENTITY = {
+    'GIT_AUTHOR_NAME': 'GitHub Actions',
+    'GIT_AUTHOR_EMAIL': 'actions@github.com',
+    'GIT_COMMITTER_NAME': 'GitHub Actions',
+    'GIT_COMMITTER_EMAIL': 'actions@github.com',
+}
+repo_locks = ProcessLocks(LOCK_DIR / 'git')
+git_flights = SingleFlight()
+clone_slots = ConcurrencyLimit(MAX_CONCURRENT_CLONES)
 
 
 
@@ -57,10 +141,40 @@ def extract_repo_info(git_url: str) -> tuple:
     return None, None
 
 
-def clone_repo(git_url: str, clone_dir: Path):
+async def clone_repo(git_url: str, clone_dir: Path, branch: str):
+    # One process clones; the others wait for it and use its clone
+    async with repo_locks.hold(('clone', clone_dir)):
+        if not (clone_dir / 'HEAD').exists():
+            await clone_repo_locked(git_url, clone_dir, branch)
+
+
+async def clone_repo_locked(git_url: str, clone_dir: Path, branch: str):
+    # Clone next to the final location and rename, so a failed clone never looks like a cached repo
+    tmp_dir = clone_dir.with_name(f".{clone_dir.name}.cloning")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    clone_dir.parent.mkdir(parents=True, exist_ok=True)
+    cmd = ["clone", "--bare"]
+    if CLONE_DEPTH > 0:
+        cmd.extend(["--depth", str(CLONE_DEPTH)])
+    if CLONE_FILTER:
+        cmd.append(f"--filter={CLONE_FILTER}")
+    if CLONE_SINGLE_BRANCH:
+        cmd.extend(["--single-branch", "--branch", branch])
+    elif CLONE_DEPTH > 0:
+        # --depth implies --single-branch unless told otherwise
+        cmd.append("--no-single-branch")
     try:
-        subprocess.run(["git", "clone", git_url, str(clone_dir)], check=True, capture_output=True, text=True)
+        async with clone_slots:
+            with stage('clone'):
+                await run_git(*cmd, git_url, str(tmp_dir))
+        # Mirror remote branches onto local ones so later fetches can update them in place
+        await run_git("config", "remote.origin.fetch", "+refs/heads/*:refs/heads/*", cwd=tmp_dir)
+        shutil.rmtree(clone_dir, ignore_errors=True)
+        tmp_dir.rename(clone_dir)
+        await asyncio.to_thread(repo_cache.index.set_branch_checked, clone_dir, branch, time.time())
+        await asyncio.to_thread(repo_cache.record, clone_dir)
     except subprocess.CalledProcessError as e:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
         raise HTTPException(status_code=400, detail=f"Error cloning repository: {e.stderr}")
 
 
@@ -90,7 +204,69 @@ async def run_code2prompt(clone_dir: Path, git_url: str, filter_patterns: Option
         raise HTTPException(status_code=500, detail=f"Error running code2prompt: {stderr.decode()}")
 
     output = stdout.decode()
-    return process_relative_paths(output, clone_dir, git_url)
+    with stage('process_relative_paths'):
+        return process_relative_paths(output, clone_dir, git_url)
+
+
+def render_native_summary(repo_path: Path, commit_sha: str, git_url: str, filter_patterns: Optional[str] = None,
+                          exclude_patterns: Optional[str] = None, case_sensitive: bool = False,
+                          suppress_comments: bool = False, line_number: bool = False,
+                          paths: Optional[List[str]] = None) -> Iterator[str]:
+    user, repo = extract_repo_info(git_url)
+    return render_summary(GitTreeSource(repo_path, commit_sha, paths, blob_index), friendly_base(user, repo), filter_patterns,
+                          exclude_patterns, case_sensitive, suppress_comments, line_number)
+
+
+async def summarize_repo(repo_path: Path, commit_sha: str, git_url: str, filter_patterns: Optional[str] = None,
+                         exclude_patterns: Optional[str] = None, case_sensitive: bool = False,
+                         suppress_comments: bool = False, line_number: bool = False,
+                         paths: Optional[List[str]] = None) -> str:
+    """Renders the summary of commit_sha, or of only the given paths of it (always with the native engine)."""
+    if SUMMARY_ENGINE == 'code2prompt' and paths is None:
+        # code2prompt needs files on disk
+        async with repo_worktree(repo_path, commit_sha) as worktree:
+            with stage('code2prompt'):
+                return await run_code2prompt(worktree, git_url, filter_patterns, exclude_patterns, case_sensitive,
+                                             suppress_comments, line_number)
+    chunks = render_native_summary(repo_path, commit_sha, git_url, filter_patterns, exclude_patterns,
+                                   case_sensitive, suppress_comments, line_number, paths)
+    with stage('render'):
+        return await asyncio.to_thread(''.join, chunks)
+
+
+def stream_summary_json(chunks: Iterator[str], cache_key: str, repo_path: Path,
+                        extra: Optional[Dict[str, Any]] = None) -> Iterator[bytes]:
+    """
+    Streams chunks as a {"summary": ..., **extra} JSON document (the same bytes summary_document makes),
+    writing the document through to the summary cache. The caller pins repo_path before handing the
+    stream to a response; the stream unpins it when done.
+    """
+    def document() -> Iterator[bytes]:
+        yield b'{"summary": "'
+        for chunk in chunks:
+            SUMMARY_BYTES.inc(len(chunk.encode('utf-8')))
+            yield json.dumps(chunk, ensure_ascii=False)[1:-1].encode('utf-8')
+        yield b'"'
+        for name, value in (extra or {}).items():
+            yield f", {json.dumps(name)}: {json.dumps(value, ensure_ascii=False)}".encode('utf-8')
+        yield b'}'
+
+    try:
+        writer = summary_cache.writer(cache_key)
+        try:
+            with stage('render'):
+                for data in document():
+                    writer.write(data)
+                    yield data
+            writer.commit()
+        finally:
+            writer.discard()
+    finally:
+        repo_cache.unpin(repo_path)
+
+
+def summary_document(summary: str, extra: Dict[str, Any]) -> bytes:
+    return json.dumps({"summary": summary, **extra}, ensure_ascii=False).encode('utf-8')
 
 
 def process_relative_paths(output: str, base_path: Path, git_url: str) -> str:
@@ -112,18 +288,16 @@ def process_relative_paths(output: str, base_path: Path, git_url: str) -> str:
 
 
 def parse_summary(summary: str, repo_path: Path, user: Optional[str] = None, repo: Optional[str] = None):
-    file_pattern = re.compile(r'# File (.*?)(::.*?)?\n(.*?)# EndFile \1', re.DOTALL)
-    files = []
-    last_end = 0
+    return parse_file_blocks(iter_file_blocks(split_lines(summary)), repo_path, user, repo)
 
-    for match in file_pattern.finditer(summary):
-        if match.start() < last_end:
-            continue  # Skip nested matches
 
-        path = match.group(1).strip()
-        command = match.group(2) and match.group(2).strip()
-        content = match.group(3).strip()
-        last_end = match.end()
+def parse_file_blocks(blocks: Iterable[FileBlock], repo_path: Path, user: Optional[str] = None,
+                      repo: Optional[str] = None):
+    files = []
+    for block in blocks:
+        path = block.path
+        command = block.command
+        content = block.content
 
         # Remove repo path from path (repo_path is of type Path)
         if path.startswith(str(repo_path)):
@@ -131,10 +305,13 @@ def parse_summary(summary: str, repo_path: Path, user: Optional[str] = None, rep
         elif user and repo and path.startswith(f"/{user}/{repo}"):
             path = path[len(f"/{user}/{repo}"):]
 
-        # Parse the DSL instructions
-        dsl_instructions = parse_dsl(command[2:] if command else "")
+        # Parse the DSL instructions; a malformed argument fails like a block that does not apply
+        try:
+            dsl_instructions = parse_dsl(command[2:] if command else "")
+        except ValueError as e:
+            raise ApplyError(path, e) from e
 
-        files.append({'path': path, 'content': content, 'dsl': dsl_instructions, 'pathAndCommand': str(path)+str(command if command else '')})
+        files.append({'path': path, 'content': content, 'dsl': dsl_instructions, 'command': command, 'pathAndCommand': str(path)+str(command if command else '')})
 
     return files
 
@@ -154,143 +331,193 @@ def get_safe_path(repo_path: Path, file_path: str) -> Path:
     else:
         full_path = Path(normalized_path).resolve()
 
-    # Check if the resolved path starts with any parent of repo_path
-    repo_parents = [repo_path] + list(repo_path.parents)
-    if not any(str(full_path).startswith(str(parent)) for parent in repo_parents):
+    # The resolved path (symlinks followed) must be inside the repo itself
+    if not full_path.is_relative_to(repo_path.resolve()):
         logging.warning(f"Attempted to access path outside repo: {full_path}")
         raise HTTPException(status_code=400, detail=f"Invalid file path: {file_path}")
 
-    logging.info(f"repo_path: {repo_path}")
-    logging.info(f"file_path: {file_path}")
-    logging.info(f"normalized_path: {normalized_path}")
-    logging.info(f"full_path: {full_path}")
-    logging.info(f"repo_parents: {repo_parents}")
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(f"repo_path: {repo_path}")
+        logging.debug(f"file_path: {file_path}")
+        logging.debug(f"normalized_path: {normalized_path}")
+        logging.debug(f"full_path: {full_path}")
 
     return full_path
 
 
-def update_repo(files: list, repo_path: Path):
-    sorted_files = sorted(files, key=lambda x: x['pathAndCommand'], reverse=True)  # this prevents
+# A block's path and command with a line hint, e.g. 'src/app.py::inject-at-line:12@3f1c2a9e'
+LINE_HINTED_COMMAND = re.compile(r'(.*::[a-z-]+:)(\d+)')
 
-    for file in sorted_files:
-        path = file['path']
-        content = file['content']
-        dsl_instruction = file['dsl']
 
-        try:
-            file_path = get_safe_path(repo_path, path)
-            logging.info(f"Processing file: {file_path}")
-
-            if dsl_instruction:
-                with open(file_path, 'r') as f:
-                    lines = f.readlines()
-                new_lines, message = dsl_instruction.apply(file_path, content, lines)
-                if new_lines:
-                    with open(file_path, 'w') as f:
-                        f.writelines(new_lines)
-            else:
-                file_path.parent.mkdir(parents=True, exist_ok=True)
-                with open(file_path, 'w') as f:
-                    f.write(content.strip())
-                logging.info(f"Updated file: {file_path}")
-        except Exception as e:
-            logging.error(f"Error processing file {path}: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Error processing file {path}: {str(e)}")
+def apply_order(files: list) -> list:
+    # Blocks with a line hint go bottom-up within their file and command, so a block never moves the
+    # lines that the hints of the blocks after it point at
+    def key(file):
+        match = LINE_HINTED_COMMAND.match(file['pathAndCommand'])
+        if match:
+            return match.group(1), int(match.group(2))
+        return file['pathAndCommand'], 0
+
+    return sorted(files, key=key, reverse=True)
+
 
+def update_repo(files: list, repo_path: Path) -> List[StagedFile]:
+    sorted_files = apply_order(files)
 
-def create_pull_request(repo_path: Path, github_token: str, source_branch: str, pr_branch: Optional[str] = None, pr_title: Optional[str] = None, pr_description: Optional[str] = None):
+    # All blocks for a file are applied in memory and written once; any failure leaves the tree untouched
+    transaction = FileTransaction(lambda path: get_safe_path(repo_path, path), workers=APPLY_WORKERS)
     try:
-        # Set up Git configuration
-        subprocess.run(["git", "config", "user.name", "GitHub Actions"], cwd=repo_path, check=True, capture_output=True,
-                       text=True)
-        subprocess.run(["git", "config", "user.email", "actions@github.com"], cwd=repo_path, check=True,
-                       capture_output=True, text=True)
-
-        # Check if there are any changes
-        status_output = subprocess.check_output(["git", "status", "--porcelain"], cwd=repo_path, text=True)
-        if not status_output.strip():
+        with stage('apply'):
+            changed = transaction.apply(sorted_files)
+        FILES_PATCHED.inc(len(changed))
+        return changed
+    except ApplyError as e:
+        logging.error(str(e))
+        if isinstance(e.error, HTTPException):
+            raise e.error  # a path rejected by get_safe_path, before anything was staged
+        raise HTTPException(status_code=500, detail=str(e))
+    except OSError as e:
+        logging.error(f"Error writing changes: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error writing changes: {str(e)}")
+
+
+async def create_pull_request(worktree: Path, base_sha: str, changed: List[str], git_url: str, github_token: str,
+                              source_branch: str, pr_branch: Optional[str] = None, pr_title: Optional[str] = None,
+                              pr_description: Optional[str] = None):
+    try:
+        # Commit the changed files on top of base_sha without staging them in the worktree
+        with stage('commit'):
+            commit_sha = await commit_files(worktree, base_sha, changed, "Update repository", COMMIT_IDENTITY)
+        if commit_sha is None:
             logging.info("No changes to commit")
             return "No changes to commit"
 
-        # Create a new branch
         branch_name = pr_branch if pr_branch else f"update-{int(time.time())}_txt-repo_{int(time.time())}"
-        subprocess.run(["git", "checkout", "-b", branch_name], cwd=repo_path, check=True, capture_output=True,
-                       text=True)
-
-        # Commit changes
-        subprocess.run(["git", "add", "."], cwd=repo_path, check=True, capture_output=True, text=True)
-        subprocess.run(["git", "commit", "-m", "Update repository"], cwd=repo_path, check=True, capture_output=True,
-                       text=True)
+        auth_remote = re.sub(r"https://", f"https://x-access-token:{github_token}@", git_url)
 
-        # Get the remote URL and add the token
-        remote_url = subprocess.check_output(["git", "remote", "get-url", "origin"], cwd=repo_path, text=True).strip()
-        auth_remote = re.sub(r"https://", f"https://x-access-token:{github_token}@", remote_url)
-
-        # Push changes
+        # Push the commit straight to the remote branch; the cached clone's branches stay a mirror of the remote
         logging.info(f"Pushing changes to branch: {branch_name}")
-        push_result = subprocess.run(["git", "push", "-u", auth_remote, branch_name], cwd=repo_path,
-                                     capture_output=True, text=True)
-        if push_result.returncode != 0:
-            raise subprocess.CalledProcessError(push_result.returncode, push_result.args, push_result.stdout,
-                                                push_result.stderr)
-
-        # Create pull request using GitHub CLI
-        logging.info("Authenticating with GitHub CLI")
-        auth_result = subprocess.run(["gh", "auth", "login", "--with-token"], input=github_token, text=True,
-                                     capture_output=True)
-        if auth_result.returncode != 0:
-            raise subprocess.CalledProcessError(auth_result.returncode, auth_result.args, auth_result.stdout,
-                                                auth_result.stderr)
+        with stage('push'):
+            await run_git("push", auth_remote, f"{commit_sha}:refs/heads/{branch_name}", cwd=worktree)
 
         logging.info("Creating pull request")
-        pr_command = ["gh", "pr", "create", "--head", branch_name, "--base", source_branch]
-        if pr_title:
-            pr_command.extend(["--title", pr_title])
-        else:
-            pr_command.extend(["--title", "Update repository"])
-        if pr_description:
-            pr_command.extend(["--body", pr_description])
-        else:
-            pr_command.extend(["--body", "Automated update"])
-        pr_result = subprocess.run(pr_command, cwd=repo_path, capture_output=True, text=True)
-        if pr_result.returncode != 0:
-            raise subprocess.CalledProcessError(pr_result.returncode, pr_result.args, pr_result.stdout,
-                                                pr_result.stderr)
+        user, repo = extract_repo_info(git_url)
+        with stage('pr_create'):
+            pr_url = await github.create_pull_request(
+                github_token, user, repo,
+                head=branch_name,
+                base=source_branch,
+                title=pr_title if pr_title else "Update repository",
+                body=pr_description if pr_description else "Automated update"
+            )
 
         logging.info("Pull request created successfully")
-        return pr_result.stdout.strip()
+        return pr_url
     except subprocess.CalledProcessError as e:
         error_message = f"Command '{e.cmd}' returned non-zero exit status {e.returncode}.\nStdout: {e.stdout}\nStderr: {e.stderr}"
+        error_message = error_message.replace(github_token, '***')
         logging.error(error_message)
         raise HTTPException(status_code=500, detail=error_message)
+    except GitHubAPIError as e:
+        logging.error(str(e))
+        raise HTTPException(status_code=500, detail=str(e))
     except Exception as e:
         error_message = f"Unexpected error: {str(e)}"
         logging.error(error_message)
         raise HTTPException(status_code=500, detail=error_message)
 
 
-def get_cached_repo(git_url: str, branch: str, user: Optional[str] = None, repo: Optional[str] = None) -> Path:
-    # Extract user and repo name from git_url
+async def fetch_branch(repo_path: Path, branch: str):
+    """
+    Fetches branch unless it was checked within FETCH_TTL or the remote tip is already present.
+    One process at a time checks a branch; the others wait and reuse the check it made.
+    """
+    requested_at = time.time()
+    checked_at = await asyncio.to_thread(repo_cache.index.branch_checked_at, repo_path, branch)
+    if checked_at is not None and requested_at - checked_at < FETCH_TTL:
+        return
+
+    async with repo_locks.hold(('check', repo_path, branch)):
+        checked_at = await asyncio.to_thread(repo_cache.index.branch_checked_at, repo_path, branch)
+        if checked_at is not None and checked_at >= requested_at:
+            return
+        await check_branch(repo_path, branch)
+        await asyncio.to_thread(repo_cache.index.set_branch_checked, repo_path, branch, time.time())
+
+
+async def check_branch(repo_path: Path, branch: str):
+    with stage('ls_remote'):
+        remote = await run_git("ls-remote", "origin", f"refs/heads/{branch}", cwd=repo_path)
+    remote_sha = remote.split()[0] if remote.strip() else None
+    local = await run_command(["git", "rev-parse", "--verify", "--quiet", f"refs/heads/{branch}"], cwd=repo_path,
+                              check=False)
+    if remote_sha is None or remote_sha != local.stdout.strip():
+        cmd = ["fetch", "origin", f"+refs/heads/{branch}:refs/heads/{branch}"]
+        if CLONE_DEPTH > 0:
+            cmd.extend(["--depth", str(CLONE_DEPTH)])
+        # Fetches of different branches of one repo still share FETCH_HEAD, so serialize them
+        async with repo_locks.hold(('fetch', repo_path)):
+            with stage('fetch'):
+                await run_git(*cmd, cwd=repo_path)
+        await asyncio.to_thread(repo_cache.record, repo_path)
+
+
+def cached_repo_path(user: Optional[str], repo: Optional[str]) -> Path:
     if not user or not repo:
         raise HTTPException(status_code=400, detail="Invalid git URL")
-    
-    repo_path = REPO_BASE_DIR / user / repo
-    if not repo_path.exists():
-        repo_path.mkdir(parents=True, exist_ok=True)
-        clone_repo(git_url, repo_path)
-
-    # Clean all previous changes
-    subprocess.run(["git", "clean", "-fd"], cwd=repo_path, check=True, capture_output=True, text=True)
-    subprocess.run(["git", "reset", "--hard"], cwd=repo_path, check=True, capture_output=True, text=True)
+    return REPO_BASE_DIR / user / f"{repo}.git"
 
-    # Checkout to the specified branch
-    subprocess.run(["git", "checkout", branch], cwd=repo_path, check=True, capture_output=True, text=True)
-    subprocess.run(["git", "pull", "origin", branch], cwd=repo_path, check=True, capture_output=True, text=True)
 
+async def get_cached_repo(git_url: str, branch: str, user: Optional[str] = None, repo: Optional[str] = None) -> Path:
+    """
+    Makes sure the bare clone exists and the branch is up to date, and returns the clone's path.
+    Concurrent calls for the same repo (and branch) share one clone (or fetch).
+    Callers should hold repo_cache.use(cached_repo_path(user, repo)) while they work with the clone.
+    """
+    repo_path = cached_repo_path(user, repo)
+    try:
+        if not (repo_path / 'HEAD').exists():
+            await git_flights.run(('clone', repo_path), lambda: clone_repo(git_url, repo_path, branch))
+        await git_flights.run(('fetch', repo_path, branch), lambda: fetch_branch(repo_path, branch))
+    except subprocess.CalledProcessError as e:
+        raise HTTPException(status_code=500, detail=f"Error updating repository: {e.stderr}")
     return repo_path
 
+
+async def resolve_branch(repo_path: Path, branch: str) -> str:
+    try:
+        return (await run_git("rev-parse", "--verify", f"refs/heads/{branch}^{{commit}}", cwd=repo_path)).strip()
+    except subprocess.CalledProcessError:
+        raise HTTPException(status_code=400, detail=f"Branch not found: {branch}")
+
+
+@asynccontextmanager
+async def repo_worktree(repo_path: Path, commit_sha: str) -> AsyncIterator[Path]:
+    """A private worktree of the bare clone at commit_sha, removed (with any branch made in it) on exit."""
+    worktree = WORKTREE_BASE_DIR / repo_path.parent.name / repo_path.stem / uuid.uuid4().hex
+    worktree.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        async with repo_locks.hold(('worktree', repo_path)):
+            with stage('worktree'):
+                await run_git("worktree", "prune", cwd=repo_path)
+                await run_git("worktree", "add", "--detach", str(worktree), commit_sha, cwd=repo_path)
+    except subprocess.CalledProcessError as e:
+        raise HTTPException(status_code=500, detail=f"Error creating worktree: {e.stderr}")
+
+    try:
+        yield worktree
+    finally:
+        branch = await run_command(["git", "symbolic-ref", "--quiet", "--short", "HEAD"], cwd=worktree, check=False)
+        async with repo_locks.hold(('worktree', repo_path)):
+            await run_command(["git", "worktree", "remove", "--force", str(worktree)], cwd=repo_path, check=False)
+            if branch.returncode == 0 and branch.stdout.strip():
+                await run_command(["git", "branch", "-D", branch.stdout.strip()], cwd=repo_path, check=False)
+        shutil.rmtree(worktree, ignore_errors=True)
+
+
 @app.get("/repo")
 async def get_repo_summary(
+        request: Request,
         background_tasks: BackgroundTasks,
         git_url: str = Query(..., description="The URL of the GitHub repository"),
         branch: str = Query("main", description="Branch to fetch"),
@@ -300,52 +527,634 @@ async def get_repo_summary(
                                                 description="Comma-separated patterns to exclude files (e.g., '*.txt,*.md')"),
         case_sensitive: bool = Query(False, description="Perform case-sensitive pattern matching"),
         suppress_comments: bool = Query(False, description="Strip comments from the code files"),
-        line_number: bool = Query(False, description="Add line numbers to source code blocks")
+        line_number: bool = Query(False, description="Add line numbers to source code blocks"),
+        stream: bool = Query(False, description="Stream the summary as it is rendered (native engine only)"),
+        since: Optional[str] = Query(None, description="Only summarize files changed since this commit "
+                                                       "(or the commit of an earlier response's ETag)"),
+        max_tokens: Optional[int] = Query(None, ge=1,
+                                          description="Only include as many whole files as fit in this many tokens"),
+        strategy: str = Query("recent", description="Which files go first under max_tokens: "
+                                                    "'recent', 'smallest' or 'priority'"),
+        priority: Optional[str] = Query(None, description="Comma-separated patterns, most important first "
+                                                          "(strategy=priority)")
 ):
     user, repo = extract_repo_info(git_url)
+    check_strategy(max_tokens, strategy)
+
+    async with repo_cache.use(cached_repo_path(user, repo)):
+        return await summarize_branch(git_url, branch, user, repo, filter_patterns, exclude_patterns,
+                                      case_sensitive, suppress_comments, line_number, stream, since,
+                                      max_tokens, strategy, priority, request.headers.get('if-none-match'),
+                                      request.headers.get('accept-encoding', ''))
+
+
+def check_strategy(max_tokens: Optional[int], strategy: str):
+    if max_tokens is not None and strategy not in STRATEGIES:
+        raise HTTPException(status_code=400, detail=f"strategy must be one of {', '.join(STRATEGIES)}")
+
+
+def plan_budget(repo_path: Path, commit_sha: str, base: str, paths: Optional[List[str]], max_tokens: int,
+                strategy: str, priority: Optional[str], filter_patterns: Optional[str],
+                exclude_patterns: Optional[str], case_sensitive: bool, suppress_comments: bool,
+                line_number: bool) -> BudgetPlan:
+    entries = candidate_entries(repo_path, commit_sha, paths, filter_patterns, exclude_patterns, case_sensitive,
+                                blob_index)
+    return plan_summary(repo_path, commit_sha, base, entries, max_tokens, strategy, priority, case_sensitive,
+                        suppress_comments, line_number, blob_index, summary_tokenizer)
+
+
+async def resolve_commit(repo_path: Path, rev: str) -> Optional[str]:
+    result = await run_command(["git", "rev-parse", "--verify", "--quiet", "--end-of-options", f"{rev}^{{commit}}"],
+                               cwd=repo_path, check=False)
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+# A summary's ETag is its commit SHA and a digest of its cache key, plus a suffix on the gzip encoding
+ETAG_PATTERN = re.compile(r'(?:W/)?"([0-9a-f]{40})(?:-[0-9a-f]+(?:-gzip)?)?"')
+
+
+def since_commit(since: str) -> str:
+    """The commit of a since parameter: a commit (or any rev), or the ETag of an earlier summary."""
+    match = ETAG_PATTERN.fullmatch(since.strip())
+    return match.group(1) if match else since.strip('"')
+
+
+def summary_etag(commit_sha: str, cache_key: str, gzipped: bool = False) -> str:
+    return f'"{commit_sha}-{cache_key[:16]}{"-gzip" if gzipped else ""}"'
 
-    repo_path = get_cached_repo(git_url, branch, user, repo)
-    summary = await run_code2prompt(
-        repo_path,
+
+def etag_matches(if_none_match: Optional[str], commit_sha: str, cache_key: str) -> bool:
+    """Whether an If-None-Match header names either encoding of the summary (weak comparison)."""
+    if not if_none_match:
+        return False
+    etags = {summary_etag(commit_sha, cache_key), summary_etag(commit_sha, cache_key, gzipped=True)}
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*' or tag.removeprefix('W/') in etags:
+            return True
+    return False
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    for item in accept_encoding.split(','):
+        coding, _, params = item.partition(';')
+        if coding.strip().lower() not in ('gzip', '*'):
+            continue
+        quality = params.strip().lower()
+        try:
+            return not (quality.startswith('q=') and float(quality[2:]) == 0)
+        except ValueError:
+            return True
+    return False
+
+
+def summary_response(document: bytes, commit_sha: str, cache_key: str, accept_encoding: str) -> Response:
+    """A gzip-compressed summary document: sent as stored to clients that accept gzip, inflated for the rest."""
+    if accepts_gzip(accept_encoding):
+        return Response(document, media_type="application/json",
+                        headers={'ETag': summary_etag(commit_sha, cache_key, gzipped=True),
+                                 'Content-Encoding': 'gzip', 'Vary': 'Accept-Encoding'})
+    return Response(gzip.decompress(document), media_type="application/json",
+                    headers={'ETag': summary_etag(commit_sha, cache_key), 'Vary': 'Accept-Encoding'})
+
+
+class SummaryPlan(NamedTuple):
+    repo_path: Path
+    commit_sha: str
+    # The commit an incremental summary starts from: None for a full summary, or when since did not resolve
+    since_sha: Optional[str]
+    cache_key: str
+
+
+async def plan_branch_summary(git_url: str, branch: str, user: str, repo: str, filter_patterns: Optional[str],
+                              exclude_patterns: Optional[str], case_sensitive: bool, suppress_comments: bool,
+                              line_number: bool, since: Optional[str] = None, max_tokens: Optional[int] = None,
+                              strategy: str = "recent", priority: Optional[str] = None) -> SummaryPlan:
+    """
+    Updates the clone and resolves the commit to summarize and the summary's cache key, which (with the
+    commit) determines the response exactly. Nothing is diffed or rendered yet.
+    """
+    repo_path = await get_cached_repo(git_url, branch, user, repo)
+    commit_sha = await resolve_branch(repo_path, branch)
+
+    since_sha = None
+    key_options = {}
+    if since is not None:
+        since_sha = await resolve_commit(repo_path, since_commit(since))
+        key_options['since'] = since_sha
+    if max_tokens is not None:
+        key_options.update(max_tokens=max_tokens, strategy=strategy, priority=priority,
+                           tokenizer=summary_tokenizer.name)
+    if suppress_comments and line_number:
+        # Summaries cached before stripped lines kept their numbers in the file
+        key_options['numbering'] = 'source'
+
+    cache_key = SummaryCache.make_key(
+        user, repo, commit_sha,
+        **key_options,
+        template=TEMPLATE_DIGEST,
+        engine=SUMMARY_ENGINE if since_sha is None and max_tokens is None else 'native',
+        filter_patterns=normalize_patterns(filter_patterns, case_sensitive),
+        exclude_patterns=normalize_patterns(exclude_patterns, case_sensitive),
+        case_sensitive=case_sensitive,
+        suppress_comments=suppress_comments,
+        line_number=line_number
+    )
+    return SummaryPlan(repo_path, commit_sha, since_sha, cache_key)
+
+
+async def summary_scope(plan: SummaryPlan, user: str, repo: str, filter_patterns: Optional[str],
+                        exclude_patterns: Optional[str], case_sensitive: bool, suppress_comments: bool,
+                        line_number: bool, since: Optional[str] = None, max_tokens: Optional[int] = None,
+                        strategy: str = "recent",
+                        priority: Optional[str] = None) -> Tuple[Optional[List[str]], Dict[str, Any]]:
+    """The files to render (None for all of them) and the extra fields of the response."""
+    # Incremental summary: only files added or modified since an earlier commit, plus the deleted paths.
+    # A commit the clone does not have (e.g. rewritten history) gets a full summary, with "since": null.
+    paths = None
+    extra = {}
+    if since is not None:
+        extra = {'since': plan.since_sha, 'head': plan.commit_sha, 'deleted': []}
+        if plan.since_sha is not None:
+            paths, deleted = await asyncio.to_thread(diff_paths, plan.repo_path, plan.since_sha, plan.commit_sha)
+            extra['deleted'] = [f"{friendly_base(user, repo)}/{p}"
+                                for p in select_paths(deleted, filter_patterns, exclude_patterns, case_sensitive)]
+
+    # Token budget: only the whole files that fit, chosen by strategy, plus a manifest of the rest
+    if max_tokens is not None:
+        with stage('budget'):
+            budget = await asyncio.to_thread(plan_budget, plan.repo_path, plan.commit_sha, friendly_base(user, repo),
+                                             paths, max_tokens, strategy, priority, filter_patterns,
+                                             exclude_patterns, case_sensitive, suppress_comments, line_number)
+        paths = budget.paths
+        extra.update({'max_tokens': max_tokens, 'tokens': budget.tokens, 'omitted': budget.omitted})
+    return paths, extra
+
+
+async def cached_summary(cache_key: str) -> Optional[bytes]:
+    """The cached summary document, gzip-compressed."""
+    with stage('cache_lookup'):
+        document = await asyncio.to_thread(summary_cache.get, cache_key)
+    SUMMARY_CACHE_REQUESTS.inc(result='miss' if document is None else 'hit')
+    return document
+
+
+async def render_planned_summary(plan: SummaryPlan, paths: Optional[List[str]], extra: Dict[str, Any],
+                                 git_url: str, filter_patterns: Optional[str], exclude_patterns: Optional[str],
+                                 case_sensitive: bool, suppress_comments: bool, line_number: bool) -> bytes:
+    """Renders a summary that missed the cache and caches its document; returns the document, gzip-compressed."""
+    summary = await summarize_repo(
+        plan.repo_path,
+        plan.commit_sha,
         git_url,
         filter_patterns,
         exclude_patterns,
         case_sensitive,
         suppress_comments,
-        line_number
+        line_number,
+        paths
     )
-    return {"summary": summary}
-def clean_old_repos(background_tasks: BackgroundTasks):
-    def cleanup():
-        current_time = time.time()
-        for git_url, cache_info in list(repo_cache.items()):
-            if current_time - cache_info['timestamp'] >= CACHE_EXPIRATION:
-                shutil.rmtree(cache_info['path'])
-                del repo_cache[git_url]
+    SUMMARY_BYTES.inc(len(summary.encode('utf-8')))
+    with stage('compress'):
+        return await asyncio.to_thread(summary_cache.put, plan.cache_key, summary_document(summary, extra))
+
+
+async def summarize_branch(git_url: str, branch: str, user: str, repo: str, filter_patterns: Optional[str],
+                           exclude_patterns: Optional[str], case_sensitive: bool, suppress_comments: bool,
+                           line_number: bool, stream: bool, since: Optional[str] = None,
+                           max_tokens: Optional[int] = None, strategy: str = "recent", priority: Optional[str] = None,
+                           if_none_match: Optional[str] = None, accept_encoding: str = ''):
+    options = (filter_patterns, exclude_patterns, case_sensitive, suppress_comments, line_number)
+    plan = await plan_branch_summary(git_url, branch, user, repo, *options, since, max_tokens, strategy, priority)
+    # The client already has this summary: nothing to diff, render or send. The ETag is the one
+    # summary_response would send for this Accept-Encoding
+    if etag_matches(if_none_match, plan.commit_sha, plan.cache_key):
+        etag = summary_etag(plan.commit_sha, plan.cache_key, gzipped=accepts_gzip(accept_encoding))
+        return Response(status_code=304, headers={'ETag': etag, 'Vary': 'Accept-Encoding'})
+
+    document = await cached_summary(plan.cache_key)
+    if document is None:
+        paths, extra = await summary_scope(plan, user, repo, *options, since, max_tokens, strategy, priority)
+        if stream and (SUMMARY_ENGINE != 'code2prompt' or paths is not None):
+            chunks = render_native_summary(plan.repo_path, plan.commit_sha, git_url, *options, paths)
+            # The stream outlives the handler's repo_cache.use(), so it is pinned before the handler returns
+            await asyncio.to_thread(repo_cache.pin, plan.repo_path)
+            return StreamingResponse(stream_summary_json(chunks, plan.cache_key, plan.repo_path, extra),
+                                     media_type="application/json",
+                                     headers={'ETag': summary_etag(plan.commit_sha, plan.cache_key),
+                                              'Vary': 'Accept-Encoding'})
+        document = await render_planned_summary(plan, paths, extra, git_url, *options)
+    return summary_response(document, plan.commit_sha, plan.cache_key, accept_encoding)
+
+
+class SummaryRequest(BaseModel):
+    git_url: str
+    branch: str = "main"
+    filter_patterns: Optional[str] = None
+    exclude_patterns: Optional[str] = None
+    case_sensitive: bool = False
+    suppress_comments: bool = False
+    line_number: bool = False
+    since: Optional[str] = None
+    max_tokens: Optional[int] = None
+    strategy: str = "recent"
+    priority: Optional[str] = None
 
-    background_tasks.add_task(cleanup)
 
+class BatchSummaryRequest(BaseModel):
+    repos: List[SummaryRequest]
+    # Repositories summarized at once (at most BATCH_CONCURRENCY)
+    concurrency: Optional[int] = Field(None, ge=1)
 
-@app.post("/repo")
-async def apply_changes_and_create_pr(pr_request: PullRequestRequest, background_tasks: BackgroundTasks):
-    user, repo = extract_repo_info(pr_request.git_url)
-    repo_path = get_cached_repo(pr_request.git_url, pr_request.branch, user, repo)
 
-    files = parse_summary(pr_request.summary, repo_path, user, repo)
-    update_repo(files, repo_path)
+async def summarize_batch_entry(index: int, entry: SummaryRequest, slots: ConcurrencyLimit) -> Dict[str, Any]:
+    result = {'index': index, 'git_url': entry.git_url, 'branch': entry.branch}
+    try:
+        async with slots:
+            user, repo = extract_repo_info(entry.git_url)
+            check_strategy(entry.max_tokens, entry.strategy)
+            if entry.max_tokens is not None and entry.max_tokens < 1:
+                raise HTTPException(status_code=400, detail="max_tokens must be at least 1")
+            options = (entry.filter_patterns, entry.exclude_patterns, entry.case_sensitive,
+                       entry.suppress_comments, entry.line_number)
+            async with repo_cache.use(cached_repo_path(user, repo)):
+                scope = (entry.since, entry.max_tokens, entry.strategy, entry.priority)
+                plan = await plan_branch_summary(entry.git_url, entry.branch, user, repo, *options, *scope)
+                document = await cached_summary(plan.cache_key)
+                if document is None:
+                    paths, extra = await summary_scope(plan, user, repo, *options, *scope)
+                    document = await render_planned_summary(plan, paths, extra, entry.git_url, *options)
+        result.update({'status': 200, 'commit': plan.commit_sha, **json.loads(gzip.decompress(document))})
+    except HTTPException as e:
+        result.update({'status': e.status_code, 'error': e.detail})
+    except Exception as e:
+        logging.exception(f"Summarizing {entry.git_url} failed")
+        result.update({'status': 500, 'error': f"Unexpected error: {str(e)}"})
+    return result
+
 
+async def stream_batch(entries: List[SummaryRequest], concurrency: int) -> AsyncIterator[bytes]:
+    """Summarizes entries concurrently and yields each result as a line of JSON as soon as it is done."""
+    slots = ConcurrencyLimit(concurrency)
+    tasks = [asyncio.ensure_future(summarize_batch_entry(i, entry, slots)) for i, entry in enumerate(entries)]
     try:
-        pr_url = create_pull_request(
-            repo_path,
-            pr_request.github_token,
-            pr_request.branch,
-            pr_request.pr_branch,
-            pr_request.pr_title,
-            pr_request.pr_description
-        )
-        return {"pull_request_url": pr_url}
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            yield (json.dumps(result, ensure_ascii=False) + '\n').encode('utf-8')
+    finally:
+        # The client went away (or everything is done): stop whatever is still running
+        for task in tasks:
+            task.cancel()
+
+
+@app.post("/repo/batch")
+async def summarize_batch(request: BatchSummaryRequest):
+    """
+    Summarizes several repositories at once. The response is newline-delimited JSON: one object per repository,
+    in the order they finish, with its index in the request and either its summary or an error.
+    """
+    if len(request.repos) > BATCH_MAX_REPOS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_REPOS} repositories per batch")
+    requested = request.concurrency if request.concurrency is not None else BATCH_CONCURRENCY
+    concurrency = min(requested, BATCH_CONCURRENCY)
+    return StreamingResponse(stream_batch(request.repos, concurrency), media_type="application/x-ndjson")
+
+
+async def resolve_requested_commit(repo_path: Path, branch: str, commit: Optional[str]) -> str:
+    """The commit to serve: the given one (e.g. from a manifest, so pages stay consistent) or the branch tip."""
+    if commit is None:
+        return await resolve_branch(repo_path, branch)
+    commit_sha = await resolve_commit(repo_path, commit.strip('"'))
+    if commit_sha is None:
+        raise HTTPException(status_code=404, detail=f"Commit not found: {commit}")
+    return commit_sha
+
+
+def stream_text(chunks: Iterator[str], repo_path: Path) -> Iterator[bytes]:
+    """Streams rendered chunks as UTF-8, then unpins the clone, which the caller pinned."""
+    try:
+        with stage('render'):
+            for chunk in chunks:
+                data = chunk.encode('utf-8')
+                SUMMARY_BYTES.inc(len(data))
+                yield data
+    finally:
+        repo_cache.unpin(repo_path)
+
+
+@app.get("/repo/manifest")
+async def get_repo_manifest(
+        git_url: str = Query(..., description="The URL of the GitHub repository"),
+        branch: str = Query("main", description="Branch to fetch"),
+        commit: Optional[str] = Query(None, description="Commit to list instead of the branch tip"),
+        filter_patterns: Optional[str] = Query(None, description="Comma-separated filter patterns to include files"),
+        exclude_patterns: Optional[str] = Query(None, description="Comma-separated patterns to exclude files"),
+        case_sensitive: bool = Query(False, description="Perform case-sensitive pattern matching")
+):
+    """The files a summary would include, in order, with their blob SHA, size in bytes and line count."""
+    user, repo = extract_repo_info(git_url)
+    async with repo_cache.use(cached_repo_path(user, repo)):
+        repo_path = await get_cached_repo(git_url, branch, user, repo)
+        commit_sha = await resolve_requested_commit(repo_path, branch, commit)
+
+        def manifest():
+            entries = candidate_entries(repo_path, commit_sha, None, filter_patterns, exclude_patterns,
+                                        case_sensitive, blob_index)
+            return build_manifest(repo_path, friendly_base(user, repo), entries, blob_index)
+
+        with stage('manifest'):
+            files = await asyncio.to_thread(manifest)
+    return JSONResponse({"commit": commit_sha, "total_files": len(files), "files": files},
+                        headers={'ETag': f'"{commit_sha}"'})
+
+
+@app.get("/repo/files")
+async def get_repo_files(
+        git_url: str = Query(..., description="The URL of the GitHub repository"),
+        branch: str = Query("main", description="Branch to fetch"),
+        commit: Optional[str] = Query(None, description="Commit to render instead of the branch tip "
+                                                        "(e.g. the commit of a manifest)"),
+        paths: Optional[List[str]] = Query(None, description="Files to render, as listed in the manifest "
+                                                             "(repeatable); overrides page"),
+        page: int = Query(1, ge=1, description="Page of the manifest to render"),
+        page_size: int = Query(100, ge=1, description="Files per page"),
+        filter_patterns: Optional[str] = Query(None, description="Comma-separated filter patterns to include files"),
+        exclude_patterns: Optional[str] = Query(None, description="Comma-separated patterns to exclude files"),
+        case_sensitive: bool = Query(False, description="Perform case-sensitive pattern matching"),
+        suppress_comments: bool = Query(False, description="Strip comments from the code files"),
+        line_number: bool = Query(False, description="Add line numbers to source code blocks")
+):
+    """Renders a page of the manifest, or the given files, as a plain-text summary."""
+    if page_size > MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"page_size must be at most {MAX_PAGE_SIZE}")
+    user, repo = extract_repo_info(git_url)
+    base = friendly_base(user, repo)
+    selected = None
+    if paths:
+        # Checked here: once the response has started, a git error could only cut it short
+        try:
+            selected = [strip_base(p, base) for p in paths]
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    async with repo_cache.use(cached_repo_path(user, repo)):
+        repo_path = await get_cached_repo(git_url, branch, user, repo)
+        commit_sha = await resolve_requested_commit(repo_path, branch, commit)
+        headers = {'ETag': f'"{commit_sha}"'}
+        if selected is None:
+            entries = await asyncio.to_thread(candidate_entries, repo_path, commit_sha, None, filter_patterns,
+                                              exclude_patterns, case_sensitive, blob_index)
+            selected = page_paths(entries, page, page_size)
+            headers['X-Total-Files'] = str(len(entries))
+        chunks = render_native_summary(repo_path, commit_sha, git_url, filter_patterns, exclude_patterns,
+                                       case_sensitive, suppress_comments, line_number, selected)
+        # The stream outlives repo_cache.use(), so it is pinned before the handler returns
+        await asyncio.to_thread(repo_cache.pin, repo_path)
+        return StreamingResponse(stream_text(chunks, repo_path), media_type="text/plain; charset=utf-8",
+                                 headers=headers)
+
+
+class PreviewRequest(BaseModel):
+    git_url: str
+    summary: str
+    branch: str = "main"
+    commit: Optional[str] = None
+
+
+@app.post("/repo/preview")
+async def preview_changes(request: PreviewRequest):
+    """
+    Dry-runs a summary's changes against the branch tip (or commit) without touching any checkout.
+    Returns each file's status and unified diff, and where its edit-section blocks matched.
+    """
+    user, repo = extract_repo_info(request.git_url)
+    async with repo_cache.use(cached_repo_path(user, repo)):
+        repo_path = await get_cached_repo(request.git_url, request.branch, user, repo)
+        commit_sha = await resolve_requested_commit(repo_path, request.branch, request.commit)
+        with stage('parse_summary'):
+            blocks = await asyncio.to_thread(lambda: list(iter_file_blocks(split_lines(request.summary))))
+
+        # Paths are checked against a worktree that is never created
+        root = WORKTREE_BASE_DIR / user / repo / 'preview'
+        overlay = Overlay(repo_path, commit_sha, root)
+        try:
+            files = apply_order(parse_file_blocks(blocks, root, user, repo))
+            with stage('preview'):
+                results = await asyncio.to_thread(preview_blocks, overlay, lambda path: get_safe_path(root, path),
+                                                  files, friendly_base(user, repo), APPLY_WORKERS)
+        except (ApplyError, ValueError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        finally:
+            await asyncio.to_thread(overlay.close)
+    return {"commit": commit_sha, "files": results}
+
+
+def forget_repo(repo_path: Path):
+    repo_cache.index.remove(repo_path)
+
+
+def clean_up_after_crash():
+    # Worktrees only live for one request, so anything left over is from a crash
+    shutil.rmtree(WORKTREE_BASE_DIR, ignore_errors=True)
+    repo_cache.rebuild()
+
+
+@app.on_event("startup")
+async def start_repo_cache():
+    # Only the first process to start cleans up; later ones would delete clones and worktrees in use
+    alone = await asyncio.to_thread(worker_registry.register, clean_up_after_crash)
+    logging.info(f"Worker {worker_registry.worker_id} started{' (first)' if alone else ''}")
+    app.state.cache_sweeper = asyncio.create_task(repo_cache.run_periodically(CACHE_SWEEP_INTERVAL))
+
+
+@app.on_event("shutdown")
+async def stop_repo_cache():
+    app.state.cache_sweeper.cancel()
+    worker_registry.unregister()
+
+
+async def purge_jobs_periodically(store: JobStore):
+    while True:
+        try:
+            await asyncio.to_thread(store.purge, JOB_RETENTION)
+            interrupted = await asyncio.to_thread(store.recover, worker_registry.is_alive)
+            if interrupted:
+                logging.warning(f"Marked {interrupted} jobs of exited workers as failed")
+        except Exception as e:
+            logging.error(f"Purging finished jobs failed: {e}")
+        await asyncio.sleep(CACHE_SWEEP_INTERVAL)
+
+
+@app.on_event("startup")
+async def open_blob_index():
+    global blob_index
+    blob_index = await asyncio.to_thread(BlobIndex, BLOB_INDEX_PATH)
+
+
+@app.on_event("shutdown")
+async def close_blob_index():
+    blob_index.close()
+
+
+@app.on_event("startup")
+async def start_job_queue():
+    global job_queue
+    store = await asyncio.to_thread(JobStore, JOB_DB_PATH)
+    interrupted = await asyncio.to_thread(store.recover, worker_registry.is_alive)
+    if interrupted:
+        logging.warning(f"Marked {interrupted} jobs interrupted by the last shutdown as failed")
+    job_queue = JobQueue(store, {'pull_request': run_pull_request_job}, JOB_WORKERS, worker_registry.worker_id)
+    job_queue.start()
+    app.state.job_purger = asyncio.create_task(purge_jobs_periodically(store))
+
+
+@app.on_event("shutdown")
+async def stop_job_queue():
+    app.state.job_purger.cancel()
+    await job_queue.stop()
+    job_queue.store.close()
+    await github.close()
+
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    return {"summary_cache": summary_cache.stats(), "repo_cache": await asyncio.to_thread(repo_cache.stats),
+            "blob_index": await asyncio.to_thread(blob_index.stats)}
+
+
+def numeric_stats(stats: dict):
+    return [((name,), value) for name, value in stats.items() if isinstance(value, (int, float))]
+
+
+REGISTRY.register(Gauge('txtrepo_summary_cache', 'Summary cache counters and sizes (see /cache/stats).', ('stat',),
+                        lambda: numeric_stats(summary_cache.stats())))
+REGISTRY.register(Gauge('txtrepo_jobs', 'Stored jobs by status.', ('status',),
+                        lambda: [((status,), count) for status, count in job_queue.store.counts().items()]
+                        if job_queue is not None else []))
+REGISTRY.register(Gauge('txtrepo_repo_cache', 'Repository cache counters and sizes (see /cache/stats).', ('stat',),
+                        lambda: numeric_stats(repo_cache.stats())))
+
+
+@app.get("/metrics")
+async def get_metrics():
+    # Gauges read the shared stores, so render off the event loop
+    return PlainTextResponse(await asyncio.to_thread(REGISTRY.render), media_type=CONTENT_TYPE)
+
+
+async def read_pull_request(request: Request, spool: PayloadSpool) -> PullRequestRequest:
+    """
+    Reads a POST /repo body: either a JSON PullRequestRequest, or (any other content type) the raw
+    summary streamed as the body, with the other fields as query parameters and the token in the
+    X-GitHub-Token header. The summary is tokenized into file blocks as it arrives, and the blocks
+    are written to spool.
+    """
+    if request.headers.get('content-type', '').startswith('application/json'):
+        try:
+            pr_request = PullRequestRequest(**await request.json())
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        with stage('parse_summary'):
+            await asyncio.to_thread(spool.write_all, map(list, iter_file_blocks(split_lines(pr_request.summary))))
+        pr_request.summary = ""
+        return pr_request
+
+    params = request.query_params
+    if 'git_url' not in params or 'x-github-token' not in request.headers:
+        raise HTTPException(status_code=422,
+                            detail="Streamed summaries need a git_url query parameter and an X-GitHub-Token header")
+    pr_request = PullRequestRequest(
+        git_url=params['git_url'],
+        github_token=request.headers['x-github-token'],
+        summary="",
+        branch=params.get('branch', 'main'),
+        pr_branch=params.get('pr_branch'),
+        pr_title=params.get('pr_title'),
+        pr_description=params.get('pr_description')
+    )
+    with stage('parse_summary'):
+        async for block in aiter_file_blocks(request.stream()):
+            await asyncio.to_thread(spool.write, list(block))
+    return pr_request
+
+
+@app.post("/repo", status_code=202)
+async def apply_changes_and_create_pr(request: Request, background_tasks: BackgroundTasks):
+    # The blocks go to a file as they are parsed, so queued jobs don't hold their edits in memory
+    spool = await asyncio.to_thread(job_queue.store.spool)
+    try:
+        pr_request = await read_pull_request(request, spool)
+        user, repo = extract_repo_info(pr_request.git_url)
+        cached_repo_path(user, repo)  # rejects invalid URLs before queueing
+        await asyncio.to_thread(spool.close)
+
+        params = {
+            'git_url': pr_request.git_url,
+            'branch': pr_request.branch,
+            'pr_branch': pr_request.pr_branch,
+            'pr_title': pr_request.pr_title,
+            'pr_description': pr_request.pr_description
+        }
+        job_id = await job_queue.submit('pull_request', f"{user}/{repo}", params, secret=pr_request.github_token,
+                                        payload_path=str(spool.path))
+    except BaseException:
+        await asyncio.to_thread(spool.discard)
+        raise
+    return JSONResponse(status_code=202, content={"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"})
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await asyncio.to_thread(job_queue.store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+async def run_pull_request_job(job: Job):
+    pr_request = PullRequestRequest(**job.params, github_token=job.secret, summary="")
+    if job.payload_path is not None:
+        blocks = await asyncio.to_thread(lambda: [FileBlock(*block) for block in read_payload(job.payload_path)])
+    else:
+        blocks = [FileBlock(*block) for block in job.payload]  # queued before payloads were spooled
+    user, repo = extract_repo_info(pr_request.git_url)
+    try:
+        async with repo_cache.use(cached_repo_path(user, repo)):
+            result = await create_pull_request_from_summary(pr_request, blocks, user, repo)
     except HTTPException as e:
-        return {"error": e.detail}
+        raise JobFailed(e.detail)
+    if 'error' in result:
+        raise JobFailed(result['error'])
+    return result
+
+
+async def create_pull_request_from_summary(pr_request: PullRequestRequest, blocks: List[FileBlock], user: str,
+                                           repo: str):
+    repo_path = await get_cached_repo(pr_request.git_url, pr_request.branch, user, repo)
+    base_sha = await resolve_branch(repo_path, pr_request.branch)
+
+    async with repo_worktree(repo_path, base_sha) as worktree:
+        try:
+            files = parse_file_blocks(blocks, worktree, user, repo)
+        except ApplyError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        # get_safe_path has rejected every path outside the worktree before anything was written
+        staged = await asyncio.to_thread(update_repo, files, worktree)
+        changed = [staged_file.path.relative_to(worktree.resolve()).as_posix() for staged_file in staged]
+
+        try:
+            pr_url = await create_pull_request(
+                worktree,
+                base_sha,
+                changed,
+                pr_request.git_url,
+                pr_request.github_token,
+                pr_request.branch,
+                pr_request.pr_branch,
+                pr_request.pr_title,
+                pr_request.pr_description
+            )
+            return {"pull_request_url": pr_url}
+        except HTTPException as e:
+            return {"error": e.detail}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,294 @@
+"""
+In-process replacement for the code2prompt CLI.
+
+Renders the same layout as template.j2:
+
+    # Code summary
+    - /user/repo/path
+    ...
+
+    ## Files
+
+    # File /user/repo/path
+    <content>
+    # EndFile /user/repo/path
+
+as a generator of text chunks. Files come from a source: a commit read
+straight from the object database (GitTreeSource) or a checkout listed with
+`git ls-files` (WorkingTreeSource). Either way they are read in fixed-size
+chunks, so memory stays flat regardless of repository size.
+"""
+import fnmatch
+import io
+import os
+import subprocess
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from blob_index import BlobIndex, text_entries
+from git_objects import BlobReader
+
+CHUNK_SIZE = 64 * 1024
+BINARY_SNIFF_SIZE = 8 * 1024
+
+# Comment syntax per file extension: (line comment markers, block comment delimiters, string quotes)
+_C_STYLE = (('//',), (('/*', '*/'),), ('"', "'", '`'))
+_HASH_STYLE = (('#',), (), ('"', "'"))
+_COMMENT_SYNTAX = {
+    **{ext: _C_STYLE for ext in (
+        '.c', '.h', '.cc', '.cpp', '.cxx', '.hpp', '.hh', '.cs', '.java', '.kt', '.kts', '.scala', '.go', '.rs',
+        '.swift', '.js', '.jsx', '.mjs', '.cjs', '.ts', '.tsx', '.php', '.dart', '.groovy', '.m', '.mm')},
+    **{ext: _HASH_STYLE for ext in (
+        '.py', '.pyi', '.sh', '.bash', '.zsh', '.rb', '.pl', '.pm', '.r', '.yaml', '.yml', '.toml', '.ps1',
+        '.cfg', '.ini', '.conf', '.mk', '.cmake', '.tf', '.nix')},
+    '.css': ((), (('/*', '*/'),), ('"', "'")),
+    '.scss': _C_STYLE,
+    '.less': _C_STYLE,
+    '.sql': (('--',), (('/*', '*/'),), ("'", '"')),
+    '.lua': (('--',), (('--[[', ']]'),), ('"', "'")),
+    '.hs': (('--',), (('{-', '-}'),), ('"',)),
+    '.html': ((), (('<!--', '-->'),), ()),
+    '.htm': ((), (('<!--', '-->'),), ()),
+    '.xml': ((), (('<!--', '-->'),), ()),
+    '.vue': (('//',), (('/*', '*/'), ('<!--', '-->')), ('"', "'", '`')),
+}
+_FILENAME_SYNTAX = {'Makefile': _HASH_STYLE, 'Dockerfile': _HASH_STYLE, 'CMakeLists.txt': _HASH_STYLE}
+
+
+def friendly_base(user: Optional[str], repo: Optional[str]) -> str:
+    return f"/{user}/{repo}" if user and repo else "/unknown/repo"
+
+
+def split_patterns(patterns: Optional[str]) -> List[str]:
+    return [p.strip() for p in patterns.split(',') if p.strip()] if patterns else []
+
+
+def matches_any(path: str, patterns: List[str], case_sensitive: bool) -> bool:
+    name = path.rsplit('/', 1)[-1]
+    if not case_sensitive:
+        path, name = path.lower(), name.lower()
+    for pattern in patterns:
+        if not case_sensitive:
+            pattern = pattern.lower()
+        if fnmatch.fnmatchcase(path, pattern) or fnmatch.fnmatchcase(name, pattern):
+            return True
+    return False
+
+
+def select_paths(paths: Iterable[str], filter_patterns: Optional[str] = None, exclude_patterns: Optional[str] = None,
+                 case_sensitive: bool = False) -> List[str]:
+    include = split_patterns(filter_patterns)
+    exclude = split_patterns(exclude_patterns)
+    return [
+        path for path in paths
+        if (not include or matches_any(path, include, case_sensitive))
+        and not (exclude and matches_any(path, exclude, case_sensitive))
+    ]
+
+
+def list_tracked_files(repo_path: Path) -> List[str]:
+    output = subprocess.run(["git", "ls-files", "-z"], cwd=repo_path, check=True, capture_output=True).stdout
+    return [os.fsdecode(p) for p in output.split(b'\0') if p]
+
+
+def is_text_file(path: Path) -> bool:
+    if not path.is_file():
+        return False
+    try:
+        with open(path, 'rb') as f:
+            return b'\0' not in f.read(BINARY_SNIFF_SIZE)
+    except OSError:
+        return False
+
+
+class WorkingTreeSource:
+    """Tracked files of a checkout."""
+
+    def __init__(self, repo_path: Path):
+        self.repo_path = repo_path
+
+    def list_files(self) -> List[str]:
+        return [p for p in list_tracked_files(self.repo_path) if is_text_file(self.repo_path / p)]
+
+    def open(self, path: str) -> TextIO:
+        return open(self.repo_path / path, 'r', encoding='utf-8', errors='replace', newline='')
+
+    def close(self):
+        pass
+
+
+class GitTreeSource:
+    """Files of a commit (or only the given paths of it), read from the object database without a checkout."""
+
+    def __init__(self, git_dir: Path, rev: str, paths: Optional[List[str]] = None,
+                 index: Optional[BlobIndex] = None):
+        self.git_dir = git_dir
+        self.rev = rev
+        self.paths = paths
+        self.index = index
+        self._blobs = {}
+        self._reader: Optional[BlobReader] = None
+
+    def list_files(self) -> List[str]:
+        self._blobs = {e.path: e.sha for e in text_entries(self.git_dir, self.rev, self.paths, self.index)}
+        return list(self._blobs)
+
+    def open(self, path: str) -> TextIO:
+        if self._reader is None:
+            self._reader = BlobReader(self.git_dir)
+        return io.TextIOWrapper(self._reader.open(self._blobs[path]), encoding='utf-8', errors='replace',
+                                newline='')
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+
+def comment_syntax(path: str):
+    name = path.rsplit('/', 1)[-1]
+    return _FILENAME_SYNTAX.get(name) or _COMMENT_SYNTAX.get(os.path.splitext(name)[1].lower())
+
+
+class CommentStripper:
+    """Strips comments line by line, carrying block-comment state across lines."""
+
+    def __init__(self, syntax):
+        self.line_markers, self.block_markers, self.quotes = syntax
+        self.block_end = None
+
+    def strip(self, line: str) -> Optional[str]:
+        """Returns the line without comments, or None when the line held nothing but comments."""
+        out = []
+        i = 0
+        quote = None
+        had_comment = False
+        length = len(line)
+        while i < length:
+            if self.block_end:
+                end = line.find(self.block_end, i)
+                had_comment = True
+                if end == -1:
+                    i = length
+                    break
+                i = end + len(self.block_end)
+                self.block_end = None
+                continue
+            ch = line[i]
+            if quote:
+                out.append(ch)
+                if ch == '\\' and i + 1 < length:
+                    out.append(line[i + 1])
+                    i += 2
+                    continue
+                if ch == quote:
+                    quote = None
+                i += 1
+                continue
+            if ch in self.quotes:
+                quote = ch
+                out.append(ch)
+                i += 1
+                continue
+            block = next((b for b in self.block_markers if line.startswith(b[0], i)), None)
+            if block:
+                self.block_end = block[1]
+                i += len(block[0])
+                continue
+            if any(line.startswith(marker, i) for marker in self.line_markers):
+                had_comment = True
+                break
+            out.append(ch)
+            i += 1
+
+        text = ''.join(out)
+        newline = line[len(line.rstrip('\r\n')):]
+        if had_comment:
+            text = text.rstrip()
+            if not text.strip():
+                return None
+            return text + newline
+        return text if text.endswith(newline) else text + newline
+
+
+def iter_file_lines(open_file: Callable[[], TextIO], rel_path: str,
+                    suppress_comments: bool = False) -> Iterator[str]:
+    for _, line in iter_numbered_lines(open_file, rel_path, suppress_comments):
+        yield line
+
+
+def iter_numbered_lines(open_file: Callable[[], TextIO], rel_path: str,
+                        suppress_comments: bool = False) -> Iterator[Tuple[int, str]]:
+    """The file's lines with their 1-based line numbers in the file, which skip the lines that were all comment."""
+    syntax = comment_syntax(rel_path) if suppress_comments else None
+    stripper = CommentStripper(syntax) if syntax else None
+    with open_file() as f:
+        for number, line in enumerate(f, 1):
+            if stripper:
+                line = stripper.strip(line)
+                if line is None:
+                    continue
+            yield number, line
+
+
+def iter_file_content(open_file: Callable[[], TextIO], rel_path: str, suppress_comments: bool = False,
+                      line_number: bool = False) -> Iterator[str]:
+    """Yields a file's (optionally comment-stripped and line-numbered) content in bounded chunks."""
+    if not suppress_comments and not line_number:
+        with open_file() as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+    if not line_number:
+        yield from _batch(iter_file_lines(open_file, rel_path, suppress_comments))
+        return
+
+    # Lines keep their numbers in the file (line hints refer to them), right-aligned to the widest one,
+    # so find the last number first
+    last = 0
+    for last, _ in iter_numbered_lines(open_file, rel_path, suppress_comments):
+        pass
+    width = len(str(last))
+
+    def numbered():
+        for number, line in iter_numbered_lines(open_file, rel_path, suppress_comments):
+            text = line.rstrip('\r\n')
+            yield f"{number:{width}} | {text}" + ('\n' if number < last else '')
+
+    yield from _batch(numbered())
+
+
+def _batch(pieces: Iterable[str]) -> Iterator[str]:
+    buffer = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= CHUNK_SIZE:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def render_summary(source, base: str, filter_patterns: Optional[str] = None,
+                   exclude_patterns: Optional[str] = None, case_sensitive: bool = False,
+                   suppress_comments: bool = False, line_number: bool = False) -> Iterator[str]:
+    """Renders a template.j2-compatible summary of the source's text files as text chunks."""
+    try:
+        paths = select_paths(source.list_files(), filter_patterns, exclude_patterns, case_sensitive)
+
+        yield "# Code summary\n"
+        yield from _batch(f"- {base}/{p}\n" for p in paths)
+        yield "\n\n## Files\n\n"
+        for path in paths:
+            friendly_path = f"{base}/{path}"
+            yield f"\n# File {friendly_path}\n"
+            yield from iter_file_content(lambda: source.open(path), path, suppress_comments, line_number)
+            yield f"\n# EndFile {friendly_path}\n"
+    finally:
+        source.close()
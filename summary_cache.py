@@ -0,0 +1,287 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+GZIP_LEVEL = 6
+SUFFIX = '.json.gz'
+INDEX_NAME = 'index.sqlite3'
+# Temporary files untouched for this long were left by writers that died
+STALE_TMP_SECONDS = 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+"""
+
+
+def gzip_compressor():
+    # wbits 31: a gzip stream (with a zero mtime, so equal documents compress to equal bytes)
+    return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+
+def gzip_compress(data: bytes) -> bytes:
+    compressor = gzip_compressor()
+    return compressor.compress(data) + compressor.flush()
+
+
+def normalize_patterns(patterns: Optional[str], case_sensitive: bool) -> str:
+    """Comma-separated patterns in a canonical order, so equivalent option sets share a cache entry."""
+    if not patterns:
+        return ""
+    items = {p.strip() for p in patterns.split(',') if p.strip()}
+    if not case_sensitive:
+        items = {p.lower() for p in items}
+    return ','.join(sorted(items))
+
+
+class SummaryCache:
+    """
+    Two-tier, content-addressed cache of rendered repository summaries.
+
+    Each entry is a complete JSON response body, stored gzip-compressed so
+    it can be sent as is to clients that accept gzip.
+
+    Entries are keyed by the repository, the resolved commit SHA and the
+    normalized summary options, so a key never goes stale: a new commit or a
+    different option set simply produces a different key. Both tiers are
+    bounded by size and evict the least recently used entries first.
+
+    The disk tier can be shared by several processes: entries are written
+    atomically, and their sizes and last accesses are kept in a SQLite index
+    beside them, so the disk limit bounds the entries of every process
+    together.
+    """
+
+    def __init__(self, cache_dir: Path, memory_limit: int, disk_limit: int):
+        self.cache_dir = cache_dir
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_sizes: Dict[str, int] = {}
+        self._memory_bytes = 0
+        self._counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'memory_evictions': 0,
+            'disk_evictions': 0,
+        }
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(cache_dir / INDEX_NAME), check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        self._db_lock = threading.Lock()
+        self._reconcile_disk()
+
+    @staticmethod
+    def make_key(user: str, repo: str, commit_sha: str, **options) -> str:
+        payload = json.dumps({'user': user, 'repo': repo, 'commit': commit_sha, 'options': options},
+                             sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """The entry's gzip-compressed document."""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self._counters['memory_hits'] += 1
+                return data
+
+        if self._entry_path(key).is_file():
+            data = self._read_disk(key)
+            if data is not None:
+                with self._lock:
+                    self._counters['disk_hits'] += 1
+                    self._remember(key, data)
+                return data
+
+        with self._lock:
+            self._counters['misses'] += 1
+        return None
+
+    def put(self, key: str, document: bytes) -> bytes:
+        """Compresses and stores a document; returns the compressed bytes."""
+        data = gzip_compress(document)
+        with self._lock:
+            self._remember(key, data)
+        self._write_disk(key, data)
+        return data
+
+    def writer(self, key: str) -> "SummaryCacheWriter":
+        """Incrementally compresses a document straight to the disk tier, for output too large to buffer."""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        return SummaryCacheWriter(self, key)
+
+    def stats(self) -> Dict[str, int]:
+        with self._db_lock:
+            disk_entries, disk_bytes = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        with self._lock:
+            return dict(
+                self._counters,
+                memory_entries=len(self._memory),
+                memory_bytes=self._memory_bytes,
+                disk_entries=disk_entries,
+                disk_bytes=disk_bytes,
+            )
+
+    def _remember(self, key: str, data: bytes):
+        """Adds an entry to the memory tier. Caller must hold the lock."""
+        size = len(data)
+        if size > self.memory_limit:
+            return
+        if key in self._memory:
+            self._memory_bytes -= self._memory_sizes[key]
+        self._memory[key] = data
+        self._memory.move_to_end(key)
+        self._memory_sizes[key] = size
+        self._memory_bytes += size
+        while self._memory_bytes > self.memory_limit:
+            evicted, _ = self._memory.popitem(last=False)
+            self._memory_bytes -= self._memory_sizes.pop(evicted)
+            self._counters['memory_evictions'] += 1
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}{SUFFIX}"
+
+    def _reconcile_disk(self):
+        """Brings the shared index in line with the files on disk, and removes leftovers of dead writers."""
+        # Uncompressed entries of earlier versions
+        for path in self.cache_dir.glob("*.summary"):
+            path.unlink(missing_ok=True)
+        stale = time.time() - STALE_TMP_SECONDS
+        on_disk = {}
+        for path in self.cache_dir.iterdir():
+            try:
+                stat = path.stat()
+                if path.name.endswith('.tmp'):
+                    if stat.st_mtime < stale:
+                        path.unlink()
+                elif path.name.endswith(SUFFIX):
+                    on_disk[path.name[:-len(SUFFIX)]] = (stat.st_size, stat.st_mtime)
+            except OSError:
+                continue
+        with self._db_lock, self._db:
+            indexed = {key for key, in self._db.execute("SELECT key FROM entries")}
+            self._db.executemany("INSERT OR IGNORE INTO entries (key, size, last_access) VALUES (?, ?, ?)",
+                                 [(key, size, mtime) for key, (size, mtime) in on_disk.items() if key not in indexed])
+            gone = [key for key in indexed - on_disk.keys() if not self._entry_path(key).exists()]
+            self._db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key in gone])
+            evicted = self._evict_over_limit()
+        self._unlink_entries(evicted)
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        path = self._entry_path(key)
+        try:
+            data = path.read_bytes()
+        except OSError:
+            with self._db_lock, self._db:
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            return None
+        self._account_disk(key, len(data))
+        return data
+
+    def _write_disk(self, key: str, data: bytes):
+        if len(data) > self.disk_limit:
+            return
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._entry_path(key))
+        except OSError as e:
+            logging.warning(f"Could not write summary cache entry {key}: {e}")
+            return
+        self._account_disk(key, len(data))
+
+    def _account_disk(self, key: str, size: int):
+        """Records an entry as just used, and evicts the least recently used entries over the disk limit."""
+        with self._db_lock, self._db:
+            # The write starts the transaction, so other processes wait until the evictions are recorded
+            self._db.execute("INSERT OR REPLACE INTO entries (key, size, last_access) VALUES (?, ?, ?)",
+                             (key, size, time.time()))
+            evicted = self._evict_over_limit()
+        self._unlink_entries(evicted)
+
+    def _evict_over_limit(self) -> List[str]:
+        """Removes the least recently used entries from the index until they fit. Caller must hold _db_lock."""
+        total, = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()
+        evicted = []
+        if total > self.disk_limit:
+            for key, size in self._db.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall():
+                if total <= self.disk_limit:
+                    break
+                evicted.append(key)
+                total -= size
+            self._db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key in evicted])
+        with self._lock:
+            self._counters['disk_evictions'] += len(evicted)
+        return evicted
+
+    def _unlink_entries(self, keys: List[str]):
+        for key in keys:
+            try:
+                self._entry_path(key).unlink()
+            except OSError:
+                pass
+
+    def close(self):
+        with self._db_lock:
+            self._db.close()
+
+
+class SummaryCacheWriter:
+    def __init__(self, cache: SummaryCache, key: str):
+        self.cache = cache
+        self.key = key
+        self.size = 0
+        self.compressor = gzip_compressor()
+        fd, self.tmp_path = tempfile.mkstemp(dir=cache.cache_dir, suffix='.tmp')
+        self.file = os.fdopen(fd, 'wb')
+
+    def write(self, data: bytes):
+        if self.file is None:
+            return
+        self._write(self.compressor.compress(data))
+
+    def _write(self, compressed: bytes):
+        self.size += len(compressed)
+        if self.size > self.cache.disk_limit:
+            self.discard()
+            return
+        self.file.write(compressed)
+
+    def commit(self):
+        if self.file is None:
+            return
+        self._write(self.compressor.flush())
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        os.replace(self.tmp_path, self.cache._entry_path(self.key))
+        self.cache._account_disk(self.key, self.size)
+
+    def discard(self):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        try:
+            os.unlink(self.tmp_path)
+        except OSError:
+            pass
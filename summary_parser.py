@@ -0,0 +1,196 @@
+"""
+Single-pass, line-oriented tokenizer for the summary edit format:
+
+    # File <path>[::<command>]
+    <content>
+    # EndFile <path>
+
+It produces the same blocks as the regex
+
+    # File (.*?)(::.*?)?\\n(.*?)# EndFile \\1      (re.DOTALL)
+
+applied with finditer: the path runs up to the first '::' or the end of the
+header line, a block ends at the first occurrence of '# EndFile <path>'
+(headers inside a block are content), scanning resumes right after that
+marker, and a header that is never closed is skipped so the blocks inside it
+are found instead. It is linear in the input: while a block is open, the
+headers inside it are recorded with the first footer that would close each
+of them, so an unterminated block is resolved at the end of input without
+rescanning its lines. Paths that only close through a multi-line match of
+the regex are not supported.
+"""
+import codecs
+from typing import AsyncIterable, AsyncIterator, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+HEADER = '# File '
+FOOTER = '# EndFile '
+
+
+class FileBlock(NamedTuple):
+    path: str
+    command: Optional[str]
+    content: str
+
+
+class SummaryTokenizer:
+    """Incremental tokenizer: feed() lines (with their line endings) and collect finished blocks."""
+
+    def __init__(self):
+        self._path: Optional[str] = None
+        self._command: Optional[str] = None
+        self._footer = ''
+        self._reset()
+
+    def _reset(self):
+        # The lines after an open header: its content, or what to fall back to if it is never closed
+        self._pending: List[str] = []
+        # Headers inside the open block, as (index in _pending, offset, path, command), with the
+        # position of the first footer that closes each one, if any has been seen yet
+        self._headers: List[Tuple[int, int, str, Optional[str]]] = []
+        self._closes: List[Optional[Tuple[int, int]]] = []
+        # The headers still waiting for a footer, in a trie of their paths (None keys the headers that end there)
+        self._waiting: Dict = {}
+
+    def feed(self, line: str) -> List[FileBlock]:
+        blocks = []
+        self._feed(line, blocks)
+        return blocks
+
+    def close(self) -> List[FileBlock]:
+        blocks = []
+        if self._path is not None:
+            self._recover(blocks)
+        return blocks
+
+    def _recover(self, blocks: List[FileBlock]):
+        """The open block was never closed: skip its header and take the blocks after it, as a rescan would."""
+        lines = self._pending
+        position = (0, 0)
+        for index, (line, offset, path, command) in enumerate(self._headers):
+            if (line, offset) < position:
+                continue
+            close = self._closes[index]
+            if close is None:
+                # Never closed either: the rest of its line is part of the header
+                position = (line + 1, 0)
+                continue
+            close_line, close_offset = close
+            content = ''.join(lines[line + 1:close_line]) + lines[close_line][:close_offset]
+            blocks.append(FileBlock(path.strip(), command, content.strip()))
+            position = (close_line, close_offset + len(FOOTER) + len(path))
+        self._path = None
+        self._reset()
+
+    def _feed(self, line: str, blocks: List[FileBlock]):
+        while line:
+            if self._path is None:
+                line = self._scan_header(line)
+                continue
+            self._pending.append(line)
+            end = line.find(self._footer)
+            if end == -1:
+                self._record(len(self._pending) - 1, line)
+                return
+            content = ''.join(self._pending[:-1]) + line[:end]
+            blocks.append(FileBlock(self._path.strip(), self._command, content.strip()))
+            rest = line[end + len(self._footer):]
+            self._path = None
+            self._reset()
+            line = rest
+
+    def _record(self, index: int, line: str):
+        """Records the footers and headers of a line inside the open block."""
+        if self._waiting:
+            position = line.find(FOOTER)
+            while position != -1:
+                # Every waiting path that the text after the footer starts with
+                node = self._waiting
+                i = position + len(FOOTER)
+                while node is not None:
+                    headers = node.get(None)
+                    if headers:
+                        for header in headers:
+                            self._closes[header] = (index, position)
+                        headers.clear()
+                    node = node.get(line[i]) if i < len(line) else None
+                    i += 1
+                position = line.find(FOOTER, position + 1)
+
+        if not line.endswith('\n'):
+            return
+        offset = line.find(HEADER)
+        while offset != -1:
+            path, command = split_header(line[offset + len(HEADER):-1])
+            self._headers.append((index, offset, path, command))
+            self._closes.append(None)
+            node = self._waiting
+            for char in path:
+                node = node.setdefault(char, {})
+            node.setdefault(None, []).append(len(self._headers) - 1)
+            offset = line.find(HEADER, offset + 1)
+
+    def _scan_header(self, line: str) -> str:
+        start = line.find(HEADER)
+        if start == -1 or not line.endswith('\n'):
+            return ''
+        self._path, self._command = split_header(line[start + len(HEADER):-1])
+        self._footer = FOOTER + self._path
+        return ''
+
+
+def split_header(header: str) -> Tuple[str, Optional[str]]:
+    """The path and '::command' of a header line's text after '# File '."""
+    split = header.find('::')
+    if split == -1:
+        return header, None
+    return header[:split], header[split:].strip()
+
+
+def split_lines(text: str) -> Iterator[str]:
+    """Lines of text with their '\\n' endings (unlike str.splitlines, only '\\n' ends a line)."""
+    start = 0
+    while start < len(text):
+        end = text.find('\n', start)
+        if end == -1:
+            yield text[start:]
+            return
+        yield text[start:end + 1]
+        start = end + 1
+
+
+def iter_file_blocks(lines: Iterable[str]) -> Iterator[FileBlock]:
+    tokenizer = SummaryTokenizer()
+    for line in lines:
+        yield from tokenizer.feed(line)
+    yield from tokenizer.close()
+
+
+async def aiter_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[str]:
+    """Splits a stream of UTF-8 byte chunks (e.g. a request body) into lines."""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    partial: List[str] = []
+    async for chunk in chunks:
+        text = decoder.decode(chunk)
+        start = 0
+        while True:
+            end = text.find('\n', start)
+            if end == -1:
+                if start < len(text):
+                    partial.append(text[start:])
+                break
+            yield ''.join(partial) + text[start:end + 1]
+            partial = []
+            start = end + 1
+    rest = ''.join(partial) + decoder.decode(b'', final=True)
+    if rest:
+        yield rest
+
+
+async def aiter_file_blocks(chunks: AsyncIterable[bytes]) -> AsyncIterator[FileBlock]:
+    """Tokenizes a streamed summary as it arrives."""
+    tokenizer = SummaryTokenizer()
+    async for line in aiter_lines(chunks):
+        for block in tokenizer.feed(line):
+            yield block
+    for block in tokenizer.close():
+        yield block
@@ -0,0 +1,66 @@
+import os
+import subprocess
+import sys
+import tempfile
+import uuid
+from pathlib import Path
+from typing import Dict
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+# repo_controller reads its configuration when imported, and its templates relative to the working directory
+os.environ.setdefault('REPO_BASE_DIR', tempfile.mkdtemp(prefix='txtrepo-tests-'))
+os.chdir(ROOT)
+sys.path.insert(0, str(ROOT))
+
+IDENTITY = {
+    'GIT_AUTHOR_NAME': 'Test', 'GIT_AUTHOR_EMAIL': 'test@example.com',
+    'GIT_COMMITTER_NAME': 'Test', 'GIT_COMMITTER_EMAIL': 'test@example.com',
+}
+
+
+def git(*args: str, cwd: Path = None) -> str:
+    return subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True, text=True,
+                          env=dict(os.environ, **IDENTITY)).stdout
+
+
+class Remote:
+    """A bare repository reachable over file://, with a work tree to push commits to it from."""
+
+    def __init__(self, root: Path):
+        self.work = root / 'work'
+        self.bare = root / 'remote.git'
+        self.url = self.bare.as_uri()
+        self.work.mkdir()
+        git("init", "-q", "-b", "main", cwd=self.work)
+        git("init", "-q", "--bare", "-b", "main", str(self.bare))
+        # Partial clones need the server's consent, even over file://
+        git("config", "uploadpack.allowFilter", "true", cwd=self.bare)
+        git("remote", "add", "origin", self.url, cwd=self.work)
+
+    def commit(self, files: Dict[str, str], message: str = "Update") -> str:
+        for path, content in files.items():
+            (self.work / path).parent.mkdir(parents=True, exist_ok=True)
+            (self.work / path).write_text(content)
+        git("add", "-A", cwd=self.work)
+        git("commit", "-qm", message, cwd=self.work)
+        git("push", "-q", "origin", "main", cwd=self.work)
+        return git("rev-parse", "HEAD", cwd=self.work).strip()
+
+
+@pytest.fixture
+def remote(tmp_path) -> Remote:
+    remote = Remote(tmp_path)
+    remote.commit({'README.md': "# Test\n", 'main.py': "def add(x, y):\n    return x + y\n"}, "Initial commit")
+    return remote
+
+
+@pytest.fixture
+def github_url(remote, monkeypatch) -> str:
+    """A GitHub URL (of a repository new to the cache) that git fetches from the file:// remote."""
+    url = f"https://github.com/tests/repo-{uuid.uuid4().hex[:8]}.git"
+    monkeypatch.setenv('GIT_CONFIG_COUNT', '1')
+    monkeypatch.setenv('GIT_CONFIG_KEY_0', f'url.{remote.url}.insteadOf')
+    monkeypatch.setenv('GIT_CONFIG_VALUE_0', url)
+    return url
@@ -0,0 +1,37 @@
+import pytest
+from fastapi import HTTPException
+
+import repo_controller as rc
+from summary_parser import FileBlock
+
+
+@pytest.fixture
+def worktree(tmp_path):
+    worktree = tmp_path / 'worktrees' / 'u' / 'r' / 'tree'
+    worktree.mkdir(parents=True)
+    (worktree / 'main.py').write_text("print(1)\n")
+    return worktree
+
+
+def apply(worktree, *paths):
+    files = rc.parse_file_blocks([FileBlock(path, None, "changed") for path in paths], worktree, 'u', 'r')
+    return rc.update_repo(files, worktree)
+
+
+@pytest.mark.parametrize('path', ['../../other.git/hooks/post-checkout', 'sub/../../x', 'link/escape.txt'])
+def test_paths_outside_the_worktree_are_rejected_before_anything_is_written(worktree, path):
+    outside = worktree.parent.parent
+    (worktree / 'link').symlink_to(outside, target_is_directory=True)
+    before = sorted(p for p in worktree.parent.parent.parent.rglob('*'))
+
+    with pytest.raises(HTTPException) as error:
+        apply(worktree, 'main.py', path)
+    assert error.value.status_code == 400
+    assert sorted(p for p in worktree.parent.parent.parent.rglob('*')) == before
+    assert (worktree / 'main.py').read_text() == "print(1)\n"
+
+
+def test_names_starting_with_dots_are_allowed(worktree):
+    staged = apply(worktree, '..notes.txt', 'docs/..hidden/a.txt')
+    assert sorted(s.path.relative_to(worktree).as_posix() for s in staged) == ['..notes.txt', 'docs/..hidden/a.txt']
+    assert (worktree / '..notes.txt').read_text() == "changed"
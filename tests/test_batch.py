@@ -0,0 +1,31 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import repo_controller as rc
+
+
+@pytest.fixture
+def client():
+    # No lifespan: these requests are rejected or answered before any repository is touched
+    return TestClient(rc.app)
+
+
+@pytest.mark.parametrize('concurrency', [0, -1])
+def test_concurrency_below_one_is_rejected(client, concurrency):
+    response = client.post('/repo/batch', json={'repos': [], 'concurrency': concurrency})
+    assert response.status_code == 422
+
+
+@pytest.mark.parametrize('concurrency, used', [(None, rc.BATCH_CONCURRENCY), (1, 1),
+                                               (rc.BATCH_CONCURRENCY + 5, rc.BATCH_CONCURRENCY)])
+def test_concurrency_defaults_and_is_capped(client, monkeypatch, concurrency, used):
+    limits = []
+
+    async def stream_batch(entries, concurrency):
+        limits.append(concurrency)
+        yield b''
+
+    monkeypatch.setattr(rc, 'stream_batch', stream_batch)
+    body = {'repos': []} if concurrency is None else {'repos': [], 'concurrency': concurrency}
+    assert client.post('/repo/batch', json=body).status_code == 200
+    assert limits == [used]
@@ -0,0 +1,50 @@
+import pytest
+
+import git_objects
+from blob_index import BlobIndex, text_entries
+
+
+@pytest.fixture
+def numstat_paths(monkeypatch):
+    """The paths each binary_paths call was limited to."""
+    calls = []
+    binary_paths = git_objects.binary_paths
+
+    def recording(git_dir, rev, paths=None):
+        calls.append(None if paths is None else sorted(paths))
+        return binary_paths(git_dir, rev, paths)
+
+    monkeypatch.setattr('blob_index.binary_paths', recording)
+    return calls
+
+
+def test_binary_files_are_checked_once_per_blob(remote, tmp_path, numstat_paths):
+    (remote.work / 'logo.png').write_bytes(b'\x89PNG\r\n\x1a\n\0\0\0\rIHDR')
+    first = remote.commit({'lib/util.py': "VALUE = 1\n"})
+    (remote.work / 'copy.png').write_bytes((remote.work / 'logo.png').read_bytes())
+    second = remote.commit({'lib/util.py': "VALUE = 2\n", 'lib/new.py': "import util\n"})
+    index = BlobIndex(tmp_path / 'blobs.sqlite3')
+    try:
+        entries = text_entries(remote.work, first, None, index)
+        assert [e.path for e in entries] == ['README.md', 'lib/util.py', 'main.py']
+        assert numstat_paths == [['README.md', 'lib/util.py', 'logo.png', 'main.py']]
+
+        # Only blobs the second commit added are checked; copy.png is a known blob under a new name
+        entries = text_entries(remote.work, second, None, index)
+        assert [e.path for e in entries] == ['README.md', 'lib/new.py', 'lib/util.py', 'main.py']
+        assert numstat_paths[1:] == [['lib/new.py', 'lib/util.py']]
+
+        text_entries(remote.work, second, ['copy.png', 'main.py'], index)
+        assert len(numstat_paths) == 2
+        assert index.stats()['binary_entries'] == 6
+    finally:
+        index.close()
+
+
+def test_without_an_index_every_file_is_checked(remote, numstat_paths):
+    (remote.work / 'data.bin').write_bytes(b'\0\1\2')
+    rev = remote.commit({})
+
+    assert [e.path for e in text_entries(remote.work, rev)] == ['README.md', 'main.py']
+    assert [e.path for e in text_entries(remote.work, rev)] == ['README.md', 'main.py']
+    assert numstat_paths == [None, None]
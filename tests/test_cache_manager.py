@@ -0,0 +1,103 @@
+import asyncio
+import time
+
+import pytest
+
+from cache_manager import RepoCacheEntry, RepoCacheManager, RepoIndex
+
+NOW = 1_000_000.0
+
+
+@pytest.fixture
+def cache(tmp_path):
+    index = RepoIndex(tmp_path / '.index' / 'repos.sqlite3')
+    cache = RepoCacheManager(tmp_path / 'repos', 3600, 1000, index, tmp_path / '.locks')
+    yield cache
+    index.close()
+
+
+def clone(cache, name, last_access, size):
+    """A clone directory under base_dir, indexed as last used at last_access."""
+    path = cache.base_dir / 'u' / name
+    path.mkdir(parents=True)
+    (path / 'HEAD').write_text("ref: refs/heads/main\n")
+    cache.index.put(RepoCacheEntry(path, last_access, size))
+    return path
+
+
+def release(cache, victims):
+    for entry in victims:
+        cache._evicting.pop(entry.path).release()
+
+
+def test_expired_clones_are_selected_oldest_first(cache):
+    clone(cache, 'fresh', NOW - 60, 100)
+    clone(cache, 'newer', NOW - 7200, 100)
+    clone(cache, 'older', NOW - 9000, 100)
+
+    victims = cache.select_victims(NOW)
+    assert [e.path.name for e in victims] == ['older', 'newer']
+    release(cache, victims)
+
+
+def test_least_recently_used_clones_are_selected_until_the_total_fits(cache):
+    clone(cache, 'a', NOW - 30, 400)
+    clone(cache, 'b', NOW - 20, 400)
+    clone(cache, 'c', NOW - 10, 400)
+    clone(cache, 'd', NOW, 400)
+
+    # Nothing has expired; 1600 bytes are over the budget of 1000 until the two oldest go
+    victims = cache.select_victims(NOW)
+    assert [e.path.name for e in victims] == ['a', 'b']
+    release(cache, victims)
+
+
+def test_clones_in_use_are_skipped(cache, tmp_path):
+    used = clone(cache, 'used', NOW - 9000, 100)
+    elsewhere = clone(cache, 'elsewhere', NOW - 8000, 100)
+    clone(cache, 'idle', NOW - 7000, 100)
+    cache.pin(used)
+    # Another process's manager over the same lock_dir
+    other = RepoCacheManager(cache.base_dir, cache.ttl, cache.max_bytes, cache.index, cache.lock_dir)
+    other.pin(elsewhere)
+    try:
+        victims = cache.select_victims(NOW)
+        assert [e.path.name for e in victims] == ['idle']
+        release(cache, victims)
+    finally:
+        cache.unpin(used)
+        other.unpin(elsewhere)
+
+
+def test_sweep_removes_victims_and_their_index_entries(cache):
+    kept = clone(cache, 'kept', time.time(), 100)
+    expired = clone(cache, 'expired', time.time() - 7200, 100)
+    cache.pin(kept)
+    cache.unpin(kept)
+    evicted = []
+
+    assert asyncio.run(cache.sweep(evicted.append)) == 1
+    assert evicted == [expired]
+    assert not expired.exists()
+    assert [e.path.name for e in cache.index.entries()] == ['kept']
+    assert cache.stats()['evictions'] == 1
+    assert cache._evicting == {}
+    # The evicted clone's lock file goes with it
+    assert [p.name for p in (cache.lock_dir / 'u').iterdir()] == ['kept.lock']
+
+
+def test_rebuild_indexes_clones_and_removes_half_finished_ones(cache):
+    finished = clone(cache, 'repo', NOW, 0)
+    (finished / 'objects').mkdir()
+    (finished / 'objects' / 'pack').write_bytes(b'x' * 10)
+    half = cache.base_dir / 'u' / '.repo.cloning'
+    (half / 'objects').mkdir(parents=True)
+    (cache.base_dir / '.blob_index').mkdir()
+    cache.index.put(RepoCacheEntry(cache.base_dir / 'u' / 'gone', NOW, 100))
+
+    cache.rebuild()
+    assert not half.exists()
+    assert (cache.base_dir / '.blob_index').exists()
+    [entry] = cache.index.entries()
+    assert entry.path == finished
+    assert entry.size == len("ref: refs/heads/main\n") + 10
@@ -0,0 +1,94 @@
+import asyncio
+import time
+import uuid
+
+import pytest
+
+import repo_controller as rc
+from conftest import git
+
+
+@pytest.fixture
+def repo_name():
+    return 'tests', f"repo-{uuid.uuid4().hex[:8]}"
+
+
+@pytest.fixture
+def git_calls(monkeypatch):
+    """The git subcommands repo_controller runs."""
+    calls = []
+    run_git = rc.run_git
+
+    async def recording_run_git(*args, **kwargs):
+        calls.append(args[0])
+        return await run_git(*args, **kwargs)
+
+    monkeypatch.setattr(rc, 'run_git', recording_run_git)
+    return calls
+
+
+def get_cached_repo(remote, repo_name):
+    return asyncio.run(rc.get_cached_repo(remote.url, 'main', *repo_name))
+
+
+def missing_objects(repo_path) -> list:
+    listing = git("rev-list", "--objects", "--all", "--missing=print", cwd=repo_path)
+    return [line for line in listing.splitlines() if line.startswith('?')]
+
+
+def test_full_clone_has_every_object(remote, repo_name, monkeypatch):
+    monkeypatch.setattr(rc, 'CLONE_FILTER', '')
+    repo_path = get_cached_repo(remote, repo_name)
+
+    assert (repo_path / 'HEAD').exists()
+    assert git("config", "--get", "core.bare", cwd=repo_path).strip() == 'true'
+    assert missing_objects(repo_path) == []
+
+
+def test_blobless_clone_fetches_blobs_on_demand(remote, repo_name, monkeypatch):
+    monkeypatch.setattr(rc, 'CLONE_FILTER', 'blob:none')
+    repo_path = get_cached_repo(remote, repo_name)
+
+    assert git("config", "--get", "remote.origin.partialclonefilter", cwd=repo_path).strip() == 'blob:none'
+    assert missing_objects(repo_path)
+    # Reading a file still works: git fetches the blob from the promisor remote
+    assert git("show", "main:main.py", cwd=repo_path) == "def add(x, y):\n    return x + y\n"
+
+
+def test_unchanged_remote_tip_skips_fetch(remote, repo_name, git_calls, monkeypatch):
+    monkeypatch.setattr(rc, 'FETCH_TTL', 0)
+    get_cached_repo(remote, repo_name)
+    git_calls.clear()
+
+    get_cached_repo(remote, repo_name)
+    assert git_calls == ['ls-remote']
+
+    git_calls.clear()
+    sha = remote.commit({'main.py': "def add(x, y):\n    return y + x\n"})
+    repo_path = get_cached_repo(remote, repo_name)
+    assert git_calls == ['ls-remote', 'fetch']
+    assert git("rev-parse", "refs/heads/main", cwd=repo_path).strip() == sha
+
+
+def test_branch_checked_within_ttl_is_used_as_is(remote, repo_name, git_calls, monkeypatch):
+    monkeypatch.setattr(rc, 'FETCH_TTL', 60)
+    repo_path = get_cached_repo(remote, repo_name)
+    remote.commit({'main.py': "changed\n"})
+    git_calls.clear()
+
+    get_cached_repo(remote, repo_name)
+    assert git_calls == []
+
+    # Once the TTL has passed the branch is checked (and here fetched) again
+    rc.repo_cache.index.set_branch_checked(repo_path, 'main', time.time() - 61)
+    get_cached_repo(remote, repo_name)
+    assert git_calls == ['ls-remote', 'fetch']
+
+
+def test_shallow_clone_keeps_only_recent_history(remote, repo_name, monkeypatch):
+    remote.commit({'main.py': "second\n"})
+    monkeypatch.setattr(rc, 'CLONE_DEPTH', 1)
+    repo_path = get_cached_repo(remote, repo_name)
+
+    assert git("rev-parse", "--is-shallow-repository", cwd=repo_path).strip() == 'true'
+    assert git("rev-list", "--count", "refs/heads/main", cwd=repo_path).strip() == '1'
@@ -0,0 +1,59 @@
+import asyncio
+import threading
+import time
+
+from coordination import FileLock, ProcessLocks
+from git_ops import KeyedLocks
+
+
+def test_keyed_locks_are_dropped_without_waiters():
+    locks = KeyedLocks()
+    order = []
+
+    async def hold(name):
+        async with locks.hold('repo'):
+            order.append(name)
+            await asyncio.sleep(0)
+            assert locks.is_locked('repo')
+
+    async def run():
+        await asyncio.gather(hold('first'), hold('second'))
+        assert locks.waiters('repo') == 0
+        assert not locks.is_locked('repo')
+
+    asyncio.run(run())
+    assert order == ['first', 'second']
+    assert locks._locks == {} and locks._users == {}
+
+
+def test_process_lock_files_are_deleted_by_the_last_waiter(tmp_path):
+    locks = ProcessLocks(tmp_path)
+    path = locks.path(('fetch', 'u/r'))
+
+    async def hold():
+        async with locks.hold(('fetch', 'u/r')):
+            assert path.exists()
+            await asyncio.sleep(0)
+
+    async def run():
+        await asyncio.gather(hold(), hold())
+
+    asyncio.run(run())
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_lock_on_a_deleted_file_is_taken_again_on_its_replacement(tmp_path):
+    holder, waiter, newcomer = (FileLock(tmp_path / 'clone.lock') for _ in range(3))
+    holder.acquire()
+    # The waiter blocks on the file the holder is about to delete
+    waiting = threading.Thread(target=waiter.acquire, kwargs={'shared': True})
+    waiting.start()
+    time.sleep(0.05)
+    holder.release(unlink=True)
+    waiting.join()
+
+    # Both lock the file now at the path, so an exclusive lock still excludes the waiter
+    assert not newcomer.acquire(blocking=False)
+    waiter.release()
+    assert newcomer.acquire(blocking=False)
+    newcomer.release()
@@ -0,0 +1,38 @@
+import asyncio
+import gzip
+import json
+from pathlib import Path
+
+import pytest
+
+import repo_controller as rc
+
+PLAN = rc.SummaryPlan(Path('/nonexistent'), 'a' * 40, None, 'k' * 64)
+
+
+@pytest.fixture(autouse=True)
+def cached_plan(monkeypatch):
+    async def plan_branch_summary(*args, **kwargs):
+        return PLAN
+
+    async def cached_summary(cache_key):
+        return gzip.compress(json.dumps({'summary': "text"}).encode())
+
+    monkeypatch.setattr(rc, 'plan_branch_summary', plan_branch_summary)
+    monkeypatch.setattr(rc, 'cached_summary', cached_summary)
+
+
+def summarize(if_none_match=None, accept_encoding=''):
+    return asyncio.run(rc.summarize_branch('https://github.com/u/r.git', 'main', 'u', 'r', None, None, False, False,
+                                           False, False, if_none_match=if_none_match,
+                                           accept_encoding=accept_encoding))
+
+
+@pytest.mark.parametrize('accept_encoding', ['', 'gzip, deflate', 'gzip;q=0', 'br, *'])
+def test_not_modified_has_the_etag_of_the_full_response(accept_encoding):
+    etag = summarize(accept_encoding=accept_encoding).headers['etag']
+    for if_none_match in (etag, rc.summary_etag(PLAN.commit_sha, PLAN.cache_key),
+                          'W/' + rc.summary_etag(PLAN.commit_sha, PLAN.cache_key, gzipped=True)):
+        response = summarize(if_none_match, accept_encoding)
+        assert response.status_code == 304
+        assert response.headers['etag'] == etag
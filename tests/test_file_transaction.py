@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+import file_transaction
+from dsl.inject_at_line import InjectAtLineInstruction
+from file_transaction import ApplyError, FileTransaction
+
+ORIGINAL = {'a.txt': "a\n", 'b.txt': "b\n", 'c.txt': "c\n"}
+
+
+@pytest.fixture
+def checkout(tmp_path):
+    for name, content in ORIGINAL.items():
+        (tmp_path / name).write_text(content)
+    return tmp_path
+
+
+def blocks(*failing):
+    """Blocks rewriting a.txt, b.txt and c.txt in turn, then adding d.txt; the given files' blocks fail."""
+    result = [{'path': name, 'content': f"new {name}",
+               'dsl': InjectAtLineInstruction.parse('1@0000000000000') if name in failing else None} for name in ORIGINAL]
+    return result + [{'path': 'd.txt', 'content': "new d.txt", 'dsl': None}]
+
+
+def tree(checkout):
+    return {p.name: p.read_text() for p in sorted(checkout.iterdir())}
+
+
+def test_failing_block_changes_nothing(checkout):
+    with pytest.raises(ApplyError, match="c.txt"):
+        FileTransaction(lambda path: checkout / path).apply(blocks('c.txt'))
+    assert tree(checkout) == ORIGINAL
+
+
+def test_failure_while_replacing_restores_earlier_files(checkout, monkeypatch):
+    replace = os.replace
+
+    def failing_replace(src, dst):
+        if os.fspath(dst) == os.fspath(checkout / 'c.txt') and os.fspath(src).endswith('.tmp'):
+            raise OSError("disk full")
+        replace(src, dst)
+
+    monkeypatch.setattr(file_transaction.os, 'replace', failing_replace)
+    with pytest.raises(OSError, match="disk full"):
+        FileTransaction(lambda path: checkout / path, workers=1).apply(blocks())
+    # a.txt and b.txt were already replaced and come back from their backups; no temporary files are left
+    assert tree(checkout) == ORIGINAL
+
+
+def test_all_files_change_together(checkout):
+    changed = FileTransaction(lambda path: checkout / path).apply(blocks())
+    assert [s.path.name for s in changed] == ['a.txt', 'b.txt', 'c.txt', 'd.txt']
+    assert tree(checkout) == {name: f"new {name}" for name in ['a.txt', 'b.txt', 'c.txt', 'd.txt']}
@@ -0,0 +1,103 @@
+import asyncio
+import os
+import stat
+import time
+
+from job_queue import FAILED, SUCCEEDED, JobStore, JobTimings, read_payload
+from metrics import recording, stage
+
+
+def test_store_files_are_private(tmp_path):
+    path = tmp_path / 'jobs' / 'jobs.sqlite3'
+    store = JobStore(path)
+    store.create('pull_request', 'u/r', {}, secret='ghp_token')
+    try:
+        assert stat.S_IMODE(path.parent.stat().st_mode) == 0o700
+        assert stat.S_IMODE(store.payload_dir.stat().st_mode) == 0o700
+        for file in path.parent.iterdir():
+            if file.is_file():
+                assert stat.S_IMODE(file.stat().st_mode) == 0o600, file.name
+    finally:
+        store.close()
+
+
+def test_finished_job_leaves_no_secret_on_disk(tmp_path):
+    path = tmp_path / 'jobs.sqlite3'
+    store = JobStore(path)
+    job_id = store.create('pull_request', 'u/r', {}, payload=['block'], secret='ghp_supersecrettoken')
+    store.claim('worker')
+    store.finish(job_id, SUCCEEDED, {})
+    try:
+        assert store.get(job_id).secret is None
+        for file in tmp_path.rglob('*'):
+            if file.is_file():
+                assert b'supersecrettoken' not in file.read_bytes(), file.name
+    finally:
+        store.close()
+
+
+def test_spooled_payload_is_read_back_and_removed_when_finished(tmp_path):
+    store = JobStore(tmp_path / 'jobs.sqlite3')
+    spool = store.spool()
+    spool.write(['a.py', 'print(1)\n', None, None])
+    spool.write_all([['b.py', 'ünïcode\n', 'edit', None]])
+    spool.close()
+    try:
+        assert stat.S_IMODE(spool.path.stat().st_mode) == 0o600
+        job_id = store.create('pull_request', 'u/r', {}, payload_path=str(spool.path))
+        job = store.claim('worker')
+        assert job.payload is None
+        assert list(read_payload(job.payload_path)) == [['a.py', 'print(1)\n', None, None],
+                                                         ['b.py', 'ünïcode\n', 'edit', None]]
+        store.finish(job_id, FAILED, {}, error='boom')
+        assert not spool.path.exists()
+        assert store.get(job_id).payload_path is None
+    finally:
+        store.close()
+
+
+def test_purge_removes_only_old_unreferenced_payloads(tmp_path):
+    store = JobStore(tmp_path / 'jobs.sqlite3')
+    orphan, queued, fresh = store.spool(), store.spool(), store.spool()
+    for spool in (orphan, queued, fresh):
+        spool.close()
+    store.create('pull_request', 'u/r', {}, payload_path=str(queued.path))
+    old = time.time() - 2 * 3600
+    for spool in (orphan, queued):
+        os.utime(spool.path, (old, old))
+    try:
+        store.purge(86400)
+        assert not orphan.path.exists()
+        assert queued.path.exists()
+        assert fresh.path.exists()
+    finally:
+        store.close()
+
+
+def test_stage_writes_do_not_block_the_event_loop(tmp_path, monkeypatch):
+    store = JobStore(tmp_path / 'jobs.sqlite3')
+    job_id = store.create('pull_request', 'u/r', {})
+    job = store.claim('worker')
+    # A write waiting on another process's transaction
+    set_stage = store.set_stage
+    monkeypatch.setattr(store, 'set_stage', lambda *args: (time.sleep(0.5), set_stage(*args)))
+
+    async def run():
+        timings = JobTimings(store, job.id)
+        with recording(timings):
+            start = time.perf_counter()
+            with stage('clone'):
+                pass
+            with stage('apply'):
+                pass
+            blocked = time.perf_counter() - start
+        await timings.flush()
+        return blocked
+
+    try:
+        assert asyncio.run(run()) < 0.1
+        stored = store.get(job_id)
+        assert stored.stage == 'apply'
+        assert set(stored.timings) == {'clone'}
+    finally:
+        store.close()
@@ -0,0 +1,92 @@
+import pytest
+
+import repo_controller as rc
+from dsl.edit_section import EditSectionInstruction
+from dsl.inject_at_line import InjectAtLineInstruction
+from file_transaction import StagedFile
+from git_objects import blob_sha
+from summary_parser import FileBlock
+
+ORIGINAL = ''.join(f"L{i}\n" for i in range(1, 21))
+SHA = blob_sha(ORIGINAL.encode())[:12]
+
+
+@pytest.fixture
+def checkout(tmp_path):
+    (tmp_path / 'f.txt').write_text(ORIGINAL)
+    return tmp_path
+
+
+def apply(checkout, *blocks):
+    files = rc.parse_file_blocks([FileBlock('f.txt', command, content) for command, content in blocks], checkout)
+    rc.update_repo(files, checkout)
+    return files, (checkout / 'f.txt').read_text().splitlines()
+
+
+@pytest.mark.parametrize('hint', [f'@{SHA}', ''])
+def test_injects_refer_to_the_original_lines_in_any_order(checkout, hint):
+    for blocks in ([(f'::inject-at-line:9{hint}', 'AT9'), (f'::inject-at-line:10{hint}', 'AT10')],
+                   [(f'::inject-at-line:10{hint}', 'AT10'), (f'::inject-at-line:9{hint}', 'AT9')]):
+        (checkout / 'f.txt').write_text(ORIGINAL)
+        _, lines = apply(checkout, *blocks)
+        assert lines[7:12] == ['L8', 'AT9', 'L9', 'AT10', 'L10']
+
+
+def test_hints_are_ordered_by_number_not_text():
+    files = [{'pathAndCommand': f'f.txt::inject-at-line:{n}'} for n in (9, 10, 100, 2)]
+    files.append({'pathAndCommand': 'f.txt'})
+    assert [f['pathAndCommand'] for f in rc.apply_order(files)] == [
+        'f.txt::inject-at-line:100', 'f.txt::inject-at-line:10', 'f.txt::inject-at-line:9',
+        'f.txt::inject-at-line:2', 'f.txt']
+
+
+def test_edit_section_hint_follows_earlier_edits(checkout):
+    # The edit-section block is applied after the injects above it
+    files, lines = apply(checkout,
+                         (f'::edit-section:12@{SHA}', "L12\n---L13\n+++changed 13\n+++added\nL14"),
+                         (f'::inject-at-line:3@{SHA}', "first\nsecond"),
+                         (f'::inject-at-line:5@{SHA}', "third"))
+    assert lines[:7] == ['L1', 'L2', 'first', 'second', 'L3', 'L4', 'third']
+    assert lines[14:18] == ['L12', 'changed 13', 'added', 'L14']
+    edit = next(f['dsl'] for f in files if f['command'].startswith('::edit-section'))
+    assert [m['method'] for m in edit.matches] == ['hint']
+
+
+def test_edits_of_edit_section_move_later_hints(checkout):
+    staged = StagedFile(checkout / 'f.txt')
+    blocks = [(EditSectionInstruction.parse(f'2@{SHA}'), "L2\n---L3\n---L4\n+++new\nL5\n---L6\nL7"),
+              (InjectAtLineInstruction.parse(f'18@{SHA}'), "AT18"),
+              (EditSectionInstruction.parse(f'19@{SHA}'), "L19\n---L20\n+++changed 20")]
+    for instruction, content in blocks:
+        lines, _ = instruction.apply(staged, content, list(staged.read_lines()))
+        staged.write_lines(lines)
+    assert ''.join(staged.lines).splitlines() == [
+        'L1', 'L2', 'new', 'L5', 'L7', *(f'L{i}' for i in range(8, 18)), 'AT18', 'L18', 'L19', 'changed 20']
+    assert staged.line_edits == [(2, 2, 1), (4, 1, 0), (15, 0, 1), (18, 1, 1)]
+    assert blocks[2][0].matches[0]['method'] == 'hint'
+
+
+def test_hinted_inject_fails_after_the_file_was_rewritten(checkout):
+    staged = StagedFile(checkout / 'f.txt')
+    staged.write_text("rewritten\n")
+    with pytest.raises(ValueError, match="can no longer be located"):
+        InjectAtLineInstruction.parse(f'3@{SHA}').apply(staged, "AT3", list(staged.read_lines()))
+    # Without a blob SHA the line is taken as it is
+    lines, _ = InjectAtLineInstruction.parse('1').apply(staged, "AT1", list(staged.read_lines()))
+    assert lines == ["AT1\n", "rewritten\n"]
+
+
+@pytest.mark.parametrize('args', ['foo', '12x', '0', 'legacy args'])
+def test_edit_section_ignores_arguments_that_are_not_a_hint(args):
+    instruction = EditSectionInstruction.parse(args)
+    assert (instruction.line, instruction.blob_sha) == (None, None)
+
+
+def test_inject_requires_a_line_hint():
+    with pytest.raises(ValueError, match="Invalid line hint: foo"):
+        InjectAtLineInstruction.parse('foo')
+
+
+def test_edit_section_with_unknown_arguments_applies_by_search(checkout):
+    _, lines = apply(checkout, ('::edit-section:foo', "L2\n---L3\n+++three\nL4"))
+    assert lines[1:4] == ['L2', 'three', 'L4']
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import repo_controller as rc
+from conftest import git
+from summary_parser import FileBlock
+
+
+@pytest.fixture
+def client():
+    with TestClient(rc.app) as client:
+        yield client
+
+
+def preview(client, github_url, summary):
+    return client.post('/repo/preview', json={'git_url': github_url, 'summary': summary})
+
+
+def test_preview_of_an_added_file_and_an_edit_section(client, github_url, remote):
+    user, repo = rc.extract_repo_info(github_url)
+    summary = (f"# File /{user}/{repo}/new.txt\nhello\n# EndFile /{user}/{repo}/new.txt\n"
+               f"# File /{user}/{repo}/main.py::edit-section\ndef add(x, y):\n---    return x + y\n"
+               f"+++    return y + x\n# EndFile /{user}/{repo}/main.py\n")
+    response = preview(client, github_url, summary)
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body['commit'] == git("rev-parse", "HEAD", cwd=remote.work).strip()
+    files = {f['path']: f for f in body['files']}
+    added = files[f"/{user}/{repo}/new.txt"]
+    assert added['status'] == 'added'
+    assert '+hello' in added['diff']
+    edited = files[f"/{user}/{repo}/main.py"]
+    assert edited['status'] == 'modified'
+    assert '-    return x + y\n+    return y + x\n' in edited['diff']
+    [block] = edited['blocks']
+    assert block['command'] == 'edit-section'
+    assert [(m['line'], m['method']) for m in block['matches']] == [(2, 'search')]
+    # Nothing was written to the clone
+    assert not (rc.cached_repo_path(user, repo) / 'new.txt').exists()
+
+
+def test_preview_rejects_a_bad_dsl_argument(client, github_url):
+    user, repo = rc.extract_repo_info(github_url)
+    response = preview(client, github_url,
+                       f"# File /{user}/{repo}/b.txt::inject-at-line:abc\nx\n# EndFile /{user}/{repo}/b.txt\n")
+    assert response.status_code == 400
+    assert "Invalid line hint: abc" in response.json()['detail']
+
+
+def test_pull_request_job_fails_cleanly_on_a_bad_dsl_argument(github_url):
+    user, repo = rc.extract_repo_info(github_url)
+    pr_request = rc.PullRequestRequest(git_url=github_url, github_token='t', summary="")
+    blocks = [FileBlock(f"/{user}/{repo}/b.txt", '::inject-at-line:abc', "x")]
+
+    async def run():
+        async with rc.repo_cache.use(rc.cached_repo_path(user, repo)):
+            return await rc.create_pull_request_from_summary(pr_request, blocks, user, repo)
+
+    with pytest.raises(rc.HTTPException) as error:
+        asyncio.run(run())
+    assert error.value.status_code == 400
+    assert "Invalid line hint: abc" in error.value.detail
@@ -0,0 +1,39 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import repo_controller as rc
+from manifest import strip_base
+
+
+@pytest.fixture
+def client():
+    with TestClient(rc.app) as client:
+        yield client
+
+
+def base(github_url):
+    user, repo = rc.extract_repo_info(github_url)
+    return f"/{user}/{repo}"
+
+
+def test_listed_paths_are_rendered(client, github_url):
+    response = client.get('/repo/files', params={'git_url': github_url,
+                                                 'paths': [f"{base(github_url)}/main.py", 'README.md']})
+    assert response.status_code == 200
+    assert f"# File {base(github_url)}/main.py\n" in response.text
+    assert f"# File {base(github_url)}/README.md\n" in response.text
+
+
+@pytest.mark.parametrize('path', ['../../etc/passwd', 'src/../../x', 'a//b', './main.py', 'main.py\0'])
+def test_paths_outside_the_tree_are_rejected_before_streaming(client, github_url, path):
+    response = client.get('/repo/files', params={'git_url': github_url,
+                                                 'paths': [f"{base(github_url)}/main.py", path]})
+    assert response.status_code == 400
+    assert response.json()['detail'].startswith("Invalid path")
+
+
+def test_strip_base():
+    assert strip_base('/u/r/src/a.py', '/u/r') == 'src/a.py'
+    assert strip_base('/src/..a.py', '/u/r') == 'src/..a.py'
+    with pytest.raises(ValueError):
+        strip_base('/u/r/', '/u/r')
@@ -0,0 +1,66 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import repo_controller as rc
+from conftest import git
+
+
+@pytest.fixture
+def client():
+    with TestClient(rc.app) as client:
+        yield client
+
+
+def summarize(client, github_url, **params):
+    response = client.get('/repo', params={'git_url': github_url, **params})
+    assert response.status_code == 200
+    return response.json()
+
+
+def rendered_files(body):
+    return [line.split(' ', 2)[2] for line in body['summary'].split('\n') if line.startswith('# File ')]
+
+
+def test_only_changed_files_and_deleted_paths(client, github_url, remote):
+    user, repo = rc.extract_repo_info(github_url)
+    (remote.work / 'README.md').unlink()
+    since = remote.commit({'old.py': "OLD = 1\n"})
+    (remote.work / 'old.py').unlink()
+    head = remote.commit({'main.py': "def add(x, y):\n    return y + x\n", 'lib/new.py': "NEW = 1\n"})
+
+    body = summarize(client, github_url, since=since)
+    assert (body['since'], body['head']) == (since, head)
+    assert rendered_files(body) == [f"/{user}/{repo}/lib/new.py", f"/{user}/{repo}/main.py"]
+    assert body['deleted'] == [f"/{user}/{repo}/old.py"]
+
+    # The ETag of the earlier summary works as since too
+    etag = client.get('/repo', params={'git_url': github_url}, headers={'Accept-Encoding': 'identity'}).headers['etag']
+    body = summarize(client, github_url, since=etag)
+    assert (body['since'], rendered_files(body), body['deleted']) == (head, [], [])
+
+
+def test_unknown_since_commit_gives_a_full_summary(client, github_url):
+    user, repo = rc.extract_repo_info(github_url)
+    body = summarize(client, github_url, since='0' * 40)
+    assert body['since'] is None
+    assert rendered_files(body) == [f"/{user}/{repo}/README.md", f"/{user}/{repo}/main.py"]
+    assert body['deleted'] == []
+
+
+def test_since_commit_that_is_not_an_ancestor(client, github_url, remote):
+    user, repo = rc.extract_repo_info(github_url)
+    since = remote.commit({'dropped.py': "DROPPED = 1\n", 'main.py': "# rewritten\n"})
+    # The clone has the commit, then history is rewritten without it
+    summarize(client, github_url)
+    git("reset", "-q", "--hard", "HEAD~1", cwd=remote.work)
+    (remote.work / 'kept.py').write_text("KEPT = 1\n")
+    git("add", "kept.py", cwd=remote.work)
+    git("commit", "-qm", "Rewritten", cwd=remote.work)
+    git("push", "-qf", "origin", "main", cwd=remote.work)
+    head = git("rev-parse", "HEAD", cwd=remote.work).strip()
+
+    body = summarize(client, github_url, since=since)
+    # The difference between the two trees, as if since were an ancestor
+    assert (body['since'], body['head']) == (since, head)
+    assert rendered_files(body) == [f"/{user}/{repo}/kept.py", f"/{user}/{repo}/main.py"]
+    assert body['deleted'] == [f"/{user}/{repo}/dropped.py"]
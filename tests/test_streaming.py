@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+from fastapi import BackgroundTasks, Request
+
+import repo_controller as rc
+
+OPTIONS = dict(filter_patterns=None, exclude_patterns=None, case_sensitive=False, suppress_comments=False,
+               line_number=False)
+
+
+@pytest.fixture
+def evict_everything(monkeypatch):
+    # Every clone not in use is due for eviction
+    monkeypatch.setattr(rc.repo_cache, 'ttl', 0)
+    monkeypatch.setattr(rc, 'SUMMARY_ENGINE', 'native')
+    # The handlers are called directly, without the lifespan that opens the blob index
+    monkeypatch.setattr(rc, 'blob_index', None)
+
+
+async def streamed_clone_survives_sweep(repo_path, start_stream):
+    response = await start_stream()
+    # The handler has returned, so its repo_cache.use() is over; only the stream holds the clone now
+    await rc.repo_cache.sweep()
+    assert (repo_path / 'HEAD').exists()
+    body = b''.join([chunk async for chunk in response.body_iterator])
+    await rc.repo_cache.sweep()
+    assert not repo_path.exists()
+    return body
+
+
+def test_streamed_files_keep_the_clone(github_url, evict_everything):
+    user, repo = rc.extract_repo_info(github_url)
+
+    async def start_stream():
+        return await rc.get_repo_files(git_url=github_url, branch='main', commit=None, paths=None, page=1,
+                                       page_size=100, **OPTIONS)
+
+    body = asyncio.run(streamed_clone_survives_sweep(rc.cached_repo_path(user, repo), start_stream))
+    assert f"# File /{user}/{repo}/main.py\n".encode() in body
+
+
+def test_streamed_summary_keeps_the_clone(github_url, evict_everything):
+    user, repo = rc.extract_repo_info(github_url)
+    request = Request({'type': 'http', 'method': 'GET', 'path': '/repo', 'headers': [], 'query_string': b''})
+
+    async def start_stream():
+        return await rc.get_repo_summary(request, BackgroundTasks(), git_url=github_url, branch='main', stream=True,
+                                         since=None, max_tokens=None, strategy='recent', priority=None, **OPTIONS)
+
+    body = asyncio.run(streamed_clone_survives_sweep(rc.cached_repo_path(user, repo), start_stream))
+    assert body.startswith(b'{"summary": "# Code summary')
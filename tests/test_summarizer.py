@@ -0,0 +1,42 @@
+import io
+
+from summarizer import iter_file_content
+
+SOURCE = '''"""Module docstring."""
+# A comment line
+import os  # trailing comment
+
+
+def main():
+    # another comment
+    return os.getcwd()
+'''
+
+
+def render(source, path='main.py', **options):
+    return ''.join(iter_file_content(lambda: io.StringIO(source), path, **options))
+
+
+def test_line_numbers_are_positions_in_the_file_when_comments_are_stripped():
+    numbered = render(SOURCE, suppress_comments=True, line_number=True)
+    assert numbered == ('1 | """Module docstring."""\n'
+                        '3 | import os\n'
+                        '4 | \n'
+                        '5 | \n'
+                        '6 | def main():\n'
+                        '8 |     return os.getcwd()')
+    lines = SOURCE.splitlines()
+    for row in numbered.split('\n'):
+        number, _, text = row.partition(' | ')
+        assert lines[int(number) - 1].startswith(text)
+
+
+def test_numbers_are_aligned_to_the_last_line_kept():
+    source = ''.join(f"x = {i}\n" for i in range(1, 10)) + "y = 10\n# end\n"
+    numbered = render(source, suppress_comments=True, line_number=True).split('\n')
+    assert numbered[0] == " 1 | x = 1"
+    assert numbered[-1] == "10 | y = 10"
+
+
+def test_numbering_without_stripping_is_unchanged():
+    assert render("a\n# b\nc\n", line_number=True) == "1 | a\n2 | # b\n3 | c"
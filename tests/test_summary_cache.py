@@ -0,0 +1,82 @@
+import os
+import time
+
+import pytest
+
+from summary_cache import STALE_TMP_SECONDS, SummaryCache, gzip_compress
+
+
+def document(n: int) -> bytes:
+    return b'{"summary": "%d"}' % n
+
+
+# Every entry compresses to the same size; each tier holds two
+SIZE = len(gzip_compress(document(0)))
+
+
+@pytest.fixture
+def caches(tmp_path):
+    """Opens caches over one directory, as separate processes would."""
+    opened = []
+
+    def open_cache(memory_limit=2 * SIZE, disk_limit=2 * SIZE):
+        opened.append(SummaryCache(tmp_path, memory_limit, disk_limit))
+        return opened[-1]
+    yield open_cache
+    for cache in opened:
+        cache.close()
+
+
+def test_memory_tier_evicts_the_least_recently_used(caches):
+    cache = caches(disk_limit=0)
+    for n in range(2):
+        cache.put(f'k{n}', document(n))
+    assert cache.get('k0') == gzip_compress(document(0))
+
+    cache.put('k2', document(2))
+    assert cache.get('k1') is None
+    assert cache.get('k0') is not None and cache.get('k2') is not None
+    stats = cache.stats()
+    assert (stats['memory_entries'], stats['memory_bytes'], stats['memory_evictions']) == (2, 2 * SIZE, 1)
+
+
+def test_disk_limit_holds_across_processes(caches, tmp_path):
+    first, second = caches(memory_limit=0), caches(memory_limit=0)
+    first.put('k0', document(0))
+    second.put('k1', document(1))
+    # Reading k0 makes k1 the least recently used entry of both processes
+    assert second.get('k0') == gzip_compress(document(0))
+
+    first.put('k2', document(2))
+    assert sorted(p.name for p in tmp_path.glob('*.json.gz')) == ['k0.json.gz', 'k2.json.gz']
+    assert first.get('k1') is None and second.get('k1') is None
+    assert first.stats()['disk_bytes'] == second.stats()['disk_bytes'] == 2 * SIZE
+
+
+def test_streamed_entries_count_toward_the_disk_limit(caches, tmp_path):
+    cache = caches(memory_limit=0)
+    cache.put('k0', document(0))
+    cache.put('k1', document(1))
+    writer = cache.writer('k2')
+    writer.write(document(2))
+    writer.commit()
+
+    assert not (tmp_path / 'k0.json.gz').exists()
+    assert cache.get('k2') == gzip_compress(document(2))
+    assert cache.stats()['disk_entries'] == 2
+
+
+def test_startup_removes_leftovers_and_indexes_unknown_entries(caches, tmp_path):
+    stale, fresh = tmp_path / 'stale.tmp', tmp_path / 'fresh.tmp'
+    stale.write_bytes(b'partial')
+    fresh.write_bytes(b'being written')
+    os.utime(stale, (time.time() - STALE_TMP_SECONDS - 1,) * 2)
+    (tmp_path / 'old.summary').write_text("uncompressed")
+    (tmp_path / 'k0.json.gz').write_bytes(gzip_compress(document(0)))
+
+    cache = caches()
+    assert not stale.exists() and not (tmp_path / 'old.summary').exists()
+    # Another process may still be writing a recent temporary file
+    assert fresh.exists()
+    assert cache.stats()['disk_entries'] == 1
+    assert cache.get('k0') == gzip_compress(document(0))
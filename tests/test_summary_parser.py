@@ -0,0 +1,49 @@
+import random
+import re
+import time
+
+from summary_parser import FileBlock, iter_file_blocks, split_lines
+
+BLOCK_PATTERN = re.compile(r'# File (.*?)(::.*?)?\n(.*?)# EndFile \1', re.DOTALL)
+
+# At most one header per line: where the first is never closed, the regex would retry at the second
+LINES = ['# File a\n', '# File b::edit-section\n', '# EndFile a\n', 'x # EndFile b y\n', 'text\n',
+         '# EndFile ab\n', '# File ab\n', 'q # EndFile a # File b\n', '# File \n', '# EndFile \n',
+         '# EndFile a::x\n', 'z']
+
+
+def regex_blocks(text):
+    matches = list(BLOCK_PATTERN.finditer(text))
+    # Paths that only close across lines are not supported
+    if any('\n' in (match.group(1) + (match.group(2) or '')) for match in matches):
+        return None
+    return [FileBlock(m.group(1).strip(), m.group(2).strip() if m.group(2) else None, m.group(3).strip())
+            for m in matches]
+
+
+def test_blocks_match_the_regex():
+    rng = random.Random(0)
+    compared = 0
+    for _ in range(20000):
+        text = ''.join(rng.choice(LINES) for _ in range(rng.randint(0, 14)))
+        expected = regex_blocks(text)
+        if expected is None:
+            continue
+        assert list(iter_file_blocks(split_lines(text))) == expected, text
+        compared += 1
+    assert compared > 10000
+
+
+def test_unterminated_headers_are_linear():
+    def parse_time(count):
+        text = ''.join(f"# File path{i}\ncontent\n# EndFile other\n" for i in range(count))
+        times = []
+        for _ in range(3):
+            start = time.perf_counter()
+            assert list(iter_file_blocks(split_lines(text))) == []
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    parse_time(1000)
+    # Rescanning after every unterminated header was quadratic: 30s for 8000 of them
+    assert parse_time(16000) < 8 * max(parse_time(4000), 0.01)
@@ -0,0 +1,71 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import repo_controller as rc
+from token_budget import Tokenizer
+
+FILES = {'a_large.py': "A = 1\n" * 40, 'b_small.py': "B = 1\n", 'c_medium.py': "C = 1\n" * 10}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(rc, 'summary_tokenizer', Tokenizer('heuristic'))
+    with TestClient(rc.app) as client:
+        yield client
+
+
+@pytest.fixture
+def budget(client, github_url, remote):
+    """Summarizes the repository with FILES under a token budget; returns the response body."""
+    remote.commit(FILES)
+    user, repo = rc.extract_repo_info(github_url)
+
+    def summarize(max_tokens, **params):
+        response = client.get('/repo', params={'git_url': github_url, 'max_tokens': max_tokens, **params})
+        assert response.status_code == 200
+        body = response.json()
+        body['files'] = [line.split(' ', 2)[2].removeprefix(f"/{user}/{repo}/")
+                         for line in body['summary'].split('\n') if line.startswith('# File ')]
+        body['omitted_files'] = [entry['path'].removeprefix(f"/{user}/{repo}/") for entry in body['omitted']]
+        return body
+    return summarize
+
+
+def test_omitted_files_are_listed_with_their_cost(budget):
+    full = budget(100_000)
+    assert full['omitted'] == []
+
+    body = budget(full['tokens'] - 1, strategy='smallest')
+    # The largest file goes and the others fit; tokens counts what was included, so the omitted file's cost
+    # is the difference
+    assert body['files'] == ['README.md', 'b_small.py', 'c_medium.py', 'main.py']
+    assert body['omitted_files'] == ['a_large.py']
+    assert body['tokens'] == full['tokens'] - body['omitted'][0]['tokens'] <= body['max_tokens']
+
+
+def test_smallest_and_priority_choose_different_files(budget):
+    full = budget(100_000)
+    large = next(e['tokens'] for e in budget(full['tokens'] - 1, strategy='smallest')['omitted'])
+    limit = full['tokens'] - large
+
+    smallest = budget(limit, strategy='smallest')
+    assert 'a_large.py' in smallest['omitted_files']
+    prioritized = budget(limit, strategy='priority', priority='a_*')
+    assert 'a_large.py' in prioritized['files']
+    assert prioritized['omitted_files'] != [] and 'a_large.py' not in prioritized['omitted_files']
+    # Files are rendered in tree order whichever strategy chose them
+    assert prioritized['files'] == sorted(prioritized['files'])
+
+
+def test_budget_smaller_than_the_header_omits_everything(budget):
+    body = budget(1, strategy='smallest')
+    assert body['files'] == []
+    assert sorted(body['omitted_files']) == sorted(['README.md', 'main.py', *FILES])
+    # The header alone is over budget; it is reported rather than trimmed
+    assert body['tokens'] > body['max_tokens'] == 1
+
+
+def test_unknown_strategy_is_rejected(client, github_url):
+    response = client.get('/repo', params={'git_url': github_url, 'max_tokens': 10, 'strategy': 'largest'})
+    assert response.status_code == 400
+    assert response.json()['detail'] == "strategy must be one of recent, smallest, priority"
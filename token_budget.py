@@ -0,0 +1,150 @@
+"""
+Fits a summary into a token budget.
+
+Every candidate file's cost is the token count of everything it adds to the
+summary: its line in the file list, its `# File` / `# EndFile` markers and
+its rendered content. Content counts are looked up in the blob index by
+blob SHA (and rendering variant and tokenizer), so a blob is tokenized once
+no matter how many commits, branches or repositories contain it. Files are
+then taken greedily in the order of the chosen strategy, skipping any that
+no longer fit, and the rest are reported as omitted.
+"""
+import hashlib
+import io
+import math
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+from blob_index import BlobIndex, text_entries
+from git_objects import BlobReader, TreeEntry, last_changed
+from summarizer import comment_syntax, iter_file_content, matches_any, select_paths, split_patterns
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+STRATEGIES = ('recent', 'smallest', 'priority')
+# How far back the 'recent' strategy looks for each file's latest change
+RECENT_HISTORY_DEPTH = 1000
+
+
+class Tokenizer:
+    """A tiktoken encoding, or (name 'heuristic') an estimate of one token per four characters."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._encoding = None
+        if name != 'heuristic':
+            if tiktoken is None:
+                raise ValueError(f"Tokenizer {name} needs the tiktoken package")
+            self._encoding = tiktoken.get_encoding(name)
+
+    def count(self, text: str) -> int:
+        if self._encoding is None:
+            return math.ceil(len(text) / 4)
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+
+def default_tokenizer_name() -> str:
+    return 'cl100k_base' if tiktoken is not None else 'heuristic'
+
+
+def content_variant(path: str, suppress_comments: bool, line_number: bool) -> str:
+    """Identifies how a file's content is rendered, since that changes its token count."""
+    parts = []
+    syntax = comment_syntax(path) if suppress_comments else None
+    if syntax:
+        parts.append('nocomments:' + hashlib.sha1(repr(syntax).encode()).hexdigest()[:8])
+    if line_number:
+        # Stripped lines keep their numbers in the file
+        parts.append('numbered:source' if syntax else 'numbered')
+    return ','.join(parts) or 'raw'
+
+
+def candidate_entries(git_dir: Path, rev: str, paths: Optional[List[str]], filter_patterns: Optional[str],
+                      exclude_patterns: Optional[str], case_sensitive: bool,
+                      index: Optional[BlobIndex] = None) -> List[TreeEntry]:
+    """The text files a summary of rev (limited to paths) would include, in tree order."""
+    entries = text_entries(git_dir, rev, paths, index)
+    selected = set(select_paths([e.path for e in entries], filter_patterns, exclude_patterns, case_sensitive))
+    return [e for e in entries if e.path in selected]
+
+
+def content_tokens(git_dir: Path, entries: List[TreeEntry], suppress_comments: bool, line_number: bool,
+                   index: BlobIndex, tokenizer: Tokenizer) -> Dict[str, int]:
+    """Token count of each entry's rendered content, by path; blobs missing from the index are counted and added."""
+    by_variant: Dict[str, List[TreeEntry]] = {}
+    for entry in entries:
+        by_variant.setdefault(content_variant(entry.path, suppress_comments, line_number), []).append(entry)
+
+    tokens: Dict[str, int] = {}
+    reader: Optional[BlobReader] = None
+    try:
+        for variant, variant_entries in by_variant.items():
+            known = index.get_tokens([e.sha for e in variant_entries], variant, tokenizer.name)
+            counted = {}
+            for entry in variant_entries:
+                if entry.sha not in known and entry.sha not in counted:
+                    if reader is None:
+                        reader = BlobReader(git_dir)
+                    opener = lambda: io.TextIOWrapper(reader.open(entry.sha), encoding='utf-8', errors='replace',
+                                                      newline='')
+                    text = ''.join(iter_file_content(opener, entry.path, suppress_comments, line_number))
+                    counted[entry.sha] = tokenizer.count(text)
+                tokens[entry.path] = known.get(entry.sha, counted.get(entry.sha))
+            if counted:
+                index.put_tokens(counted.items(), variant, tokenizer.name)
+    finally:
+        if reader is not None:
+            reader.close()
+    return tokens
+
+
+class BudgetPlan(NamedTuple):
+    paths: List[str]
+    tokens: int
+    omitted: List[dict]
+
+
+def plan_summary(git_dir: Path, rev: str, base: str, entries: List[TreeEntry], max_tokens: int, strategy: str,
+                 priority: Optional[str], case_sensitive: bool, suppress_comments: bool, line_number: bool,
+                 index: BlobIndex, tokenizer: Tokenizer) -> BudgetPlan:
+    """Chooses the whole files that fit in max_tokens, by strategy. paths keeps tree order."""
+    tokens = content_tokens(git_dir, entries, suppress_comments, line_number, index, tokenizer)
+    cost = {}
+    for entry in entries:
+        friendly_path = f"{base}/{entry.path}"
+        cost[entry.path] = (tokens[entry.path] + tokenizer.count(f"- {friendly_path}\n")
+                            + tokenizer.count(f"\n# File {friendly_path}\n")
+                            + tokenizer.count(f"\n# EndFile {friendly_path}\n"))
+
+    ordered = [entry.path for entry in entries]
+    if strategy == 'smallest':
+        ordered.sort(key=lambda path: cost[path])
+    elif strategy == 'recent':
+        changed_at = last_changed(git_dir, rev, RECENT_HISTORY_DEPTH)
+        ordered.sort(key=lambda path: -changed_at.get(path, 0))
+    elif strategy == 'priority':
+        patterns = split_patterns(priority)
+
+        def rank(path: str) -> int:
+            for i, pattern in enumerate(patterns):
+                if matches_any(path, [pattern], case_sensitive):
+                    return i
+            return len(patterns)
+
+        ordered.sort(key=rank)
+    else:
+        raise ValueError(f"Unknown strategy: {strategy}")
+
+    used = tokenizer.count("# Code summary\n") + tokenizer.count("\n\n## Files\n\n")
+    included = set()
+    omitted = []
+    for path in ordered:
+        if used + cost[path] <= max_tokens:
+            included.add(path)
+            used += cost[path]
+        else:
+            omitted.append({'path': f"{base}/{path}", 'tokens': cost[path]})
+    return BudgetPlan([entry.path for entry in entries if entry.path in included], used, omitted)